@@ -0,0 +1,261 @@
+"""train.py 的 CPU 基准测试套件
+
+生成合成 YOLO-pose 数据集（与 ExportService 导出格式一致），在 CPU 上用极小模型
+依次计时：飞行前检查、标签校验、训练 epoch 吞吐、VisualValidator、推理延迟，
+结果保存为 JSON 并与基线对比，用于发现版本之间的性能回退。
+
+用法:
+    python scripts/benchmark_train.py --num_train 64 --baseline bench_baseline.json
+    python scripts/benchmark_train.py --save_baseline bench_baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import train
+from train import log_json
+
+BENCH_MODEL_CFG = 'yolov8n-pose.yaml'
+COCO_FLIP_IDX = [0, 1, 2, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15]
+
+def generate_synthetic_dataset(root, num_train, num_val, imgsz, num_kpts=17, max_fish=3, seed=0):
+    """生成合成鱼类姿态数据集：噪声背景上的椭圆目标，关键点沿长轴分布"""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    flip_idx = COCO_FLIP_IDX if num_kpts == 17 else list(range(num_kpts))
+
+    for split, count in (('train', num_train), ('val', num_val)):
+        img_dir = os.path.join(root, 'images', split)
+        label_dir = os.path.join(root, 'labels', split)
+        os.makedirs(img_dir, exist_ok=True)
+        os.makedirs(label_dir, exist_ok=True)
+
+        for i in range(count):
+            h, w = imgsz, int(imgsz * rng.uniform(1.0, 1.8))
+            img = rng.integers(0, 60, (h, w, 3), dtype=np.uint8)
+            img[..., 0] += 80
+            lines = []
+            for _ in range(rng.integers(1, max_fish + 1)):
+                cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.2, 0.8) * h
+                length = rng.uniform(0.15, 0.35) * min(h, w)
+                angle = rng.uniform(0, np.pi)
+                dx, dy = np.cos(angle) * length / 2, np.sin(angle) * length / 2
+                cv2.ellipse(img, (int(cx), int(cy)), (int(length / 2), int(length / 6)),
+                            np.degrees(angle), 0, 360, tuple(int(c) for c in rng.integers(120, 255, 3)), -1)
+
+                t = np.linspace(-1, 1, num_kpts)
+                kx = np.clip(cx + t * dx, 0, w - 1)
+                ky = np.clip(cy + t * dy, 0, h - 1)
+                x1, y1 = max(kx.min() - length / 6, 0), max(ky.min() - length / 6, 0)
+                x2, y2 = min(kx.max() + length / 6, w), min(ky.max() + length / 6, h)
+
+                kpt_line = ' '.join(f"{x / w:.6f} {y / h:.6f} 2" for x, y in zip(kx, ky))
+                lines.append(f"0 {(x1 + x2) / 2 / w:.6f} {(y1 + y2) / 2 / h:.6f} {(x2 - x1) / w:.6f} {(y2 - y1) / h:.6f} {kpt_line}")
+
+            name = f"{i + 1:06d}"
+            cv2.imwrite(os.path.join(img_dir, f"{name}.jpg"), img)
+            with open(os.path.join(label_dir, f"{name}.txt"), 'w') as f:
+                f.write('\n'.join(lines))
+
+    yaml_content = f"""path: {os.path.abspath(root).replace(os.sep, '/')}
+train: images/train
+val: images/val
+
+kpt_shape: [{num_kpts}, 3]
+flip_idx: [{', '.join(str(i) for i in flip_idx)}]
+
+names:
+  0: fish
+"""
+    data_yaml = os.path.join(root, 'data.yaml')
+    with open(data_yaml, 'w', encoding='utf-8') as f:
+        f.write(yaml_content)
+    return data_yaml
+
+def _timed(fn, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return {"seconds": round(float(np.median(times)), 4), "runs": [round(t, 4) for t in times]}, result
+
+def bench_label_check(data_yaml, imgsz):
+    """标签校验：删除 labels/*.cache 后重新构建数据集，触发 ultralytics 全量标签校验"""
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_yolo_dataset
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(data_yaml)
+    label_dir = os.path.join(os.path.dirname(data_yaml), 'labels')
+    for f in os.listdir(label_dir):
+        if f.endswith('.cache'):
+            os.remove(os.path.join(label_dir, f))
+    cfg = get_cfg(overrides={'task': 'pose', 'data': data_yaml, 'imgsz': imgsz})
+    return len(build_yolo_dataset(cfg, data['train'], 8, data, mode='train'))
+
+def bench_train_epochs(data_yaml, args, out_dir):
+    """在 CPU 上用随机初始化的 yolov8n-pose 训练若干 epoch，统计每轮吞吐"""
+    from ultralytics import YOLO
+
+    epoch_times = []
+    state = {}
+
+    def on_epoch_start(trainer):
+        state["start"] = time.perf_counter()
+
+    def on_epoch_end(trainer):
+        epoch_times.append((time.perf_counter() - state["start"], len(trainer.train_loader.dataset)))
+
+    model = YOLO(BENCH_MODEL_CFG)
+    model.add_callback("on_train_epoch_start", on_epoch_start)
+    model.add_callback("on_train_epoch_end", on_epoch_end)
+    model.train(data=data_yaml, epochs=args.epochs, batch=args.batch, imgsz=args.imgsz, device='cpu',
+                workers=args.workers, project=out_dir, name='train', exist_ok=True, pretrained=False,
+                val=False, plots=False, verbose=False, **{k: 0.0 for k in ('mosaic', 'mixup')})
+
+    # 第一轮包含数据加载器与权重初始化预热，有多轮时不计入
+    measured = epoch_times[1:] if len(epoch_times) > 1 else epoch_times
+    total_time = sum(t for t, _ in measured)
+    total_images = sum(n for _, n in measured)
+    return {
+        "epoch_seconds": round(total_time / max(len(measured), 1), 4),
+        "images_per_sec": round(total_images / total_time, 2) if total_time > 0 else 0.0
+    }, os.path.join(out_dir, 'train', 'weights', 'last.pt')
+
+def compare_with_baseline(results, baseline, tolerance):
+    """逐阶段对比耗时；吞吐类指标越大越好，耗时类指标越小越好"""
+    comparison = {}
+    for stage, current in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        key = "images_per_sec" if "images_per_sec" in current else "seconds"
+        if not base.get(key):
+            continue
+        ratio = current[key] / base[key]
+        regressed = ratio < 1 - tolerance if key == "images_per_sec" else ratio > 1 + tolerance
+        comparison[stage] = {
+            "metric": key,
+            "baseline": base[key],
+            "current": current[key],
+            "ratio": round(ratio, 3),
+            "regressed": regressed
+        }
+    return comparison
+
+def run_benchmark_suite(args):
+    import torch
+    import ultralytics
+
+    work_dir = os.path.abspath(args.work_dir)
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+    print(f"🧪 CPU 基准测试: train={args.num_train}, val={args.num_val}, imgsz={args.imgsz}, threads={torch.get_num_threads()}", flush=True)
+
+    results = {
+        "created": time.time(),
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "ultralytics": ultralytics.__version__,
+            "threads": torch.get_num_threads()
+        },
+        "config": {k: getattr(args, k) for k in ('num_train', 'num_val', 'imgsz', 'epochs', 'batch', 'workers', 'repeat')},
+        "stages": {}
+    }
+    stages = results["stages"]
+
+    dataset_root = os.path.join(work_dir, 'dataset')
+    stages["generate_dataset"], data_yaml = _timed(
+        lambda: generate_synthetic_dataset(dataset_root, args.num_train, args.num_val, args.imgsz, seed=args.seed), 1
+    )
+
+    stages["preflight"], ok = _timed(lambda: train.validate_config(SimpleNamespace(data=data_yaml)), args.repeat)
+    if not ok:
+        raise RuntimeError("合成数据集未通过飞行前检查")
+
+    stages["label_check"], _ = _timed(lambda: bench_label_check(data_yaml, args.imgsz), args.repeat)
+
+    start = time.perf_counter()
+    epoch_stats, weights = bench_train_epochs(data_yaml, args, work_dir)
+    stages["train_epoch"] = {**epoch_stats, "total_seconds": round(time.perf_counter() - start, 4)}
+
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    validator = train.VisualValidator(model=model, data_yaml=data_yaml,
+                                      output_dir=os.path.join(work_dir, 'visualizations'), num_samples=3)
+    stages["visual_validator"], _ = _timed(lambda: validator.generate_visualization(epoch=1), args.repeat)
+
+    benchmark = train.PerformanceBenchmark(model=model, device='cpu', imgsz=args.imgsz)
+    latency = benchmark.measure_inference_latency(num_runs=20, warmup=3)
+    stages["inference_latency"] = {"seconds": round(latency["mean_ms"] / 1000, 5), "p95_ms": latency["p95_ms"]}
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results["comparison"] = compare_with_baseline(results, json.load(f), args.tolerance)
+
+    out_path = args.output or os.path.join(work_dir, 'benchmark_results.json')
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        shutil.copyfile(out_path, args.save_baseline)
+
+    log_json({"event": "benchmark_suite", "output": out_path, **results})
+
+    print("\n📊 基准测试结果:", flush=True)
+    for stage, value in stages.items():
+        line = f"   {stage:<20} {value.get('seconds', value.get('epoch_seconds', 0)):10.4f}s"
+        if "images_per_sec" in value:
+            line += f"  ({value['images_per_sec']} 张/秒)"
+        cmp = results.get("comparison", {}).get(stage)
+        if cmp:
+            line += f"  x{cmp['ratio']:.2f} {'⚠️ 回退' if cmp['regressed'] else '✅'}"
+        print(line, flush=True)
+    print(f"\n✅ 结果已保存至 {out_path}", flush=True)
+
+    regressions = [s for s, c in results.get("comparison", {}).items() if c["regressed"]]
+    if regressions and args.fail_on_regression:
+        print(f"❌ 以下阶段性能回退: {', '.join(regressions)}", flush=True)
+        sys.exit(1)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CPU benchmark suite for train.py on a synthetic pose dataset')
+
+    parser.add_argument('--work_dir', type=str, default='bench_run', help='Scratch directory (recreated on each run)')
+    parser.add_argument('--num_train', type=int, default=64, help='Synthetic train images')
+    parser.add_argument('--num_val', type=int, default=16, help='Synthetic val images')
+    parser.add_argument('--imgsz', type=int, default=320, help='Image size for generation and training')
+    parser.add_argument('--epochs', type=int, default=2, help='Training epochs to time (first is treated as warmup)')
+    parser.add_argument('--batch', type=int, default=8, help='Training batch size')
+    parser.add_argument('--workers', type=int, default=0, help='Dataloader workers')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads (0 = default)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions for short stages (median is reported)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic dataset')
+
+    parser.add_argument('--output', type=str, default='', help='Results JSON path (default: <work_dir>/benchmark_results.json)')
+    parser.add_argument('--baseline', type=str, default='', help='Baseline results JSON to compare against')
+    parser.add_argument('--save_baseline', type=str, default='', help='Also save these results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Relative slowdown tolerated before flagging a regression')
+    parser.add_argument('--fail_on_regression', action='store_true', help='Exit with code 1 if any stage regressed')
+
+    args = parser.parse_args()
+
+    train.run_tool(run_benchmark_suite, args)
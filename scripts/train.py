@@ -1,4 +1,5 @@
 import argparse
+import contextlib
 import sys
 import os
 import json
@@ -13,20 +14,42 @@ from pathlib import Path
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 from ultralytics import YOLO
+from ultralytics.data.dataset import YOLODataset
 
 GPU_MONITOR_INTERVAL = 2.0
 GPU_MEMORY_WARNING_THRESHOLD = 0.85
 GPU_UTIL_WARNING_THRESHOLD = 0.30
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+DATASET_MANIFEST_FILE = 'dataset_manifest.json'
+WEIGHTS_REFS_FILE = 'weights_refs.json'
+WEIGHTS_STORE_REGISTRY = 'experiments.json'
+PACK_INDEX_FILE = 'index.json'
+POST_TRAIN_CACHE_DIR = 'post_train'
+IMPORTANCE_LOSSES_FILE = 'importance_losses.npy'
+
 PARENT_PID = os.getppid()
 CHECK_INTERVAL = 10
 should_stop = False
+current_job_id = None
+# 线程局部：训练后阶段在各自线程中收集 log_json 事件，命中缓存时重放
+_log_capture = threading.local()
+# print 会把内容与换行分两次写出，多线程时 __JSON_LOG__ 行可能被插入其它输出
+_log_lock = threading.Lock()
 
 def log_json(data):
-    print(f"__JSON_LOG__{json.dumps(data)}", flush=True)
+    captured = getattr(_log_capture, 'events', None)
+    if captured is not None:
+        captured.append(data)
+    if current_job_id is not None:
+        data = {**data, "job_id": current_job_id}
+    line = f"__JSON_LOG__{json.dumps(data)}\n"
+    with _log_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
 
 def check_parent_alive():
-    """定期检查父进程是否存活，如果父进程已退出则自动终止自身"""
+    """检查父进程是否存活，如果父进程已退出则设置停止标志"""
     global should_stop
     try:
         if PARENT_PID == 1:
@@ -52,44 +75,194 @@ def check_parent_alive():
         print(f"⚠️ 检查父进程状态时出错: {e}", flush=True)
         return True
 
+class TrainingStopped(Exception):
+    """协作式取消：在训练回调中抛出，用于结束 model.train"""
+
+STOP_EXIT_CODE = 143
+stop_timeout = 60.0
+stop_reason = None
+_stop_lock = threading.Lock()
+_stop_generation = 0
+# worker 模式：保护 current_job_id 的切换，使 cancel 与任务结束互斥
+_job_lock = threading.Lock()
+
+def _stop_watchdog(generation):
+    time.sleep(stop_timeout)
+    if generation != _stop_generation:
+        # worker 模式下该停止请求对应的任务已经结束
+        return
+    print(f"⚠️ 停止请求 {stop_timeout:.0f}s 内未完成，强制退出", flush=True)
+    log_json({"event": "stop_timeout", "reason": stop_reason, "timeout_s": stop_timeout})
+    os._exit(STOP_EXIT_CODE)
+
+def request_stop(reason):
+    """设置停止标志并启动看门狗，保证进程在 stop_timeout 内退出"""
+    global should_stop, stop_reason
+    with _stop_lock:
+        should_stop = True
+        if stop_reason is not None:
+            return
+        stop_reason = reason
+    threading.Thread(target=_stop_watchdog, args=(_stop_generation,), daemon=True).start()
+
+def reset_stop_state():
+    """worker 模式在任务之间清除停止状态，并使尚在等待的看门狗失效"""
+    global should_stop, stop_reason, _stop_generation
+    with _stop_lock:
+        should_stop = False
+        stop_reason = None
+        _stop_generation += 1
+
+def _set_parent_death_signal():
+    """Linux: 父进程退出时由内核直接向本进程发送 SIGTERM"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        import ctypes
+        PR_SET_PDEATHSIG = 1
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM) != 0:
+            return False
+        # prctl 生效前父进程可能已经退出
+        return os.getppid() == PARENT_PID
+    except Exception:
+        return False
+
 def parent_monitor_thread():
-    """后台线程：定期检查父进程是否存活"""
-    global should_stop
-    print(f"🔄 父进程监控线程已启动 (父进程 PID: {PARENT_PID}, 检查间隔: {CHECK_INTERVAL}s)", flush=True)
-    
-    while not should_stop:
-        time.sleep(CHECK_INTERVAL)
-        if should_stop:
-            break
-        if not check_parent_alive():
-            log_json({
-                "event": "parent_exit",
-                "message": "父进程已退出，训练即将停止"
-            })
-            break
-    
+    """后台线程：事件驱动地等待父进程退出（Linux 用 PDEATHSIG，其余平台阻塞在 psutil wait 上）"""
+    if not check_parent_alive():
+        log_json({
+            "event": "parent_exit",
+            "message": "父进程已退出，训练即将停止"
+        })
+        request_stop("parent_exit")
+        return
+
+    if _set_parent_death_signal():
+        print(f"🔄 父进程监控已启用 (PID: {PARENT_PID}, PR_SET_PDEATHSIG)", flush=True)
+        return
+
+    print(f"🔄 父进程监控线程已启动 (父进程 PID: {PARENT_PID})", flush=True)
+    try:
+        psutil.Process(PARENT_PID).wait()
+    except psutil.NoSuchProcess:
+        pass
+    except Exception as e:
+        print(f"⚠️ 无法等待父进程 ({e})，改为每 {CHECK_INTERVAL}s 轮询", flush=True)
+        while not should_stop and check_parent_alive():
+            time.sleep(CHECK_INTERVAL)
+        if should_stop and stop_reason is not None:
+            return
+
+    log_json({
+        "event": "parent_exit",
+        "message": "父进程已退出，训练即将停止"
+    })
+    request_stop("parent_exit")
     print("🔄 父进程监控线程已退出", flush=True)
 
+_parent_monitor_started = False
+
+def start_parent_monitor():
+    global _parent_monitor_started
+    if _parent_monitor_started:
+        return
+    _parent_monitor_started = True
+    threading.Thread(target=parent_monitor_thread, daemon=True).start()
+
 def signal_handler(signum, frame):
-    """处理终止信号"""
-    global should_stop
+    """处理终止信号；再次收到信号时立即退出"""
+    if stop_reason is not None:
+        print(f"收到信号 {signum}，强制退出", flush=True)
+        os._exit(STOP_EXIT_CODE)
     print(f"收到信号 {signum}，正在停止训练...", flush=True)
-    should_stop = True
+    request_stop(f"signal_{signum}")
+
+def write_training_checkpoint(trainer, path, epoch, **extra):
+    """按 ultralytics save_model 的格式序列化训练状态到 path（先写临时文件再替换）。
+    不经过 trainer.save_model，因此不会顺带改写 best.pt"""
+    import io
+    from copy import deepcopy
+    from datetime import datetime
+    import torch
+    from ultralytics import __version__
+
+    buffer = io.BytesIO()
+    torch.save({
+        "epoch": epoch,
+        "best_fitness": trainer.best_fitness,
+        "model": None,
+        "ema": deepcopy(trainer.ema.ema).half(),
+        "updates": trainer.ema.updates,
+        "optimizer": deepcopy(trainer.optimizer.state_dict()),
+        "train_args": vars(trainer.args),
+        "train_metrics": {**(trainer.metrics or {}), "fitness": trainer.fitness},
+        "date": datetime.now().isoformat(),
+        "version": __version__,
+        **extra
+    }, buffer)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp, path)
+    return str(path)
+
+def save_resumable_checkpoint(trainer):
+    """只写入可续训的 last.pt，best.pt 保持为最近一次验证选出的权重。
+    epoch 记为上一轮，使续训从当前未完成的 epoch 重新开始；
+    第 1 个 epoch 内停止时记为 -1 并打上标记，续训时改为重新开始训练"""
+    try:
+        if trainer.epoch == 0:
+            return write_training_checkpoint(trainer, trainer.last, -1, stopped_in_first_epoch=True)
+        return write_training_checkpoint(trainer, trainer.last, trainer.epoch - 1)
+    except Exception as e:
+        print(f"⚠️ 保存检查点失败: {e}", flush=True)
+        return None
+
+def restart_if_stopped_in_first_epoch(args):
+    """ultralytics 无法从 epoch=-1 的检查点续训（start_epoch 必须大于 0）：
+    此时关闭 --resume，以原始基础模型重新开始第 1 个 epoch"""
+    if not os.path.isfile(args.model):
+        return
+    import torch
+    try:
+        checkpoint = torch.load(args.model, map_location='cpu', weights_only=False)
+    except Exception:
+        return
+    if not isinstance(checkpoint, dict) or not checkpoint.get("stopped_in_first_epoch"):
+        return
+    base_model = checkpoint.get("train_args", {}).get("model") or args.model
+    print(f"↩️ 上次在第 1 个 epoch 内停止，没有可续训的完整 epoch，改为从 {base_model} 重新开始训练", flush=True)
+    log_json({"event": "resume_restart", "checkpoint": args.model, "model": base_model})
+    args.resume = False
+    args.model = base_model
+
+def _stop_training(trainer, checkpoint):
+    log_json({
+        "event": "stopped",
+        "reason": stop_reason,
+        "epoch": trainer.epoch + 1,
+        "epochs": trainer.epochs,
+        "checkpoint": checkpoint,
+        "resumable": checkpoint is not None
+    })
+    raise TrainingStopped(stop_reason)
+
+def on_train_batch_end_check_stop(trainer):
+    if should_stop:
+        print("🛑 当前 batch 已完成，正在保存检查点并停止...", flush=True)
+        _stop_training(trainer, save_resumable_checkpoint(trainer))
+
+def on_fit_epoch_end_check_stop(trainer):
+    # 此时本轮验证与 save_model 已完成，last.pt 即为完整 epoch 的检查点
+    if should_stop:
+        _stop_training(trainer, str(trainer.last) if os.path.exists(trainer.last) else None)
 
 signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
+# 按顺序匹配：具体的错误（显存不足、cuDNN 等）必须排在通用的 "cuda"/"GPU" 关键词之前
 ERROR_MAPPINGS = {
-    "cuda": {
-        "keywords": ["cuda", "CUDA", "GPU", "gpu device"],
-        "type": "hardware",
-        "title": "GPU 相关错误",
-        "suggestions": [
-            "请确认已正确安装 NVIDIA 显卡驱动",
-            "检查 PyTorch 是否支持 CUDA",
-            "尝试将 device 参数改为 'cpu' 使用 CPU 模式训练"
-        ]
-    },
     "cuda_oom": {
         "keywords": ["out of memory", "OOM", "CUDA out of memory", "RuntimeError: CUDA out of memory"],
         "type": "oom",
@@ -141,6 +314,16 @@ ERROR_MAPPINGS = {
             "减小 batch_size 参数",
             "检查是否有内存泄漏"
         ]
+    },
+    "cuda": {
+        "keywords": ["cuda", "CUDA", "GPU", "gpu device"],
+        "type": "hardware",
+        "title": "GPU 相关错误",
+        "suggestions": [
+            "请确认已正确安装 NVIDIA 显卡驱动",
+            "检查 PyTorch 是否支持 CUDA",
+            "尝试将 device 参数改为 'cpu' 使用 CPU 模式训练"
+        ]
     }
 }
 
@@ -187,6 +370,142 @@ def detect_hardware():
     
     return result
 
+def cpu_supports_bf16():
+    """CPU 是否有原生 bf16 指令（AVX512-BF16 / AMX），没有时 bf16 autocast 反而更慢"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def plan_cpu_threads(requested_workers):
+    """按物理核数在数据加载 worker 与计算线程之间分配 CPU"""
+    physical = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    if hasattr(os, 'sched_getaffinity'):
+        physical = min(physical, len(os.sched_getaffinity(0)))
+
+    workers = requested_workers if requested_workers > 0 else min(8, physical // 4)
+    compute = max(1, physical - workers)
+    return {
+        "physical_cores": physical,
+        "workers": workers,
+        "intra_op_threads": compute,
+        "inter_op_threads": min(2, compute)
+    }
+
+def measure_train_throughput(nn_model, batch, imgsz, channels_last=False, bf16=False, steps=2, device='cpu'):
+    """在随机输入上执行前向+反向，返回每秒处理的图片数；imgsz 可以是整数或 (h, w)"""
+    import copy
+    import torch
+
+    device = torch.device(device)
+    h, w = (imgsz, imgsz) if isinstance(imgsz, int) else imgsz
+    net = copy.deepcopy(nn_model).float().train().to(device)
+    for p in net.parameters():
+        p.requires_grad_(True)
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    net = net.to(memory_format=memory_format)
+    x = torch.rand(batch, 3, h, w, device=device).contiguous(memory_format=memory_format)
+
+    def flatten_sum(out):
+        if isinstance(out, (list, tuple)):
+            return sum(flatten_sum(o) for o in out)
+        return out.float().sum()
+
+    elapsed = 0.0
+    for step in range(steps + 1):
+        start = time.perf_counter()
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+            loss = flatten_sum(net(x))
+        loss.backward()
+        net.zero_grad(set_to_none=True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        if step > 0:
+            elapsed += time.perf_counter() - start
+    return round(batch * steps / elapsed, 2) if elapsed > 0 else 0.0
+
+def configure_cpu_training(model, args):
+    """--cpu_optimize：分配线程、测量优化前后吞吐，返回供训练器使用的配置"""
+    import torch
+
+    plan = plan_cpu_threads(args.workers)
+    plan["channels_last"] = True
+    plan["bf16"] = cpu_supports_bf16()
+
+    bench_batch = max(1, min(args.batch, 4))
+    before = measure_train_throughput(model.model, bench_batch, args.imgsz)
+
+    torch.set_num_threads(plan["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(plan["inter_op_threads"])
+    except RuntimeError:
+        # 进程内已启动过 inter-op 并行任务时不允许再修改
+        plan["inter_op_threads"] = torch.get_num_interop_threads()
+    args.workers = plan["workers"]
+
+    after = measure_train_throughput(model.model, bench_batch, args.imgsz,
+                                     channels_last=True, bf16=plan["bf16"])
+
+    log_json({
+        "event": "cpu_optimize",
+        **plan,
+        "bench_batch": bench_batch,
+        "images_per_sec_before": before,
+        "images_per_sec_after": after,
+        "speedup": round(after / before, 3) if before > 0 else None
+    })
+    print(f"🧮 CPU 优化: {plan['physical_cores']} 物理核 -> {plan['intra_op_threads']} 计算线程 + {plan['workers']} 加载 worker, "
+          f"channels_last, bf16={'开' if plan['bf16'] else '关（CPU 不支持）'}", flush=True)
+    print(f"   训练吞吐: {before} -> {after} 张/秒", flush=True)
+    return plan
+
+def make_cpu_optimized_trainer(plan, base_cls=None):
+    """返回应用 CPU 优化配置的训练器：保留 worker 分配、channels_last 权重、仅前向与损失计算使用 bf16 autocast"""
+    import functools
+    import torch
+    from ultralytics.models.yolo.pose import PoseTrainer
+    from ultralytics.utils.torch_utils import de_parallel
+
+    base_cls = base_cls or PoseTrainer
+
+    class CPUOptimizedPoseTrainer(base_cls):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            # ultralytics 在 CPU 上会把 workers 强制为 0，这里恢复按核数分配的值
+            self.args.workers = plan["workers"]
+            self.add_callback("on_train_start", self._to_channels_last)
+            if plan["bf16"]:
+                self.add_callback("on_train_start", self._wrap_bf16_forward)
+                self.add_callback("on_train_end", self._unwrap_bf16_forward)
+
+        @staticmethod
+        def _to_channels_last(trainer):
+            trainer.model.to(memory_format=torch.channels_last)
+
+        @staticmethod
+        def _wrap_bf16_forward(trainer):
+            # 训练时 model(batch) 在 forward 内完成预测与损失；只包住这一步，
+            # 反向传播、优化器与 EMA 更新保持 fp32。回调会随 OOM 重试重复注册，已包装时跳过
+            model = de_parallel(trainer.model)
+            if 'forward' in vars(model):
+                return
+            forward = model.forward
+
+            @functools.wraps(forward)
+            def bf16_forward(*a, **kw):
+                with torch.autocast('cpu', dtype=torch.bfloat16):
+                    return forward(*a, **kw)
+
+            model.forward = bf16_forward
+
+        @staticmethod
+        def _unwrap_bf16_forward(trainer):
+            vars(de_parallel(trainer.model)).pop('forward', None)
+
+    return CPUOptimizedPoseTrainer
+
 def classify_error(error_msg):
     """根据错误信息分类并返回处理建议"""
     error_lower = error_msg.lower()
@@ -276,6 +595,27 @@ def export_model(model, args, model_path):
         })
         return None
 
+def extract_val_metrics(val_results):
+    """从 model.val() 结果中提取 box / pose 主要指标"""
+    metrics = {}
+
+    if hasattr(val_results, 'box'):
+        box_metrics = val_results.box
+        metrics = {
+            "mAP50": float(getattr(box_metrics, 'map50', 0)),
+            "mAP50-95": float(getattr(box_metrics, 'map', 0)),
+            "precision": float(getattr(box_metrics, 'mp', 0)),
+            "recall": float(getattr(box_metrics, 'mr', 0)),
+            "f1": float(getattr(box_metrics, 'mf', 0)) if hasattr(box_metrics, 'mf') else 0.0
+        }
+
+    if hasattr(val_results, 'pose'):
+        pose_metrics = val_results.pose
+        metrics["pose_mAP50"] = float(getattr(pose_metrics, 'map50', 0)) if hasattr(pose_metrics, 'map50') else 0.0
+        metrics["pose_mAP50-95"] = float(getattr(pose_metrics, 'map', 0)) if hasattr(pose_metrics, 'map') else 0.0
+
+    return metrics
+
 def validate_model(model, args, model_path):
     """训练完成后执行模型验证，生成评估指标、混淆矩阵和 PR 曲线"""
     try:
@@ -298,21 +638,8 @@ def validate_model(model, args, model_path):
         }
         
         # 提取主要评估指标
-        if hasattr(val_results, 'box'):
-            box_metrics = val_results.box
-            validation_data["metrics"] = {
-                "mAP50": float(getattr(box_metrics, 'map50', 0)),
-                "mAP50-95": float(getattr(box_metrics, 'map', 0)),
-                "precision": float(getattr(box_metrics, 'mp', 0)),
-                "recall": float(getattr(box_metrics, 'mr', 0)),
-                "f1": float(getattr(box_metrics, 'mf', 0)) if hasattr(box_metrics, 'mf') else 0.0
-            }
-        
-        if hasattr(val_results, 'pose'):
-            pose_metrics = val_results.pose
-            validation_data["metrics"]["pose_mAP50"] = float(getattr(pose_metrics, 'map50', 0)) if hasattr(pose_metrics, 'map50') else 0.0
-            validation_data["metrics"]["pose_mAP50-95"] = float(getattr(pose_metrics, 'map', 0)) if hasattr(pose_metrics, 'map') else 0.0
-        
+        validation_data["metrics"] = extract_val_metrics(val_results)
+
         # 生成混淆矩阵和 PR 曲线的路径
         results_dir = os.path.join(args.project, args.name)
         
@@ -362,6 +689,260 @@ def format_user_friendly_error(error_msg):
         "action": "请根据建议调整后重试"
     }
 
+def load_data_config(data_yaml):
+    import yaml
+    with open(data_yaml, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+def resolve_split_path(data_config, split):
+    """按 data.yaml 的 path 字段解析 train/val/test 路径"""
+    split_path = data_config.get(split)
+    if not split_path:
+        return None
+    if not os.path.isabs(split_path):
+        split_path = os.path.join(data_config.get('path', ''), split_path)
+    return split_path
+
+def list_split_images(split_path):
+    """列出某个划分下的全部图片，支持目录或图片列表 txt"""
+    if not split_path or not os.path.exists(split_path):
+        return []
+    if os.path.isfile(split_path):
+        with open(split_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(
+        os.path.join(split_path, f)
+        for f in os.listdir(split_path)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def image_to_label_path(img_path):
+    """YOLO 约定：.../images/xxx.jpg -> .../labels/xxx.txt"""
+    sep = os.sep
+    img_path = os.path.normpath(img_path)
+    images_dir = f"{sep}images{sep}"
+    if images_dir in img_path:
+        head, tail = img_path.rsplit(images_dir, 1)
+        img_path = f"{head}{sep}labels{sep}{tail}"
+    return os.path.splitext(img_path)[0] + '.txt'
+
+def write_derived_data_yaml(data_config, out_path, **splits):
+    """基于原 data.yaml 生成派生配置（保留 kpt_shape / flip_idx / names）"""
+    import yaml
+    derived = {k: v for k, v in data_config.items() if k not in ('train', 'val', 'test')}
+    for split in ('train', 'val', 'test'):
+        value = splits.get(split, resolve_split_path(data_config, split))
+        if value:
+            derived[split] = os.path.abspath(value)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(derived, f, allow_unicode=True, sort_keys=False)
+    return out_path
+
+def write_image_list(image_paths, out_path):
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(os.path.abspath(p) for p in image_paths))
+    return out_path
+
+def file_sha256(path, chunk_size=1 << 20):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def weights_hash(model_path):
+    """权重内容哈希；对 yolov8n-pose.pt 这类未下载的官方名称退化为名称哈希"""
+    import hashlib
+    if os.path.isfile(model_path):
+        return file_sha256(model_path)
+    return hashlib.sha256(model_path.encode('utf-8')).hexdigest()
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _write_json_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def _blob_path(store_dir, digest):
+    return os.path.join(store_dir, 'blobs', digest[:2], f"{digest}.pt")
+
+def _link_blob(blob, path):
+    """以链接方式把 blob 放到 path：优先硬链接，跨文件系统退回符号链接，都不支持时复制"""
+    import shutil
+    # 已是同一 inode 时 rename 不做任何事，会留下 .tmp
+    if os.path.exists(path) and os.path.samefile(blob, path):
+        return "hardlink"
+    tmp = f"{path}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(blob, tmp)
+        mode = "hardlink"
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(blob), tmp)
+            mode = "symlink"
+        except OSError:
+            shutil.copyfile(blob, tmp)
+            mode = "copy"
+    os.replace(tmp, path)
+    return mode
+
+def _register_experiment(store_dir, run_dir):
+    registry_path = os.path.join(store_dir, WEIGHTS_STORE_REGISTRY)
+    experiments = _read_json(registry_path, [])
+    run_dir = os.path.abspath(run_dir)
+    if run_dir not in experiments:
+        experiments.append(run_dir)
+        _write_json_atomic(registry_path, experiments)
+
+def intern_weights(run_dir, store_dir):
+    """把实验 weights/*.pt 移入内容寻址存储，原路径替换为指向 blob 的链接；相同内容只保存一份"""
+    import shutil
+
+    weights_dir = os.path.join(run_dir, 'weights')
+    if not os.path.isdir(weights_dir):
+        return None
+    refs_path = os.path.join(weights_dir, WEIGHTS_REFS_FILE)
+    refs = _read_json(refs_path, {}).get("files", {})
+    stats = {"stored": 0, "deduplicated": 0, "bytes_saved": 0}
+
+    for name in sorted(os.listdir(weights_dir)):
+        path = os.path.join(weights_dir, name)
+        if not name.endswith('.pt') or not os.path.isfile(path):
+            continue
+        digest = file_sha256(path)
+        blob = _blob_path(store_dir, digest)
+        if refs.get(name) == digest and os.path.exists(blob) and os.path.samefile(path, blob):
+            continue
+
+        if os.path.exists(blob):
+            stats["deduplicated"] += 1
+            stats["bytes_saved"] += os.path.getsize(path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(path, blob)
+            except OSError:
+                shutil.copyfile(path, f"{blob}.tmp")
+                os.replace(f"{blob}.tmp", blob)
+            stats["stored"] += 1
+        _link_blob(blob, path)
+        refs[name] = digest
+
+    _write_json_atomic(refs_path, {"store": os.path.abspath(store_dir), "files": refs})
+    _register_experiment(store_dir, run_dir)
+    log_json({"event": "weights_interned", "run_dir": run_dir, "store": store_dir, **stats})
+    print(f"🗄️ 权重已入库: 新增 {stats['stored']} 个, 复用 {stats['deduplicated']} 个, "
+          f"节省 {stats['bytes_saved'] / 1024 / 1024:.1f} MB", flush=True)
+    return stats
+
+def detach_weights(run_dir):
+    """训练会就地覆盖 last.pt / best.pt，开始写入前把链接替换为私有副本（写时复制）；
+    没有 weights_refs.json 时什么都不做"""
+    import shutil
+
+    weights_dir = os.path.join(run_dir, 'weights')
+    refs_path = os.path.join(weights_dir, WEIGHTS_REFS_FILE)
+    refs = _read_json(refs_path, None)
+    if not refs:
+        return
+    for name in refs.get("files", {}):
+        path = os.path.join(weights_dir, name)
+        if os.path.exists(path):
+            shutil.copyfile(path, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+    os.remove(refs_path)
+
+def gc_weights_store(args):
+    """删除没有任何实验引用的 blob"""
+    if not args.weights_store:
+        raise ValueError("--weights_gc 需要同时指定 --weights_store")
+    store_dir = args.weights_store
+    registry_path = os.path.join(store_dir, WEIGHTS_STORE_REGISTRY)
+    referenced, alive = set(), []
+    for run_dir in _read_json(registry_path, []):
+        weights_dir = os.path.join(run_dir, 'weights')
+        refs = _read_json(os.path.join(weights_dir, WEIGHTS_REFS_FILE), None)
+        if not refs:
+            continue
+        alive.append(run_dir)
+        for name, digest in refs.get("files", {}).items():
+            if os.path.exists(os.path.join(weights_dir, name)):
+                referenced.add(digest)
+
+    removed, freed, kept = 0, 0, 0
+    blobs_root = os.path.join(store_dir, 'blobs')
+    for root, _, files in os.walk(blobs_root):
+        for f in files:
+            blob = os.path.join(root, f)
+            # 仍有硬链接的 blob 删除也释放不了空间，一并保留
+            if f[:-3] in referenced or os.stat(blob).st_nlink > 1:
+                kept += 1
+                continue
+            freed += os.path.getsize(blob)
+            os.remove(blob)
+            removed += 1
+
+    if os.path.isdir(store_dir):
+        _write_json_atomic(registry_path, alive)
+    log_json({"event": "weights_gc", "store": store_dir, "removed": removed, "kept": kept,
+              "bytes_freed": freed, "experiments": len(alive)})
+    print(f"🧹 权重存储回收: 删除 {removed} 个 blob，释放 {freed / 1024 / 1024:.1f} MB，保留 {kept} 个", flush=True)
+
+def copy_experiment(args):
+    """复制实验目录：权重以链接引用同一 blob，不占用额外空间"""
+    import shutil
+
+    if not args.weights_store:
+        raise ValueError("--copy_experiment 需要同时指定 --weights_store")
+    src_dir = os.path.join(args.project, args.copy_experiment)
+    dst_dir = os.path.join(args.project, args.name)
+    if not os.path.isdir(src_dir):
+        raise FileNotFoundError(f"找不到实验目录: {src_dir}")
+    if os.path.exists(dst_dir):
+        raise FileExistsError(f"目标实验已存在: {dst_dir}")
+
+    intern_weights(src_dir, args.weights_store)
+    src_refs = _read_json(os.path.join(src_dir, 'weights', WEIGHTS_REFS_FILE), {}).get("files", {})
+
+    def copy_entry(src, dst):
+        rel = os.path.relpath(src, src_dir).replace(os.sep, '/')
+        name = os.path.basename(src)
+        if rel == f"weights/{name}" and name in src_refs:
+            return _link_blob(_blob_path(args.weights_store, src_refs[name]), dst)
+        if rel == f"weights/{WEIGHTS_REFS_FILE}":
+            return None
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(src_dir, dst_dir, copy_function=copy_entry)
+    if src_refs:
+        _write_json_atomic(os.path.join(dst_dir, 'weights', WEIGHTS_REFS_FILE),
+                           {"store": os.path.abspath(args.weights_store), "files": src_refs})
+        _register_experiment(args.weights_store, dst_dir)
+
+    log_json({"event": "experiment_copied", "source": src_dir, "destination": dst_dir, "linked_weights": len(src_refs)})
+    print(f"📋 实验已复制: {src_dir} -> {dst_dir}（{len(src_refs)} 个权重文件以链接共享）", flush=True)
+
+def load_flip_idx(data_yaml, num_keypoints):
+    try:
+        flip_idx = load_data_config(data_yaml).get('flip_idx')
+        if flip_idx and len(flip_idx) == num_keypoints:
+            return list(flip_idx)
+    except Exception:
+        pass
+    return list(range(num_keypoints))
+
 class GPUMonitor:
     def __init__(self, device_id=0):
         self.device_id = device_id
@@ -499,6 +1080,180 @@ class GPUMonitor:
             "monitoring_duration_samples": len(self.history)
         }
 
+class StackSampler:
+    """py-spy 式采样：后台线程定期抓取目标线程的 Python 调用栈，开销与调用次数无关"""
+
+    def __init__(self, thread_id, interval=0.005):
+        from collections import Counter
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def top_functions(self, n):
+        from collections import Counter
+        self_counts, total_counts = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += count
+            for f in set(frames):
+                total_counts[f] += count
+        total = max(sum(self.stacks.values()), 1)
+        return [
+            {"function": f, "self_pct": round(c / total * 100, 2), "total_pct": round(total_counts[f] / total * 100, 2)}
+            for f, c in self_counts.most_common(n)
+        ]
+
+class HotPathProfiler:
+    """在一个窗口内同时采集 torch.profiler（Chrome trace）与 Python 调用栈采样，
+    结束时写入 out_dir 并发送带热点算子 / 函数排行的 profile_ready 事件"""
+
+    def __init__(self, phase, out_dir, top_n=15, use_cuda=False):
+        self.phase = phase
+        self.out_dir = out_dir
+        self.top_n = top_n
+        self.use_cuda = use_cuda
+        self.torch_profiler = None
+        self.sampler = None
+        self.start_time = None
+
+    def start(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if self.use_cuda and torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.torch_profiler = profile(activities=activities)
+        self.torch_profiler.start()
+        self.sampler = StackSampler(threading.get_ident())
+        self.sampler.start()
+        self.start_time = time.time()
+        print(f"🔬 开始性能采集 ({self.phase})", flush=True)
+
+    def stop(self, **extra):
+        if self.torch_profiler is None:
+            return None
+        import torch
+        if self.use_cuda and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.sampler.stop()
+        self.torch_profiler.stop()
+        duration = time.time() - self.start_time
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        trace_path = os.path.join(self.out_dir, f"{self.phase}_trace.json")
+        stacks_path = os.path.join(self.out_dir, f"{self.phase}_stacks.folded")
+        self.torch_profiler.export_chrome_trace(trace_path)
+        with open(stacks_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        events = list(self.torch_profiler.key_averages())
+        device_attr = None
+        if self.use_cuda and events:
+            device_attr = next((a for a in ('self_device_time_total', 'self_cuda_time_total') if hasattr(events[0], a)), None)
+        sort_attr = device_attr if device_attr and any(getattr(e, device_attr, 0) for e in events) else 'self_cpu_time_total'
+        top_ops = [
+            {
+                "name": e.key,
+                "calls": e.count,
+                "self_cpu_ms": round(e.self_cpu_time_total / 1000, 3),
+                "cpu_total_ms": round(e.cpu_time_total / 1000, 3),
+                **({"self_device_ms": round(getattr(e, device_attr, 0) / 1000, 3)} if device_attr else {})
+            }
+            for e in sorted(events, key=lambda e: getattr(e, sort_attr, 0), reverse=True)[:self.top_n]
+        ]
+
+        report = {
+            "event": "profile_ready",
+            "phase": self.phase,
+            "duration_s": round(duration, 2),
+            "trace": trace_path,
+            "stacks": stacks_path,
+            "samples": sum(self.sampler.stacks.values()),
+            "top_ops": top_ops,
+            "top_functions": self.sampler.top_functions(self.top_n),
+            **extra
+        }
+        log_json(report)
+        print(f"🔬 性能采集完成 ({self.phase}): {trace_path}", flush=True)
+        for op in top_ops[:5]:
+            print(f"   {op['name']:<40} {op['self_cpu_ms']:10.2f}ms x{op['calls']}", flush=True)
+        self.torch_profiler = None
+        return report
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+class TrainingProfiler:
+    """--profile：在第 start_iter 个训练 iteration 开始采集，持续 num_iters 个 iteration"""
+
+    def __init__(self, out_dir, start_iter, num_iters, top_n, use_cuda):
+        self.profiler = HotPathProfiler('train', out_dir, top_n, use_cuda)
+        self.start_iter = start_iter
+        self.num_iters = num_iters
+        self.iteration = 0
+        self.active = False
+        self.done = False
+
+    def on_train_batch_start(self, trainer):
+        if not self.done and not self.active and self.iteration == self.start_iter:
+            self.profiler.start()
+            self.active = True
+
+    def on_train_batch_end(self, trainer):
+        self.iteration += 1
+        if self.active and self.iteration >= self.start_iter + self.num_iters:
+            self.finish(trainer)
+
+    def on_train_end(self, trainer):
+        if self.active:
+            self.finish(trainer)
+
+    def finish(self, trainer):
+        self.active = False
+        self.done = True
+        self.profiler.stop(
+            iterations=self.iteration - self.start_iter,
+            epoch=trainer.epoch + 1,
+            batch_size=trainer.batch_size,
+            imgsz=trainer.args.imgsz
+        )
+
+def profile_benchmark(args, out_dir):
+    """--profile 时包裹 PerformanceBenchmark 运行，否则不做任何事"""
+    from contextlib import nullcontext
+    if not getattr(args, 'profile', False):
+        return nullcontext()
+    return HotPathProfiler('inference', out_dir, args.profile_top, use_cuda=args.device != 'cpu')
+
 class PerformanceBenchmark:
     def __init__(self, model, device='0', imgsz=640):
         self.model = model
@@ -518,7 +1273,7 @@ class PerformanceBenchmark:
         
         for _ in range(warmup):
             try:
-                _ = self.model.predict(dummy_input, verbose=False)
+                _ = self.model.predict(dummy_input, device=self.device, verbose=False)
             except:
                 pass
         
@@ -541,7 +1296,7 @@ class PerformanceBenchmark:
             
             inference_start = time.perf_counter()
             try:
-                _ = self.model.predict(dummy_input, verbose=False)
+                _ = self.model.predict(dummy_input, device=self.device, verbose=False)
             except:
                 pass
             
@@ -593,7 +1348,7 @@ class PerformanceBenchmark:
                 
                 for _ in range(5):
                     try:
-                        _ = self.model.predict(dummy_input, verbose=False)
+                        _ = self.model.predict(dummy_input, device=self.device, verbose=False)
                     except:
                         pass
                 
@@ -604,7 +1359,7 @@ class PerformanceBenchmark:
                 for _ in range(num_runs):
                     start = time.perf_counter()
                     try:
-                        _ = self.model.predict(dummy_input, verbose=False)
+                        _ = self.model.predict(dummy_input, device=self.device, verbose=False)
                     except:
                         continue
                     
@@ -839,6 +1594,8 @@ def get_per_keypoint_metrics(model, data_yaml, device='0'):
 gpu_monitor = None
 visual_validator = None
 performance_benchmark = None
+control_channel = None
+viz_interval = 5
 
 def on_train_epoch_end(trainer):
     log_data = {
@@ -919,7 +1676,7 @@ def on_train_epoch_end(trainer):
     log_json(log_data)
     
     global visual_validator
-    if visual_validator is not None and (trainer.epoch + 1) % 5 == 0:
+    if visual_validator is not None and viz_interval > 0 and (trainer.epoch + 1) % viz_interval == 0:
         try:
             viz_results = visual_validator.generate_visualization(trainer.epoch + 1)
             if viz_results:
@@ -939,6 +1696,300 @@ def on_train_start(trainer):
         "imgsz": trainer.args.imgsz
     })
 
+def parse_imgsz_schedule(schedule, target_imgsz):
+    """解析 '640:0.3,960:0.6' -> [(0.3, 640), (0.6, 960), (1.0, target_imgsz)]"""
+    phases = []
+    for item in schedule.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        size, fraction = item.split(':')
+        size, fraction = int(size), float(fraction)
+        if size % 32 != 0:
+            raise ValueError(f"渐进分辨率尺寸必须是 32 的倍数: {size}")
+        if not 0.0 < fraction < 1.0:
+            raise ValueError(f"渐进分辨率阶段比例必须在 (0, 1) 之间: {fraction}")
+        if phases and fraction <= phases[-1][0]:
+            raise ValueError("渐进分辨率阶段比例必须递增")
+        phases.append((fraction, size))
+    phases.append((1.0, target_imgsz))
+    return phases
+
+class ProgressiveResizeScheduler:
+    """渐进分辨率训练：前期用小尺寸，按 epoch 比例切换并重建训练 dataloader。
+    只替换 trainer.train_loader，优化器、EMA 与学习率调度保持不变；
+    阶段尺寸只传给训练 dataloader（见 make_progressive_trainer），trainer.args.imgsz 始终是目标尺寸，
+    因此验证与检查点中的 train_args 都使用目标尺寸，续训后也能按计划回到目标尺寸。"""
+
+    def __init__(self, phases, target_imgsz):
+        self.phases = phases
+        self.target_imgsz = target_imgsz
+        self.current_imgsz = None
+        self.phase_stats = {}
+        self.epoch_start = None
+
+    def size_for_epoch(self, epoch, epochs):
+        progress = epoch / max(epochs, 1)
+        for fraction, size in self.phases:
+            if progress < fraction:
+                return size
+        return self.target_imgsz
+
+    def loader_imgsz(self, trainer):
+        """训练 dataloader 应使用的尺寸；训练启动时按起始 epoch 所在阶段确定，之后由 epoch 回调切换"""
+        if getattr(trainer, '_resize_imgsz', None) is None:
+            trainer._resize_imgsz = self.size_for_epoch(trainer.epoch, trainer.epochs)
+        # OOM 降级可能把目标尺寸调得比计划中的阶段尺寸还小
+        return min(trainer._resize_imgsz, trainer.args.imgsz)
+
+    def _rebuild_loader(self, trainer, imgsz):
+        from ultralytics.utils import LOCAL_RANK
+
+        old_loader = trainer.train_loader
+        trainer._resize_imgsz = imgsz
+        world_size = max(getattr(trainer, 'world_size', 1), 1)
+        trainer.train_loader = trainer.get_dataloader(
+            trainer.trainset, batch_size=trainer.batch_size // world_size, rank=LOCAL_RANK, mode='train'
+        )
+        shutdown_dataloader(old_loader)
+        if trainer.args.close_mosaic and trainer.epoch >= trainer.epochs - trainer.args.close_mosaic:
+            trainer._close_dataloader_mosaic()
+
+    def on_train_epoch_start(self, trainer):
+        imgsz = self.size_for_epoch(trainer.epoch, trainer.epochs)
+        if imgsz != self.loader_imgsz(trainer):
+            start = time.time()
+            self._rebuild_loader(trainer, imgsz)
+            print(f"📐 渐进分辨率: 重建训练 dataloader 耗时 {time.time() - start:.1f}s", flush=True)
+        imgsz = self.loader_imgsz(trainer)
+        if imgsz != self.current_imgsz:
+            print(f"📐 渐进分辨率: epoch {trainer.epoch + 1} 起使用 imgsz={imgsz}", flush=True)
+            log_json({
+                "event": "resolution_phase_start",
+                "epoch": trainer.epoch + 1,
+                "imgsz": imgsz
+            })
+            self.current_imgsz = imgsz
+        self.epoch_start = time.time()
+
+    def on_train_epoch_end(self, trainer):
+        if self.epoch_start is None:
+            return
+        stats = self.phase_stats.setdefault(self.current_imgsz, {"epochs": 0, "train_time_s": 0.0, "images": 0})
+        stats["epochs"] += 1
+        stats["train_time_s"] += time.time() - self.epoch_start
+        stats["images"] += len(trainer.train_loader.dataset)
+        self.epoch_start = None
+
+    def on_train_end(self, trainer):
+        target = self.phase_stats.get(self.target_imgsz)
+        target_ips = target["images"] / target["train_time_s"] if target and target["train_time_s"] > 0 else None
+
+        phases = []
+        total_saved = 0.0
+        for imgsz, stats in sorted(self.phase_stats.items()):
+            ips = stats["images"] / stats["train_time_s"] if stats["train_time_s"] > 0 else 0.0
+            if target_ips:
+                est_target_time = stats["images"] / target_ips
+            else:
+                # 目标尺寸阶段未执行（如提前停止）时按像素数比例估算
+                est_target_time = stats["train_time_s"] * (self.target_imgsz / imgsz) ** 2
+            saved = max(est_target_time - stats["train_time_s"], 0.0)
+            total_saved += saved
+            phases.append({
+                "imgsz": imgsz,
+                "epochs": stats["epochs"],
+                "train_time_s": round(stats["train_time_s"], 1),
+                "images_per_sec": round(ips, 1),
+                "time_saved_s": round(saved, 1)
+            })
+
+        log_json({
+            "event": "progressive_resize_summary",
+            "target_imgsz": self.target_imgsz,
+            "phases": phases,
+            "total_time_saved_s": round(total_saved, 1)
+        })
+        for p in phases:
+            print(f"   imgsz={p['imgsz']}: {p['epochs']} epochs, {p['images_per_sec']} 张/秒, 节省 {p['time_saved_s']}s", flush=True)
+
+def make_progressive_trainer(scheduler, base_cls=None):
+    """返回按渐进分辨率计划构建训练 dataloader 的训练器：阶段尺寸只在构建训练集期间生效，
+    训练启动时直接以起始阶段尺寸构建，不会先按目标尺寸多构建一次。须位于训练器组合的最外层"""
+    from ultralytics.models.yolo.pose import PoseTrainer
+
+    base_cls = base_cls or PoseTrainer
+
+    class ProgressiveResizePoseTrainer(base_cls):
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+            if mode != 'train':
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            target = self.args.imgsz
+            self.args.imgsz = scheduler.loader_imgsz(self)
+            try:
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            finally:
+                self.args.imgsz = target
+
+    return ProgressiveResizePoseTrainer
+
+class ControlChannel:
+    """训练运行时控制通道：从 stdin 或本地 TCP 端口读取逐行 JSON 命令，
+    在训练回调的安全点执行，并通过 log_json 回执 (control_ack)。
+
+    命令示例:
+      {"cmd": "pause"} / {"cmd": "resume"}
+      {"cmd": "snapshot"}                          立即保存可续训检查点
+      {"cmd": "set", "viz_interval": 10, "val_interval": 2}
+      {"cmd": "gpu_monitor", "enabled": false}
+      {"cmd": "evaluate_keypoints"}                在本轮结束后计算各关键点指标
+    """
+
+    BATCH_COMMANDS = ("pause", "resume", "snapshot", "set", "gpu_monitor")
+    EPOCH_COMMANDS = ("evaluate_keypoints",)
+
+    def __init__(self, data_yaml, device):
+        import queue
+        self.commands = queue.Queue()
+        self.deferred = []
+        self.paused = False
+        self.val_interval = 1
+        self.data_yaml = data_yaml
+        self.device = device
+        self.server = None
+
+    def ack(self, command, status, **extra):
+        log_json({
+            "event": "control_ack",
+            "id": command.get("id"),
+            "cmd": command.get("cmd"),
+            "status": status,
+            **extra
+        })
+
+    def submit(self, line):
+        try:
+            command = json.loads(line)
+            if not isinstance(command, dict):
+                raise ValueError("命令必须是 JSON 对象")
+        except ValueError as e:
+            log_json({"event": "control_ack", "status": "error", "message": f"无法解析命令: {e}"})
+            return
+        if command.get("cmd") not in self.BATCH_COMMANDS + self.EPOCH_COMMANDS:
+            self.ack(command, "error", message="未知命令")
+            return
+        self.commands.put(command)
+        self.ack(command, "queued")
+
+    def _read_stream(self, stream):
+        for line in stream:
+            if line.strip():
+                self.submit(line)
+
+    def start_stdin(self):
+        threading.Thread(target=self._read_stream, args=(sys.stdin,), daemon=True).start()
+        print("🎛️ 控制通道已启用 (stdin)", flush=True)
+
+    def start_socket(self, port):
+        import socketserver
+
+        channel = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    line = raw.decode('utf-8', errors='replace')
+                    if line.strip():
+                        channel.submit(line)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"🎛️ 控制通道已启用 (127.0.0.1:{port})", flush=True)
+        log_json({"event": "control_channel", "transport": "socket", "port": port})
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _drain(self, allowed):
+        import queue
+        ready = [c for c in self.deferred if c["cmd"] in allowed]
+        self.deferred = [c for c in self.deferred if c["cmd"] not in allowed]
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            (ready if command["cmd"] in allowed else self.deferred).append(command)
+        return ready
+
+    def _apply_batch_command(self, trainer, command):
+        global viz_interval
+        cmd = command["cmd"]
+        if cmd == "pause":
+            self.paused = True
+            self.ack(command, "applied", epoch=trainer.epoch + 1)
+        elif cmd == "resume":
+            self.paused = False
+            self.ack(command, "applied", epoch=trainer.epoch + 1)
+        elif cmd == "snapshot":
+            # 直接写快照文件，last.pt / best.pt 保持不变，不影响之后的续训
+            snapshot = os.path.join(os.path.dirname(str(trainer.last)), f"snapshot_epoch{trainer.epoch + 1}_{int(time.time())}.pt")
+            try:
+                if trainer.epoch == 0:
+                    write_training_checkpoint(trainer, snapshot, -1, stopped_in_first_epoch=True)
+                else:
+                    write_training_checkpoint(trainer, snapshot, trainer.epoch - 1)
+                self.ack(command, "applied", checkpoint=snapshot)
+            except Exception as e:
+                self.ack(command, "error", message=f"保存快照失败: {e}")
+        elif cmd == "set":
+            if "viz_interval" in command:
+                viz_interval = int(command["viz_interval"])
+            if "val_interval" in command:
+                self.val_interval = max(int(command["val_interval"]), 1)
+            self.ack(command, "applied", viz_interval=viz_interval, val_interval=self.val_interval)
+        elif cmd == "gpu_monitor":
+            if gpu_monitor is None:
+                self.ack(command, "error", message="GPU 监控不可用")
+            elif command.get("enabled", True) and not gpu_monitor.running:
+                gpu_monitor.start_monitoring()
+                self.ack(command, "applied", enabled=True)
+            elif not command.get("enabled", True) and gpu_monitor.running:
+                gpu_monitor.stop_monitoring()
+                self.ack(command, "applied", enabled=False)
+            else:
+                self.ack(command, "applied", enabled=gpu_monitor.running)
+
+    def on_train_batch_end(self, trainer):
+        for command in self._drain(self.BATCH_COMMANDS):
+            self._apply_batch_command(trainer, command)
+
+        if self.paused:
+            print("⏸️ 训练已暂停，等待 resume 命令...", flush=True)
+            log_json({"event": "paused", "epoch": trainer.epoch + 1})
+            while self.paused and not should_stop:
+                time.sleep(0.2)
+                for command in self._drain(self.BATCH_COMMANDS):
+                    self._apply_batch_command(trainer, command)
+            log_json({"event": "resumed", "epoch": trainer.epoch + 1})
+
+    def on_train_epoch_end(self, trainer):
+        # trainer 在此回调之后决定是否验证；最后一轮始终验证
+        trainer.args.val = (trainer.epoch + 1) % self.val_interval == 0
+
+    def on_fit_epoch_end(self, trainer):
+        for command in self._drain(self.EPOCH_COMMANDS):
+            if not os.path.exists(trainer.last):
+                self.ack(command, "error", message="尚无可评估的检查点")
+                continue
+            metrics = get_per_keypoint_metrics(YOLO(str(trainer.last)), self.data_yaml, self.device)
+            log_json({**metrics, "epoch": trainer.epoch + 1})
+            self.ack(command, "applied", epoch=trainer.epoch + 1)
+
 def check_resume_available(args):
     """智能断点续训检测：检查是否存在可恢复的训练"""
     resume_info = {
@@ -1007,24 +2058,1048 @@ def check_resume_available(args):
     except Exception as e:
         return resume_info
 
-def validate_config(args):
-    """飞行前检查：验证配置完整性和数据有效性"""
-    print("🔍 开始飞行前检查 (Pre-flight Check)...", flush=True)
-    
-    issues = []
-    warnings = []
-    checks_passed = {
-        "yaml_file": False,
-        "train_path": False,
-        "val_path": False,
-        "train_images": False,
-        "val_images": False,
-        "dependencies": False
+def _file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _manifest_hash(path, prev_hash, prev_stat):
+    """大小与修改时间都未变时沿用上次清单中的哈希，否则重新计算"""
+    if not os.path.exists(path):
+        return None, None
+    stat = _file_stat(path)
+    if prev_hash is not None and prev_stat == stat:
+        return prev_hash, stat
+    return file_sha256(path), stat
+
+def build_dataset_manifest(data_yaml, previous=None):
+    """计算数据集各划分中图片与标签的内容哈希，用于增量训练比对；
+    previous 为上次的清单，其中大小与修改时间未变的文件直接复用哈希"""
+    data_config = load_data_config(data_yaml)
+    manifest = {
+        "data": os.path.abspath(data_yaml),
+        "created": time.time(),
+        "splits": {}
     }
-    
-    # 1. YAML 配置文件验证
-    print("  📄 检查 YAML 配置文件...", flush=True)
-    try:
+    known = {}
+    for entries in (previous or {}).get("splits", {}).values():
+        known.update(entries)
+
+    for split in ('train', 'val', 'test'):
+        entries = {}
+        for img_path in list_split_images(resolve_split_path(data_config, split)):
+            img_path = os.path.abspath(img_path)
+            prev = known.get(img_path, {})
+            image, image_stat = _manifest_hash(img_path, prev.get("image"), prev.get("image_stat"))
+            if image is None:
+                continue
+            label, label_stat = _manifest_hash(image_to_label_path(img_path), prev.get("label"), prev.get("label_stat"))
+            entries[img_path] = known[img_path] = {
+                "image": image, "label": label, "image_stat": image_stat, "label_stat": label_stat
+            }
+        if entries:
+            manifest["splits"][split] = entries
+
+    return manifest
+
+def save_dataset_manifest(manifest, run_dir):
+    os.makedirs(run_dir, exist_ok=True)
+    manifest_path = os.path.join(run_dir, DATASET_MANIFEST_FILE)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest_path
+
+def _manifest_pairs(manifest, split):
+    # 以 (图片哈希, 标签哈希) 作为样本身份，重新编号/改名不会被误判为新数据
+    return {(e["image"], e["label"]) for e in manifest["splits"].get(split, {}).values()}
+
+def prepare_incremental_dataset(args, abs_data_path):
+    """增量训练：对比上次训练的数据清单，组合新增样本与回放样本"""
+    prev_dir = args.incremental_from
+    prev_manifest_path = os.path.join(prev_dir, DATASET_MANIFEST_FILE)
+    base_weights = os.path.join(prev_dir, 'weights', 'best.pt')
+
+    if not os.path.exists(prev_manifest_path):
+        raise FileNotFoundError(f"找不到上次训练的数据清单: {prev_manifest_path}（上次训练需开启 --save_manifest）")
+    if not os.path.exists(base_weights):
+        raise FileNotFoundError(f"找不到上次训练的权重: {base_weights}")
+
+    print(f"🔍 正在比对数据集变化 (基准: {prev_dir})...", flush=True)
+    start = time.time()
+
+    with open(prev_manifest_path, 'r', encoding='utf-8') as f:
+        prev_manifest = json.load(f)
+    manifest = build_dataset_manifest(abs_data_path, previous=prev_manifest)
+
+    old_train = _manifest_pairs(prev_manifest, 'train')
+    changed, unchanged = [], []
+    for img_path, entry in manifest["splits"].get("train", {}).items():
+        if (entry["image"], entry["label"]) in old_train:
+            unchanged.append(img_path)
+        else:
+            changed.append(img_path)
+
+    old_val = _manifest_pairs(prev_manifest, 'val')
+    stable_val = [
+        img_path for img_path, entry in manifest["splits"].get("val", {}).items()
+        if (entry["image"], entry["label"]) in old_val
+    ]
+
+    replay_count = min(len(unchanged), int(round(len(changed) * args.replay_ratio)))
+    replay = random.Random(0).sample(unchanged, replay_count)
+
+    plan = {
+        "base_weights": base_weights,
+        "manifest": manifest,
+        "changed_count": len(changed),
+        "replay_count": len(replay),
+        "unchanged_count": len(unchanged),
+        "stable_val_count": len(stable_val),
+        "data_yaml": None,
+        "stable_val_yaml": None
+    }
+
+    log_json({
+        "event": "incremental_plan",
+        "base_run": prev_dir,
+        "base_weights": base_weights,
+        "changed": len(changed),
+        "replay": len(replay),
+        "unchanged": len(unchanged),
+        "stable_val": len(stable_val),
+        "diff_time_s": round(time.time() - start, 2)
+    })
+    print(f"   新增/变更: {len(changed)} 张, 回放: {len(replay)} 张, 未变化验证集: {len(stable_val)} 张", flush=True)
+
+    if not changed:
+        return plan
+
+    data_config = load_data_config(abs_data_path)
+    inc_dir = os.path.join(args.project, args.name, 'incremental')
+    train_list = write_image_list(changed + replay, os.path.join(inc_dir, 'train.txt'))
+    plan["data_yaml"] = write_derived_data_yaml(
+        data_config, os.path.join(inc_dir, 'data.yaml'), train=train_list
+    )
+
+    if stable_val:
+        val_list = write_image_list(stable_val, os.path.join(inc_dir, 'val_unchanged.txt'))
+        plan["stable_val_yaml"] = write_derived_data_yaml(
+            data_config, os.path.join(inc_dir, 'val_unchanged.yaml'), val=val_list
+        )
+
+    return plan
+
+def report_incremental_delta(plan, new_weights, args, train_time_s):
+    """在未变化的验证集上比较增量训练前后的精度"""
+    if not plan["stable_val_yaml"]:
+        print("⚠️ 没有未变化的验证集图片，跳过增量精度对比", flush=True)
+        return None
+
+    print("📊 正在对比增量训练前后精度 (未变化验证集)...", flush=True)
+    metrics = {}
+    for tag, weights in (("before", plan["base_weights"]), ("after", new_weights)):
+        val_results = YOLO(weights).val(
+            data=plan["stable_val_yaml"],
+            batch=args.batch,
+            imgsz=args.imgsz,
+            device=args.device,
+            plots=False,
+            verbose=False
+        )
+        metrics[tag] = extract_val_metrics(val_results)
+
+    delta = {
+        k: round(metrics["after"].get(k, 0.0) - v, 4)
+        for k, v in metrics["before"].items()
+    }
+
+    report = {
+        "event": "incremental_report",
+        "before": metrics["before"],
+        "after": metrics["after"],
+        "delta": delta,
+        "train_time_s": round(train_time_s, 1),
+        "changed": plan["changed_count"],
+        "replay": plan["replay_count"]
+    }
+    log_json(report)
+
+    print(f"   Pose mAP@50-95: {metrics['before'].get('pose_mAP50-95', 0):.4f} -> {metrics['after'].get('pose_mAP50-95', 0):.4f} ({delta.get('pose_mAP50-95', 0):+.4f})", flush=True)
+    return report
+
+def _pack_source_key(img_path):
+    label_path = image_to_label_path(img_path)
+    key = _image_cache_key(img_path)
+    if os.path.exists(label_path):
+        st = os.stat(label_path)
+        key += f"|{st.st_size}|{st.st_mtime_ns}"
+    return key
+
+def pack_split(images, split_dir, shard_bytes):
+    """把一个划分的图片与标签顺序写入分片文件。已打包且未变化的记录沿用原位置，
+    新增或修改的图片追加到新分片，因此再次打包只写入增量部分"""
+    import io
+    from PIL import Image
+    from ultralytics.data.utils import exif_size
+
+    os.makedirs(split_dir, exist_ok=True)
+    index_path = os.path.join(split_dir, PACK_INDEX_FILE)
+    index = _read_json(index_path, {"shards": [], "records": []})
+    packed = {r["name"]: r for r in index["records"]}
+
+    records, pending = [], []
+    for img_path in images:
+        name = os.path.abspath(img_path)
+        key = _pack_source_key(img_path)
+        record = packed.get(name)
+        if record is not None and record["key"] == key:
+            records.append(record)
+        else:
+            records.append(None)
+            pending.append((len(records) - 1, name, key))
+
+    shard, written = None, 0
+    try:
+        for pos, name, key in pending:
+            if shard is None or shard.tell() >= shard_bytes:
+                if shard is not None:
+                    shard.close()
+                index["shards"].append(f"shard-{len(index['shards']):05d}.bin")
+                shard = open(os.path.join(split_dir, index["shards"][-1]), 'wb')
+
+            with open(name, 'rb') as f:
+                image_bytes = f.read()
+            label_path = image_to_label_path(name)
+            label_bytes = b''
+            if os.path.exists(label_path):
+                with open(label_path, 'rb') as f:
+                    label_bytes = f.read()
+            w, h = exif_size(Image.open(io.BytesIO(image_bytes)))
+
+            image_offset = shard.tell()
+            shard.write(image_bytes)
+            label_offset = shard.tell()
+            shard.write(label_bytes)
+            records[pos] = {
+                "name": name,
+                "key": key,
+                "shard": len(index["shards"]) - 1,
+                "image": [image_offset, len(image_bytes)],
+                "label": [label_offset, len(label_bytes)],
+                "shape": [h, w]
+            }
+            written += len(image_bytes) + len(label_bytes)
+    finally:
+        if shard is not None:
+            shard.close()
+
+    index["records"] = records
+    _write_json_atomic(index_path, index)
+
+    total = sum(os.path.getsize(os.path.join(split_dir, s)) for s in index["shards"])
+    live = sum(r["image"][1] + r["label"][1] for r in records)
+    return {
+        "records": len(records),
+        "packed": len(pending),
+        "reused": len(records) - len(pending),
+        "shards": len(index["shards"]),
+        "bytes_written": written,
+        "dead_bytes": total - live
+    }
+
+def pack_dataset(args):
+    """独立工具模式：把 data.yaml 的 train/val/test 打包为少量大分片 + 偏移索引"""
+    import shutil
+
+    abs_data_path = os.path.abspath(args.data)
+    data_config = load_data_config(abs_data_path)
+    out_dir = args.pack_dataset
+    if args.pack_rebuild and os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+
+    report = {"event": "dataset_packed", "output": os.path.abspath(out_dir), "splits": {}}
+    start = time.time()
+    for split in ('train', 'val', 'test'):
+        images = list_split_images(resolve_split_path(data_config, split))
+        if not images:
+            continue
+        stats = pack_split(images, os.path.join(out_dir, split), args.pack_shard_mb * 1024 * 1024)
+        report["splits"][split] = stats
+        print(f"📦 {split}: {stats['records']} 条记录，新打包 {stats['packed']}，复用 {stats['reused']}，"
+              f"{stats['shards']} 个分片", flush=True)
+        if stats["dead_bytes"] > stats["bytes_written"] and stats["dead_bytes"] > args.pack_shard_mb * 1024 * 1024:
+            print(f"   ⚠️ 分片中有 {stats['dead_bytes'] / 1024 / 1024:.0f} MB 已失效数据，可使用 --pack_rebuild 重新打包", flush=True)
+
+    report["time_s"] = round(time.time() - start, 2)
+    log_json(report)
+    return report
+
+def load_packed_records(pack_dir):
+    """合并各划分的索引: 原图片绝对路径 -> (划分目录, 分片文件列表, 记录)"""
+    records = {}
+    for split in ('train', 'val', 'test'):
+        split_dir = os.path.join(pack_dir, split)
+        index = _read_json(os.path.join(split_dir, PACK_INDEX_FILE), None)
+        if not index:
+            continue
+        for r in index["records"]:
+            records[r["name"]] = (split_dir, index["shards"], r)
+    return records
+
+class PackedPoseDataset(YOLODataset):
+    """从打包分片读取图片与标签的 YOLODataset：mmap 方式访问，不再逐个打开小文件"""
+
+    def __init__(self, *args, packed_records=None, **kwargs):
+        self.packed_records = packed_records
+        self._maps = {}
+        super().__init__(*args, **kwargs)
+
+    def __getstate__(self):
+        # mmap 不可序列化，DataLoader worker 中按需重新打开
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def _read(self, record_entry, field):
+        import mmap
+        split_dir, shards, record = record_entry
+        path = os.path.join(split_dir, shards[record["shard"]])
+        mm = self._maps.get(path)
+        if mm is None:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[path] = mm
+        offset, length = record[field]
+        return np.frombuffer(mm, dtype=np.uint8, count=length, offset=offset)
+
+    def get_img_files(self, img_path):
+        im_files = [os.path.abspath(p) for p in list_split_images(img_path)]
+        if self.fraction < 1:
+            im_files = im_files[:round(len(im_files) * self.fraction)]
+        return im_files
+
+    def get_labels(self):
+        nkpt, ndim = self.data.get('kpt_shape', (0, 0)) if self.use_keypoints else (0, 0)
+        labels = []
+        for im_file in self.im_files:
+            entry = self.packed_records[im_file]
+            text = self._read(entry, "label").tobytes().decode('utf-8')
+            rows = [line.split() for line in text.splitlines() if line.strip()]
+            lb = np.asarray(rows, dtype=np.float32) if rows else np.zeros((0, 5 + nkpt * ndim), dtype=np.float32)
+            keypoints = None
+            if self.use_keypoints:
+                keypoints = lb[:, 5:].reshape(-1, nkpt, ndim)
+                if ndim == 2:
+                    kpt_mask = np.where((keypoints[..., 0] < 0) | (keypoints[..., 1] < 0), 0.0, 1.0).astype(np.float32)
+                    keypoints = np.concatenate([keypoints, kpt_mask[..., None]], axis=-1)
+            labels.append({
+                "im_file": im_file,
+                "shape": tuple(entry[2]["shape"]),
+                "cls": lb[:, 0:1],
+                "bboxes": lb[:, 1:5],
+                "segments": [],
+                "keypoints": keypoints,
+                "normalized": True,
+                "bbox_format": "xywh"
+            })
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        """与 BaseDataset.load_image 相同的缩放与 mosaic 缓冲逻辑，只是从分片解码"""
+        import math
+        import cv2
+
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im = cv2.imdecode(self._read(self.packed_records[self.im_files[i]], "image"), cv2.IMREAD_COLOR)
+        if im is None:
+            raise FileNotFoundError(f"无法从分片解码图片: {self.im_files[i]}")
+        h0, w0 = im.shape[:2]
+        if rect_mode:
+            r = self.imgsz / max(h0, w0)
+            if r != 1:
+                w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+
+        if self.augment and hasattr(self, 'buffer'):
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer:
+                j = self.buffer.pop(0)
+                if getattr(self, 'cache', None) != "ram":
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+class ShardShuffleSampler:
+    """两级打乱：每个 epoch 先打乱分片顺序，再在相邻 window 个分片的记录内打乱，
+    读取保持在少数几个分片内，顺序预读仍然有效"""
+
+    def __init__(self, dataset, window=2, seed=0):
+        self.groups = {}
+        for i, im_file in enumerate(dataset.im_files):
+            split_dir, shards, record = dataset.packed_records[im_file]
+            self.groups.setdefault((split_dir, record["shard"]), []).append(i)
+        self.window = window
+        self.seed = seed
+        self.epoch = 0
+        self.length = len(dataset.im_files)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        shards = sorted(self.groups)
+        rng.shuffle(shards)
+        for k in range(0, len(shards), self.window):
+            indices = [i for s in shards[k:k + self.window] for i in self.groups[s]]
+            rng.shuffle(indices)
+            yield from indices
+
+def sampled_dataloader(dataset, workers, **sampler_kwargs):
+    """与 ultralytics build_dataloader 相同的 InfiniteDataLoader 配置，只是由调用方指定 sampler / batch_sampler"""
+    import torch
+    from ultralytics.data.build import InfiniteDataLoader, seed_worker
+
+    generator = torch.Generator()
+    generator.manual_seed(6148914691236517205)
+    return InfiniteDataLoader(
+        dataset=dataset,
+        num_workers=min(os.cpu_count() or 1, workers),
+        pin_memory=torch.cuda.is_available(),
+        collate_fn=getattr(dataset, 'collate_fn', None),
+        worker_init_fn=seed_worker,
+        generator=generator,
+        **sampler_kwargs
+    )
+
+def shutdown_dataloader(loader):
+    """关闭被替换的 InfiniteDataLoader 的 worker 进程；它的迭代器常驻，不会随对象释放及时退出"""
+    iterator = getattr(loader, 'iterator', None)
+    if iterator is not None and hasattr(iterator, '_shutdown_workers'):
+        iterator._shutdown_workers()
+
+def make_packed_trainer(pack_dir, base_cls=None):
+    """返回从打包分片构建数据集的训练器；请求的图片未全部打包时回退到原始文件"""
+    from ultralytics.models.yolo.pose import PoseTrainer
+    from ultralytics.utils import colorstr
+    from ultralytics.utils.torch_utils import de_parallel
+
+    base_cls = base_cls or PoseTrainer
+    packed_records = load_packed_records(pack_dir)
+
+    class PackedPoseTrainer(base_cls):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            wanted = [os.path.abspath(p) for p in list_split_images(img_path)]
+            missing = sum(1 for p in wanted if p not in packed_records)
+            if not wanted or missing:
+                print(f"⚠️ {mode} 集有 {missing} 张图片未打包，使用原始文件（请重新运行 --pack_dataset）", flush=True)
+                return super().build_dataset(img_path, mode, batch)
+
+            cfg = self.args
+            stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+            return PackedPoseDataset(
+                img_path=img_path,
+                imgsz=cfg.imgsz,
+                batch_size=batch,
+                augment=mode == 'train',
+                hyp=cfg,
+                rect=cfg.rect or mode == 'val',
+                cache=cfg.cache if cfg.cache == 'ram' else None,
+                single_cls=cfg.single_cls or False,
+                stride=stride,
+                pad=0.0 if mode == 'train' else 0.5,
+                prefix=colorstr(f"{mode} (packed): "),
+                task=cfg.task,
+                classes=cfg.classes,
+                data=self.data,
+                fraction=cfg.fraction if mode == 'train' else 1.0,
+                packed_records=packed_records
+            )
+
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+            if mode != 'train' or rank != -1 or not isinstance(dataset, PackedPoseDataset) or dataset.rect:
+                from ultralytics.data import build_dataloader
+                workers = self.args.workers if mode == 'train' else self.args.workers * 2
+                return build_dataloader(dataset, batch_size, workers, mode == 'train' and not dataset.rect, rank)
+
+            return sampled_dataloader(dataset, self.args.workers, batch_size=min(batch_size, len(dataset)),
+                                      shuffle=False, sampler=ShardShuffleSampler(dataset))
+
+    return PackedPoseTrainer
+
+def plan_aspect_buckets(shapes, num_buckets, imgsz, stride=32):
+    """按宽高比 (h/w) 分位数把图片分成最多 num_buckets 个桶，桶形状与 ultralytics rect 的计算方式一致；
+    形状相同的桶会合并。同时统计相对方形 imgsz×imgsz letterbox 的填充比例"""
+    s = np.asarray(shapes, dtype=np.float64).reshape(-1, 2)
+    ar = s[:, 0] / s[:, 1]
+    order = np.argsort(ar, kind='stable')
+
+    bucket_of = np.zeros(len(ar), dtype=np.int64)
+    bucket_shapes = []
+    for members in np.array_split(order, max(1, min(num_buckets, len(ar)))):
+        mini, maxi = ar[members].min(), ar[members].max()
+        shape = [1.0, 1.0]
+        if maxi < 1:
+            shape = [maxi, 1.0]
+        elif mini > 1:
+            shape = [1.0, 1.0 / mini]
+        shape = tuple(int(v) * stride for v in np.ceil(np.array(shape) * imgsz / stride))
+        if shape not in bucket_shapes:
+            bucket_shapes.append(shape)
+        bucket_of[members] = bucket_shapes.index(shape)
+
+    bucket_hw = np.array(bucket_shapes, dtype=np.float64)[bucket_of]
+    # letterbox 把图片等比缩放到恰好放入目标形状，其余部分为填充
+    content_square = s[:, 0] * s[:, 1] * np.minimum(imgsz / s[:, 0], imgsz / s[:, 1]) ** 2
+    content_bucket = s[:, 0] * s[:, 1] * np.minimum(bucket_hw[:, 0] / s[:, 0], bucket_hw[:, 1] / s[:, 1]) ** 2
+    bucket_area = bucket_hw[:, 0] * bucket_hw[:, 1]
+    padding_square = float(np.mean(1 - content_square / imgsz ** 2))
+    padding_bucketed = float(np.mean(1 - content_bucket / bucket_area))
+    return {
+        "bucket_of": bucket_of,
+        "shapes": bucket_shapes,
+        "sizes": np.bincount(bucket_of, minlength=len(bucket_shapes)).tolist(),
+        "padding_square": round(padding_square, 4),
+        "padding_bucketed": round(padding_bucketed, 4),
+        "padding_saved": round(padding_square - padding_bucketed, 4),
+        "pixel_ratio": round(float(bucket_area.sum()) / (len(s) * imgsz ** 2), 4)
+    }
+
+class AspectBucketBatchSampler:
+    """每个 epoch 先在桶内打乱并切成 batch，再打乱全部 batch 的顺序；
+    同一个 batch 只含同一个桶的图片，collate 时形状一致"""
+
+    def __init__(self, bucket_of, batch_size, seed=0):
+        self.buckets = {}
+        for i, b in enumerate(bucket_of):
+            self.buckets.setdefault(int(b), []).append(i)
+        self.batch_size = max(1, batch_size)
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return sum(-(-len(v) // self.batch_size) for v in self.buckets.values())
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        batches = []
+        for b in sorted(self.buckets):
+            indices = list(self.buckets[b])
+            rng.shuffle(indices)
+            batches.extend(indices[k:k + self.batch_size] for k in range(0, len(indices), self.batch_size))
+        rng.shuffle(batches)
+        yield from batches
+
+def make_bucketed_trainer(num_buckets, base_cls=None):
+    """返回按宽高比分桶组 batch 的训练器：训练集按所在桶的形状 letterbox，
+    不再统一填充成 imgsz×imgsz；验证集与多卡训练保持原样"""
+    import copy
+    from ultralytics.models.yolo.pose import PoseTrainer
+
+    base_cls = base_cls or PoseTrainer
+
+    class BucketedPoseTrainer(base_cls):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.bucket_plan = None
+            self._bucket_throughput = None
+            self._bucket_epoch_start = None
+            self.add_callback("on_train_start", self._measure_bucket_throughput)
+            self.add_callback("on_train_epoch_start", self._start_bucket_epoch)
+            self.add_callback("on_train_epoch_end", self._end_bucket_epoch)
+
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+            if mode != 'train' or rank != -1:
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+            if dataset.rect:
+                from ultralytics.data import build_dataloader
+                return build_dataloader(dataset, batch_size, self.args.workers, False, rank)
+            plan = self._apply_aspect_buckets(dataset)
+            return sampled_dataloader(dataset, self.args.workers,
+                                      batch_sampler=AspectBucketBatchSampler(plan["bucket_of"], min(batch_size, len(dataset))))
+
+        def _apply_aspect_buckets(self, dataset):
+            plan = plan_aspect_buckets([lb["shape"] for lb in dataset.labels], num_buckets, dataset.imgsz, dataset.stride)
+            # 复用 ultralytics rect 通路：get_image_and_label 按 batch_shapes[batch[i]] 设置 rect_shape
+            dataset.rect = True
+            dataset.batch = plan["bucket_of"]
+            dataset.batch_shapes = np.array(plan["shapes"])
+            dataset.transforms = dataset.build_transforms(hyp=copy.copy(self.args))
+            self.bucket_plan = plan
+            log_json({
+                "event": "aspect_buckets",
+                "imgsz": dataset.imgsz,
+                "shapes": [list(s) for s in plan["shapes"]],
+                "sizes": plan["sizes"],
+                "padding_square": plan["padding_square"],
+                "padding_bucketed": plan["padding_bucketed"],
+                "padding_saved": plan["padding_saved"],
+                "pixel_ratio": plan["pixel_ratio"]
+            })
+            print(f"🪣 宽高比分桶: {len(plan['shapes'])} 个桶 "
+                  f"{', '.join(f'{w}x{h}({n})' for (h, w), n in zip(plan['shapes'], plan['sizes']))}", flush=True)
+            print(f"   填充比例 {plan['padding_square']:.1%} -> {plan['padding_bucketed']:.1%}，"
+                  f"每张图像素量为方形的 {plan['pixel_ratio']:.1%}", flush=True)
+            return plan
+
+        @staticmethod
+        def _measure_bucket_throughput(trainer):
+            # 回调列表与 model.callbacks 共享，OOM 重试会重复注册，已测量过时跳过
+            plan = trainer.bucket_plan
+            if plan is None or trainer._bucket_throughput is not None:
+                return
+            imgsz = trainer.train_loader.dataset.imgsz
+            bench_batch = max(1, min(trainer.batch_size, 4))
+            square = measure_train_throughput(trainer.model, bench_batch, imgsz, device=trainer.device)
+            per_bucket = [measure_train_throughput(trainer.model, bench_batch, tuple(shape), device=trainer.device)
+                          for shape in plan["shapes"]]
+            seconds = sum(n / ips for n, ips in zip(plan["sizes"], per_bucket) if ips > 0)
+            bucketed = round(sum(plan["sizes"]) / seconds, 2) if seconds > 0 else 0.0
+            trainer._bucket_throughput = {
+                "bench_batch": bench_batch,
+                "images_per_sec_square": square,
+                "images_per_sec_bucketed": bucketed,
+                "speedup": round(bucketed / square, 3) if square > 0 else None
+            }
+            log_json({"event": "aspect_bucket_throughput", **trainer._bucket_throughput})
+            print(f"   分桶训练吞吐: {square} -> {bucketed} 张/秒", flush=True)
+
+        @staticmethod
+        def _start_bucket_epoch(trainer):
+            if trainer.bucket_plan is not None:
+                trainer._bucket_epoch_start = time.time()
+
+        @staticmethod
+        def _end_bucket_epoch(trainer):
+            if trainer._bucket_epoch_start is None:
+                return
+            elapsed = time.time() - trainer._bucket_epoch_start
+            trainer._bucket_epoch_start = None
+            images = len(trainer.train_loader.dataset)
+            log_json({
+                "event": "aspect_bucket_epoch",
+                "epoch": trainer.epoch + 1,
+                "batches": len(trainer.train_loader),
+                "train_time_s": round(elapsed, 2),
+                "images_per_sec": round(images / elapsed, 2) if elapsed > 0 else None
+            })
+
+    return BucketedPoseTrainer
+
+class LossImportanceSampler:
+    """损失感知的 batch sampler。losses 按图片记录最近一次训练损失（float32，未记录为 NaN）。
+    warmup 内的 epoch 完整打乱遍历；之后每个 epoch 按损失比例有放回地抽取 fraction×N 张，
+    每张图至少保留 floor/N 的概率，抽中的图片按 1/(N·p) 加权，梯度期望与完整 epoch 相同"""
+
+    def __init__(self, num_images, warmup_epochs, fraction, floor, seed=0):
+        if not 0 < fraction <= 1 or not 0 < floor <= 1:
+            raise ValueError("importance fraction 与 floor 必须在 (0, 1] 范围内")
+        self.losses = np.full(num_images, np.nan, dtype=np.float32)
+        self.warmup_epochs = warmup_epochs
+        self.fraction = fraction
+        self.floor = floor
+        self.seed = seed
+        self.batch_size = 1
+        self.bucket_of = None
+        self.index_of = {}
+        self.consumer_epoch = 0
+        self._last_completed = -1
+        self._plans = {}
+
+    def configure(self, batch_size, im_files, bucket_of=None):
+        """(重新) 构建 dataloader 时调用，已记录的损失保留"""
+        self.batch_size = max(1, batch_size)
+        self.index_of = {f: i for i, f in enumerate(im_files)}
+        self.bucket_of = bucket_of
+        self._plans = {}
+        self._last_completed = self.consumer_epoch - 1
+
+    def is_sampling(self, epoch):
+        return epoch >= self.warmup_epochs
+
+    def probabilities(self):
+        n = len(self.losses)
+        seen = self.losses[~np.isnan(self.losses)]
+        losses = np.nan_to_num(self.losses, nan=float(seen.mean()) if seen.size else 1.0).astype(np.float64)
+        losses = np.clip(losses, 0, None)
+        total = losses.sum()
+        share = losses / total if total > 0 else np.full(n, 1.0 / n)
+        return self.floor / n + (1 - self.floor) * share
+
+    def plan(self, epoch):
+        """某个 epoch 的 batch 划分与样本权重；同一 epoch 只抽样一次，长度与迭代内容保持一致"""
+        if epoch not in self._plans:
+            n = len(self.losses)
+            rng = np.random.default_rng(self.seed + epoch)
+            if self.is_sampling(epoch):
+                p = self.probabilities()
+                indices = rng.choice(n, size=max(1, int(np.ceil(self.fraction * n))), p=p)
+                weights = (1.0 / (n * p)).astype(np.float32)
+            else:
+                indices = rng.permutation(n)
+                weights = np.ones(n, dtype=np.float32)
+
+            # 启用宽高比分桶时，batch 只在同一个桶内组成
+            groups = {}
+            for i in indices.tolist():
+                groups.setdefault(0 if self.bucket_of is None else int(self.bucket_of[i]), []).append(i)
+            batches = [members[k:k + self.batch_size] for _, members in sorted(groups.items())
+                       for k in range(0, len(members), self.batch_size)]
+            self._plans = {e: v for e, v in self._plans.items() if e >= self.consumer_epoch - 1}
+            self._plans[epoch] = {
+                "batches": [batches[j] for j in rng.permutation(len(batches))],
+                "weights": weights,
+                "images": len(indices)
+            }
+        return self._plans[epoch]
+
+    def record(self, indices, losses):
+        self.losses[indices] = losses
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, self.losses)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """续训时恢复逐图损失；文件缺失或图片数量不符时返回 False"""
+        try:
+            losses = np.load(path)
+        except (OSError, ValueError):
+            return False
+        if losses.shape != self.losses.shape:
+            return False
+        self.losses = losses.astype(np.float32)
+        return True
+
+    def __len__(self):
+        return len(self.plan(self.consumer_epoch)["batches"])
+
+    def __iter__(self):
+        # dataloader 会预取下一个 epoch 的 batch，此时训练器还停留在当前 epoch
+        epoch = max(self.consumer_epoch, self._last_completed + 1)
+        yield from self.plan(epoch)["batches"]
+        self._last_completed = epoch
+
+class ImportanceWeightedLoss:
+    """包装模型的 criterion：在同一次批量损失计算中得到逐图损失供采样器记录。
+    逐图权重 w 经 PoseLossWeights 乘到各逐元素损失项上，分配器与批内归一化不变，总损失对 w 线性，
+    ∂loss/∂w_i 就是第 i 张图对批损失的贡献。warmup 阶段 w≡1，损失与原始 batch 损失完全相同；
+    采样阶段 w 取 1/(N·p)，损失尺度只按这个因子变化"""
+
+    def __init__(self, criterion, sampler):
+        self.criterion = criterion
+        self.sampler = sampler
+        self.pending = None
+        self.loss_weights = PoseLossWeights.install(criterion)
+
+    def __call__(self, preds, batch):
+        import torch
+
+        epoch = self.sampler.consumer_epoch
+        # 只需要 warmup 最后一个 epoch 起的损失，更早的记录到采样时已经过时
+        if not torch.is_grad_enabled() or epoch < self.sampler.warmup_epochs - 1:
+            return self.criterion(preds, batch)
+
+        indices = np.array([self.sampler.index_of[f] for f in batch["im_file"]])
+        if self.sampler.is_sampling(epoch):
+            weights = self.sampler.plan(epoch)["weights"][indices]
+        else:
+            weights = np.ones(len(indices), dtype=np.float32)
+        pred_kpts = (preds if isinstance(preds[0], list) else preds[1])[1]
+        w = torch.tensor(weights, dtype=torch.float32, device=pred_kpts.device, requires_grad=True)
+
+        with self.loss_weights.apply(lambda fg_mask, target_gt_idx: w[:, None].expand(fg_mask.shape)):
+            loss, loss_items = self.criterion(preds, batch)
+        # 只沿 w 的分支求导，不经过网络；保留计算图供训练器随后的 backward 使用
+        per_image, = torch.autograd.grad(loss, w, retain_graph=True)
+        self.pending = (indices, per_image.float().cpu().numpy())
+        return loss, loss_items
+
+def make_importance_trainer(args, base_cls=None):
+    """返回按逐图损失做重要性采样的训练器：warmup 之后每个 epoch 只训练按损失抽取的部分图片"""
+    from ultralytics.models.yolo.pose import PoseTrainer
+    from ultralytics.utils.torch_utils import de_parallel
+
+    base_cls = base_cls or PoseTrainer
+
+    class ImportanceSampledPoseTrainer(base_cls):
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.importance_sampler = None
+            self._importance_loss = None
+            self._importance_stats = {"epoch_start": None, "s_per_image": None, "saved_s": 0.0,
+                                      "sampled_epochs": 0, "images": 0, "done": False}
+            self.add_callback("on_train_epoch_start", self._start_importance_epoch)
+            self.add_callback("on_train_batch_end", self._record_image_losses)
+            self.add_callback("on_train_epoch_end", self._end_importance_epoch)
+            self.add_callback("on_train_end", self._summarize_importance)
+
+        def get_dataloader(self, dataset_path, batch_size=16, rank=0, mode='train'):
+            if mode != 'train' or rank != -1:
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+            if dataset.rect:
+                print("⚠️ --rect 的 batch 形状按固定顺序划分，无法重要性采样，使用原始 dataloader", flush=True)
+                return super().get_dataloader(dataset_path, batch_size, rank, mode)
+
+            bucket_of = self._apply_aspect_buckets(dataset)["bucket_of"] if hasattr(self, '_apply_aspect_buckets') else None
+            if self.importance_sampler is None or len(self.importance_sampler.losses) != len(dataset):
+                self.importance_sampler = LossImportanceSampler(
+                    len(dataset), args.importance_warmup, args.importance_fraction, args.importance_floor
+                )
+                losses_path = os.path.join(os.path.dirname(self.last), IMPORTANCE_LOSSES_FILE)
+                if self.args.resume and self.importance_sampler.load(losses_path):
+                    recorded = int((~np.isnan(self.importance_sampler.losses)).sum())
+                    log_json({"event": "importance_resumed", "path": losses_path, "recorded_images": recorded})
+            self.importance_sampler.configure(min(batch_size, len(dataset)), dataset.im_files, bucket_of)
+            return sampled_dataloader(dataset, self.args.workers, batch_sampler=self.importance_sampler)
+
+        def preprocess_batch(self, batch):
+            batch = super().preprocess_batch(batch)
+            if self.importance_sampler is not None and self._importance_loss is None:
+                model = de_parallel(self.model)
+                criterion = getattr(model, 'criterion', None) or model.init_criterion()
+                self._importance_loss = ImportanceWeightedLoss(criterion, self.importance_sampler)
+                model.criterion = self._importance_loss
+            return batch
+
+        @staticmethod
+        def _start_importance_epoch(trainer):
+            if trainer.importance_sampler is not None:
+                trainer.importance_sampler.consumer_epoch = trainer.epoch
+                trainer._importance_stats["epoch_start"] = time.time()
+
+        @staticmethod
+        def _record_image_losses(trainer):
+            # 回调列表与 model.callbacks 共享，OOM 重试会重复注册，pending 取走后置空
+            loss_fn = trainer._importance_loss
+            if loss_fn is not None and loss_fn.pending is not None:
+                trainer.importance_sampler.record(*loss_fn.pending)
+                loss_fn.pending = None
+
+        @staticmethod
+        def _end_importance_epoch(trainer):
+            stats = trainer._importance_stats
+            if stats["epoch_start"] is None:
+                return
+            elapsed = time.time() - stats["epoch_start"]
+            stats["epoch_start"] = None
+            sampler = trainer.importance_sampler
+            # 与 last.pt 一起保存，--resume 后无需重新 warmup 即可继续按损失抽样
+            sampler.save(os.path.join(os.path.dirname(trainer.last), IMPORTANCE_LOSSES_FILE))
+            total = len(sampler.losses)
+            images = sampler.plan(trainer.epoch)["images"]
+            stats["images"] += images
+            if not sampler.is_sampling(trainer.epoch):
+                stats["s_per_image"] = elapsed / total
+                return
+
+            saved = max(0.0, stats["s_per_image"] * total - elapsed) if stats["s_per_image"] else 0.0
+            stats["saved_s"] += saved
+            stats["sampled_epochs"] += 1
+            seen = sampler.losses[~np.isnan(sampler.losses)]
+            log_json({
+                "event": "importance_epoch",
+                "epoch": trainer.epoch + 1,
+                "effective_images": images,
+                "dataset_images": total,
+                "batches": len(trainer.train_loader),
+                "train_time_s": round(elapsed, 2),
+                "saved_s": round(saved, 2),
+                "total_saved_s": round(stats["saved_s"], 2),
+                "max_weight": round(float(1.0 / (total * sampler.probabilities().min())), 3),
+                "mean_image_loss": round(float(seen.mean()), 4) if seen.size else None
+            })
+
+        @staticmethod
+        def _summarize_importance(trainer):
+            stats = trainer._importance_stats
+            if trainer.importance_sampler is None or stats["done"]:
+                return
+            stats["done"] = True
+            log_json({
+                "event": "importance_summary",
+                "sampled_epochs": stats["sampled_epochs"],
+                "images_trained": stats["images"],
+                "wall_time_saved_s": round(stats["saved_s"], 1)
+            })
+            if stats["sampled_epochs"]:
+                print(f"🎯 重要性采样: {stats['sampled_epochs']} 个 epoch 按损失抽样，"
+                      f"共训练 {stats['images']} 张次，节省约 {stats['saved_s'] / 60:.1f} 分钟", flush=True)
+
+    return ImportanceSampledPoseTrainer
+
+def _normalize_image(task):
+    """线程池 worker：按 EXIF 方向转正、缩放到最长边 max_side、重新编码为 JPEG，并复制标签。
+    已经是方向正常、尺寸达标的 JPEG 直接复制原字节，避免二次压缩"""
+    import shutil
+    from PIL import Image, ImageOps
+
+    src, dst, src_label, dst_label, max_side, quality = task
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as im:
+        orientation = im.getexif().get(0x0112, 1)
+        src_shape = im.size
+        if im.format == 'JPEG' and orientation == 1 and max(im.size) <= max_side:
+            shutil.copyfile(src, dst)
+            action = "copied"
+            out_shape = im.size
+        else:
+            im = ImageOps.exif_transpose(im)
+            if max(im.size) > max_side:
+                scale = max_side / max(im.size)
+                im = im.resize((max(1, round(im.width * scale)), max(1, round(im.height * scale))), Image.LANCZOS)
+            im.convert('RGB').save(dst, 'JPEG', quality=quality)
+            action = "reencoded"
+            out_shape = im.size
+
+    if src_label and os.path.exists(src_label):
+        os.makedirs(os.path.dirname(dst_label), exist_ok=True)
+        shutil.copyfile(src_label, dst_label)
+    return {
+        "action": action,
+        "src_bytes": os.path.getsize(src),
+        "dst_bytes": os.path.getsize(dst),
+        "src_shape": list(src_shape),
+        "shape": list(out_shape)
+    }
+
+def normalize_dataset(args, abs_data_path):
+    """生成规范化镜像数据集并返回其 data.yaml 路径；按 (源文件, 标签, 参数) 缓存，重复运行只处理新增或变化的图片。
+    标签是归一化坐标，等比例缩放与 EXIF 转正（ultralytics 读图时本来就会转正）后仍然有效"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    data_config = load_data_config(abs_data_path)
+    dataset_root = os.path.abspath(data_config.get('path') or os.path.dirname(abs_data_path))
+    max_side = args.normalize_max_side
+    if not max_side:
+        max_side = max([args.imgsz] + ([size for _, size in parse_imgsz_schedule(args.imgsz_schedule, args.imgsz)]
+                                       if args.imgsz_schedule else []))
+    out_dir = os.path.abspath(args.normalize_dir or os.path.join(
+        os.path.dirname(abs_data_path), f"normalized_{max_side}_q{args.normalize_quality}"))
+    cache_path = os.path.join(out_dir, 'normalize_cache.json')
+    cache = _read_json(cache_path, {})
+    params = f"{max_side}|{args.normalize_quality}"
+
+    splits, tasks, entries, targets = {}, [], {}, set()
+    for split in ('train', 'val', 'test'):
+        split_path = resolve_split_path(data_config, split)
+        images = list_split_images(split_path)
+        if not images:
+            continue
+        is_list = os.path.isfile(split_path)
+        if not is_list:
+            # 目录划分在镜像中仍是目录：图片必须落在该划分的镜像目录里，数据集外的目录镜像到 images/external/<split>
+            split_root = os.path.abspath(split_path)
+            split_rel = os.path.relpath(split_root, dataset_root)
+            if split_rel.startswith('..'):
+                split_rel = os.path.join('images', 'external', split)
+            split_dir = os.path.join(out_dir, split_rel)
+
+        mirrored = []
+        for img_path in images:
+            src = os.path.abspath(img_path)
+            if is_list:
+                rel = os.path.relpath(src, dataset_root)
+                if rel.startswith('..'):
+                    rel = os.path.join('images', 'external', os.path.basename(src))
+                base = os.path.join(out_dir, rel)
+            else:
+                base = os.path.join(split_dir, os.path.relpath(src, split_root))
+            dst = os.path.splitext(base)[0] + '.jpg'
+            if dst in targets:
+                dst = base + '.jpg'
+            targets.add(dst)
+            mirrored.append(dst)
+
+            src_label = image_to_label_path(src)
+            key = f"{_pack_source_key(src)}|{params}"
+            entry = cache.get(src)
+            if entry and entry["key"] == key and entry["target"] == dst and os.path.exists(dst):
+                entries[src] = entry
+            else:
+                tasks.append((src, dst, src_label, image_to_label_path(dst), max_side, args.normalize_quality))
+                entries[src] = {"key": key, "target": dst}
+
+        if is_list:
+            splits[split] = write_image_list(mirrored, os.path.join(out_dir, f"{split}.txt"))
+        else:
+            splits[split] = split_dir
+
+    print(f"🖼️ 规范化数据集: 最长边 {max_side}px, JPEG 质量 {args.normalize_quality}, "
+          f"{len(tasks)} 张需处理, {len(entries) - len(tasks)} 张命中缓存 -> {out_dir}", flush=True)
+
+    start = time.time()
+    stats = {"reencoded": 0, "copied": 0, "src_bytes": 0, "dst_bytes": 0}
+    if tasks:
+        workers = args.normalize_workers or os.cpu_count() or 1
+        # PIL 解码、缩放与 JPEG 编码都会释放 GIL，用线程即可并行，也不必在 spawn 平台上为每个进程重新导入本脚本
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for task, result in zip(tasks, pool.map(_normalize_image, tasks)):
+                stats[result["action"]] += 1
+                stats["src_bytes"] += result["src_bytes"]
+                stats["dst_bytes"] += result["dst_bytes"]
+                entries[task[0]].update(shape=result["shape"], src_shape=result["src_shape"])
+
+    # 源数据集中已删除的图片，镜像中也一并删除
+    removed = 0
+    for src, entry in cache.items():
+        if src not in entries and entry["target"] not in targets:
+            for path in (entry["target"], image_to_label_path(entry["target"])):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+
+    os.makedirs(out_dir, exist_ok=True)
+    _write_json_atomic(cache_path, entries)
+    mirror_yaml = write_derived_data_yaml(
+        {**data_config, 'path': out_dir}, os.path.join(out_dir, 'data.yaml'), **splits
+    )
+
+    log_json({
+        "event": "dataset_normalized",
+        "data": mirror_yaml,
+        "max_side": max_side,
+        "quality": args.normalize_quality,
+        "processed": len(tasks),
+        "cached": len(entries) - len(tasks),
+        "removed": removed,
+        "time_s": round(time.time() - start, 2),
+        **stats
+    })
+    if tasks:
+        print(f"   重新编码 {stats['reencoded']} 张, 直接复制 {stats['copied']} 张, "
+              f"{stats['src_bytes'] / 1024 / 1024:.0f} MB -> {stats['dst_bytes'] / 1024 / 1024:.0f} MB, "
+              f"耗时 {time.time() - start:.1f}s", flush=True)
+    return mirror_yaml
+
+def validate_config(args):
+    """飞行前检查：验证配置完整性和数据有效性"""
+    print("🔍 开始飞行前检查 (Pre-flight Check)...", flush=True)
+    
+    issues = []
+    warnings = []
+    checks_passed = {
+        "yaml_file": False,
+        "train_path": False,
+        "val_path": False,
+        "train_images": False,
+        "val_images": False,
+        "dependencies": False
+    }
+    
+    # 1. YAML 配置文件验证
+    print("  📄 检查 YAML 配置文件...", flush=True)
+    try:
         import yaml
         
         if not os.path.exists(args.data):
@@ -1166,73 +3241,2619 @@ def validate_config(args):
         if ok:
             print(f"     ✅ {pkg}: {version}", flush=True)
         else:
-            issues.append(f"缺少必需包: {pkg} (需要版本 >= {min_ver})")
-            all_deps_ok = False
-    
-    if all_deps_ok:
-        checks_passed["dependencies"] = True
-    
-    # 检查 ultralytics 特定版本
-    try:
-        from ultralytics import __version__ as ultralytics_version
-        print(f"     📌 ultralytics 版本: {ultralytics_version}", flush=True)
-    except:
-        pass
-    
-    # 汇总结果
-    print("\n" + "="*50, flush=True)
-    print("📋 飞行前检查结果:", flush=True)
-    print("="*50, flush=True)
-    
-    passed_count = sum(checks_passed.values())
-    total_count = len(checks_passed)
-    
-    for check_name, passed in checks_passed.items():
-        status = "✅ 通过" if passed else "❌ 失败"
-        print(f"  {status}: {check_name}", flush=True)
-    
-    if warnings:
-        print("\n⚠️ 警告:", flush=True)
-        for w in warnings:
-            print(f"  - {w}", flush=True)
-    
-    if issues:
-        print("\n❌ 检查未通过:", flush=True)
-        for issue in issues:
-            print(f"  - {issue}", flush=True)
-        print("\n🚫 启动终止：配置验证失败", flush=True)
-        
-        log_json({
-            "event": "validation_failed",
-            "passed": passed_count,
-            "total": total_count,
-            "issues": issues,
-            "warnings": warnings
+            issues.append(f"缺少必需包: {pkg} (需要版本 >= {min_ver})")
+            all_deps_ok = False
+    
+    if all_deps_ok:
+        checks_passed["dependencies"] = True
+    
+    # 检查 ultralytics 特定版本
+    try:
+        from ultralytics import __version__ as ultralytics_version
+        print(f"     📌 ultralytics 版本: {ultralytics_version}", flush=True)
+    except:
+        pass
+    
+    # 汇总结果
+    print("\n" + "="*50, flush=True)
+    print("📋 飞行前检查结果:", flush=True)
+    print("="*50, flush=True)
+    
+    passed_count = sum(checks_passed.values())
+    total_count = len(checks_passed)
+    
+    for check_name, passed in checks_passed.items():
+        status = "✅ 通过" if passed else "❌ 失败"
+        print(f"  {status}: {check_name}", flush=True)
+    
+    if warnings:
+        print("\n⚠️ 警告:", flush=True)
+        for w in warnings:
+            print(f"  - {w}", flush=True)
+    
+    if issues:
+        print("\n❌ 检查未通过:", flush=True)
+        for issue in issues:
+            print(f"  - {issue}", flush=True)
+        print("\n🚫 启动终止：配置验证失败", flush=True)
+        
+        log_json({
+            "event": "validation_failed",
+            "passed": passed_count,
+            "total": total_count,
+            "issues": issues,
+            "warnings": warnings
+        })
+        
+        return False
+    
+    print(f"\n✅ 所有检查通过 ({passed_count}/{total_count})", flush=True)
+    print("="*50 + "\n", flush=True)
+    
+    if warnings:
+        log_json({
+            "event": "validation_passed_with_warnings",
+            "passed": passed_count,
+            "total": total_count,
+            "warnings": warnings
+        })
+    else:
+        log_json({
+            "event": "validation_passed",
+            "passed": passed_count,
+            "total": total_count
+        })
+    
+    return True
+
+def _iter_image_batches(directory, batch_size):
+    """流式遍历图片目录，按批次产出路径，避免一次性加载整个图片池"""
+    batch = []
+    for root, _, files in os.walk(directory):
+        for f in sorted(files):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                batch.append(os.path.join(root, f))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+def _image_cache_key(img_path):
+    st = os.stat(img_path)
+    return f"{os.path.abspath(img_path)}|{st.st_size}|{st.st_mtime_ns}"
+
+def _top_prediction(result):
+    """返回置信度最高的目标: (box_conf, xyxy, kpt_xy, kpt_conf)，无检测时返回 None"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return None
+    idx = int(boxes.conf.argmax())
+    kpt_xy, kpt_conf = None, None
+    if result.keypoints is not None:
+        kpt_xy = result.keypoints.xy[idx].cpu().numpy()
+        if result.keypoints.conf is not None:
+            kpt_conf = result.keypoints.conf[idx].cpu().numpy()
+    return float(boxes.conf[idx]), boxes.xyxy[idx].cpu().numpy(), kpt_xy, kpt_conf
+
+def score_uncertainty(result, flipped_result, image_width, flip_idx):
+    """综合三项不确定性：低框置信度、关键点置信度方差、水平翻转预测不一致"""
+    top = _top_prediction(result)
+    top_flipped = _top_prediction(flipped_result)
+
+    if top is None:
+        # 未检出目标：若翻转后能检出则说明模型摇摆不定，视为最不确定
+        return {
+            "box": 1.0,
+            "keypoint": 1.0,
+            "flip": 1.0 if top_flipped is not None else 0.0,
+            "num_detections": 0
+        }
+
+    box_conf, xyxy, kpt_xy, kpt_conf = top
+    box_term = 1.0 - box_conf
+
+    # 每个关键点视作伯努利变量，c*(1-c) 在 c=0.5 时最大为 0.25，归一化到 [0, 1]
+    kpt_term = float(np.mean(4.0 * kpt_conf * (1.0 - kpt_conf))) if kpt_conf is not None else 0.0
+
+    flip_term = 1.0
+    if top_flipped is not None and kpt_xy is not None and top_flipped[2] is not None:
+        unflipped = top_flipped[2][flip_idx].copy()
+        unflipped[:, 0] = image_width - unflipped[:, 0]
+        diag = max(float(np.hypot(xyxy[2] - xyxy[0], xyxy[3] - xyxy[1])), 1.0)
+        flip_term = float(min(np.linalg.norm(kpt_xy - unflipped, axis=1).mean() / diag, 1.0))
+
+    return {
+        "box": round(box_term, 4),
+        "keypoint": round(kpt_term, 4),
+        "flip": round(flip_term, 4),
+        "num_detections": len(result.boxes)
+    }
+
+def rank_unlabeled_images(args):
+    """主动学习：按不确定性对未标注图片池排序，输出可直接导入标注工具的清单"""
+    import heapq
+    import cv2
+
+    pool_dir = os.path.abspath(args.rank_unlabeled)
+    if not os.path.isdir(pool_dir):
+        raise FileNotFoundError(f"未标注图片目录不存在: {pool_dir}")
+
+    out_dir = os.path.join(args.project, args.name, 'active_learning')
+    os.makedirs(out_dir, exist_ok=True)
+
+    w_hash = weights_hash(args.model)
+    cache_path = os.path.join(out_dir, f"scores_{w_hash[:16]}.jsonl")
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    cache[entry["key"]] = entry
+                except (ValueError, KeyError):
+                    continue
+    print(f"🧠 主动学习排序: {pool_dir} (权重 {w_hash[:12]}, 已缓存 {len(cache)} 张)", flush=True)
+
+    model = YOLO(args.model)
+    flip_idx = None
+    top_k = args.rank_top_k if args.rank_top_k > 0 else None
+    heap = []
+    scored = reused = failed = 0
+    start = time.time()
+
+    def push(entry):
+        item = (entry["score"], entry["path"], entry)
+        if top_k is None or len(heap) < top_k:
+            heapq.heappush(heap, item)
+        elif item[0] > heap[0][0]:
+            heapq.heapreplace(heap, item)
+
+    with open(cache_path, 'a', encoding='utf-8') as cache_file:
+        for batch in _iter_image_batches(pool_dir, args.rank_batch):
+            if should_stop:
+                break
+
+            pending = []
+            for img_path in batch:
+                key = _image_cache_key(img_path)
+                if key in cache:
+                    push(cache[key])
+                    reused += 1
+                else:
+                    pending.append((key, img_path))
+
+            images = []
+            for key, img_path in pending:
+                img = cv2.imread(img_path)
+                if img is None:
+                    failed += 1
+                    continue
+                images.append((key, img_path, img))
+            if not images:
+                continue
+
+            frames = [img for _, _, img in images]
+            results = model.predict(
+                frames + [cv2.flip(img, 1) for img in frames],
+                imgsz=args.imgsz,
+                device=args.device,
+                conf=0.05,
+                verbose=False
+            )
+
+            for i, (key, img_path, img) in enumerate(images):
+                result, flipped = results[i], results[i + len(images)]
+                if flip_idx is None:
+                    num_kpts = result.keypoints.xy.shape[1] if result.keypoints is not None else 0
+                    flip_idx = load_flip_idx(args.data, num_kpts)
+                terms = score_uncertainty(result, flipped, img.shape[1], flip_idx)
+                entry = {
+                    "key": key,
+                    "path": img_path,
+                    "name": os.path.basename(img_path),
+                    "score": round((terms["box"] + terms["keypoint"] + terms["flip"]) / 3.0, 4),
+                    **terms
+                }
+                cache_file.write(json.dumps(entry) + '\n')
+                push(entry)
+                scored += 1
+
+            cache_file.flush()
+            del frames, images, results
+
+            log_json({
+                "event": "active_learning_progress",
+                "scored": scored,
+                "cached": reused,
+                "failed": failed,
+                "elapsed_s": round(time.time() - start, 1)
+            })
+
+    ranked = [entry for _, _, entry in sorted(heap, key=lambda x: x[0], reverse=True)]
+    for rank, entry in enumerate(ranked, 1):
+        entry.pop("key", None)
+        entry["rank"] = rank
+
+    manifest_path = os.path.join(out_dir, 'ranked_manifest.json')
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "source": pool_dir,
+            "weights": args.model,
+            "weights_hash": w_hash,
+            "created": time.time(),
+            "images": ranked
+        }, f, ensure_ascii=False, indent=2)
+
+    summary = {
+        "event": "active_learning_complete",
+        "manifest": manifest_path,
+        "ranked": len(ranked),
+        "scored": scored,
+        "cached": reused,
+        "failed": failed,
+        "elapsed_s": round(time.time() - start, 1)
+    }
+    log_json(summary)
+    print(f"✅ 排序完成: 新评分 {scored} 张, 复用缓存 {reused} 张, 清单已保存至 {manifest_path}", flush=True)
+    return summary
+
+def compute_phash(img_path):
+    """DCT 感知哈希 (pHash)，返回 64 位整数；读取失败返回 None"""
+    import cv2
+    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:8, :8].flatten()
+    bits = low_freq > np.median(low_freq[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount64(values):
+    return _POPCOUNT_TABLE[values.astype('>u8').view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+# 桶内汉明比较按行分块，每块最多比较这么多对，视频抽帧形成的大桶也不会一次分配 g×g 矩阵
+DEDUP_COMPARE_BLOCK = 1 << 22
+
+def find_near_duplicates(hashes, max_distance):
+    """多索引哈希：按鸽巢原理把 64 位哈希切成 max_distance+1 段，
+    距离 ≤ max_distance 的两条哈希至少有一段完全相同，只需在同段桶内做向量化汉明比较"""
+    if not 0 <= max_distance < 64:
+        # ≥64 时会出现零宽度的段，所有图片落进同一个桶，退化为全量两两比较
+        raise ValueError(f"近重复汉明距离阈值必须在 [0, 63] 范围内: {max_distance}")
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    num_chunks = max_distance + 1
+    bounds = np.linspace(0, 64, num_chunks + 1).astype(int)
+    pairs = set()
+
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        mask = np.uint64((1 << int(hi - lo)) - 1)
+        keys = (hashes >> np.uint64(lo)) & mask
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        split_points = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for group in np.split(order, split_points):
+            g = len(group)
+            if g < 2:
+                continue
+            gh = hashes[group]
+            rows = max(1, DEDUP_COMPARE_BLOCK // g)
+            for start in range(0, g - 1, rows):
+                # 只与其后的哈希比较（上三角），每块为 rows × (g - start)
+                block = gh[start:start + rows]
+                cols = gh[start:]
+                dist = _popcount64(np.bitwise_xor(block[:, None], cols[None, :]).ravel()).reshape(len(block), len(cols))
+                ii, jj = np.nonzero(np.triu(dist <= max_distance, k=1))
+                for a, b in zip(group[start + ii], group[start + jj]):
+                    pairs.add((int(min(a, b)), int(max(a, b))))
+
+    return sorted(pairs)
+
+def _cluster_pairs(n, pairs):
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def detect_near_duplicates(args):
+    """感知哈希近重复检测：报告 train/val 泄漏并给出精简后的训练集列表"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    abs_data_path = os.path.abspath(args.data)
+    data_config = load_data_config(abs_data_path)
+
+    entries = []
+    for split in ('train', 'val', 'test'):
+        for img_path in list_split_images(resolve_split_path(data_config, split)):
+            entries.append((split, os.path.abspath(img_path)))
+    if not entries:
+        raise FileNotFoundError(f"数据集中没有找到图片: {abs_data_path}")
+
+    cache_path = os.path.join(os.path.dirname(abs_data_path), '.phash_cache.json')
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception:
+            cache = {}
+
+    print(f"🔍 计算感知哈希: {len(entries)} 张图片 (缓存 {len(cache)} 条)", flush=True)
+    start = time.time()
+
+    keys = [_image_cache_key(p) for _, p in entries]
+    missing = [i for i, k in enumerate(keys) if k not in cache]
+    # cv2 解码与缩放会释放 GIL，线程池即可并行，避免子进程重复导入 ultralytics
+    with ThreadPoolExecutor(max_workers=max(1, os.cpu_count() or 1)) as pool:
+        for i, h in zip(missing, pool.map(compute_phash, [entries[i][1] for i in missing], chunksize=16)):
+            cache[keys[i]] = format(h, '016x') if h is not None else None
+
+    live_keys = set(keys)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump({k: v for k, v in cache.items() if k in live_keys}, f)
+    hash_time = time.time() - start
+
+    valid = [i for i, k in enumerate(keys) if cache.get(k)]
+    hashes = [int(cache[keys[i]], 16) for i in valid]
+    valid_entries = [entries[i] for i in valid]
+
+    search_start = time.time()
+    pairs = find_near_duplicates(hashes, args.dedup_threshold)
+    clusters = _cluster_pairs(len(valid_entries), pairs)
+    search_time = time.time() - search_start
+
+    leakage = []
+    for a, b in pairs:
+        splits = {valid_entries[a][0], valid_entries[b][0]}
+        if 'train' in splits and len(splits) > 1:
+            train_idx, other_idx = (a, b) if valid_entries[a][0] == 'train' else (b, a)
+            leakage.append({
+                "train": valid_entries[train_idx][1],
+                "other": valid_entries[other_idx][1],
+                "other_split": valid_entries[other_idx][0],
+                "distance": int(_popcount64(np.array([hashes[a] ^ hashes[b]], dtype=np.uint64))[0])
+            })
+
+    # 精简训练集：每个近重复簇只保留一张训练图片，并剔除与 val/test 近重复的训练图片
+    leaked_train = {item["train"] for item in leakage}
+    redundant_train = set()
+    for members in clusters:
+        train_members = sorted(valid_entries[i][1] for i in members if valid_entries[i][0] == 'train')
+        redundant_train.update(train_members[1:])
+
+    train_images = [p for split, p in entries if split == 'train']
+    thinned = [p for p in train_images if p not in redundant_train and p not in leaked_train]
+
+    out_dir = os.path.join(args.project, args.name, 'dedup')
+    thinned_list = write_image_list(thinned, os.path.join(out_dir, 'train_thinned.txt'))
+    thinned_yaml = write_derived_data_yaml(data_config, os.path.join(out_dir, 'data_thinned.yaml'), train=thinned_list)
+
+    report = {
+        "event": "dedup_report",
+        "total_images": len(entries),
+        "unreadable": len(entries) - len(valid),
+        "threshold": args.dedup_threshold,
+        "duplicate_pairs": len(pairs),
+        "clusters": len(clusters),
+        "leakage_pairs": len(leakage),
+        "train_before": len(train_images),
+        "train_after": len(thinned),
+        "removed_redundant": len(redundant_train - leaked_train),
+        "removed_leaked": len(leaked_train),
+        "epoch_reduction": round(1 - len(thinned) / len(train_images), 4) if train_images else 0.0,
+        "hash_time_s": round(hash_time, 2),
+        "search_time_s": round(search_time, 2),
+        "thinned_data_yaml": thinned_yaml
+    }
+
+    report_path = os.path.join(out_dir, 'dedup_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            **report,
+            "leakage": leakage,
+            "clusters_detail": [[valid_entries[i][1] for i in members] for members in clusters]
+        }, f, ensure_ascii=False, indent=2)
+
+    log_json({**report, "report_path": report_path})
+    print(f"   近重复对: {len(pairs)}, 泄漏对: {len(leakage)}, 训练集 {len(train_images)} -> {len(thinned)} 张", flush=True)
+    print(f"✅ 报告已保存至 {report_path}", flush=True)
+    return report
+
+def build_oom_ladder(args):
+    """OOM 降级阶梯：先逐级减半 batch，batch 降到最低后再逐级缩小 imgsz"""
+    if args.oom_batch_ladder:
+        batches = [int(b) for b in args.oom_batch_ladder.split(',') if b.strip()]
+    else:
+        batches, b = [], args.batch if args.batch > 0 else 16
+        while b > 1:
+            b //= 2
+            batches.append(b)
+
+    if args.oom_imgsz_ladder:
+        sizes = [int(s) for s in args.oom_imgsz_ladder.split(',') if s.strip()]
+    else:
+        sizes = [int(args.imgsz * f) // 32 * 32 for f in (0.75, 0.5)]
+        sizes = [s for s in sizes if 320 <= s < args.imgsz]
+
+    min_batch = batches[-1] if batches else args.batch
+    return [(b, args.imgsz) for b in batches] + [(min_batch, s) for s in sizes]
+
+_simulated_oom_done = False
+
+def simulate_oom_callback(epoch):
+    """测试用：在指定 epoch 开始时抛出一次 MemoryError，便于在 CPU 上验证 OOM 恢复流程"""
+    def callback(trainer):
+        global _simulated_oom_done
+        if not _simulated_oom_done and trainer.epoch == epoch:
+            _simulated_oom_done = True
+            raise MemoryError(f"simulated out of memory at epoch {epoch + 1}")
+    return callback
+
+def _free_memory():
+    import gc
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.ipc_collect()
+    except Exception:
+        pass
+
+def is_oom_error(e):
+    """直接按异常判断是否内存不足：torch.cuda.OutOfMemoryError 与 CPU 分配失败都带 "out of memory"，
+    MemoryError 来自 Python/numpy；不依赖 ERROR_MAPPINGS 的宽泛关键词"""
+    if isinstance(e, MemoryError) or "out of memory" in str(e).lower():
+        return True
+    return classify_error(f"{type(e).__name__}: {e}")["type"] == "memory"
+
+def train_with_oom_recovery(model, training_params, args, trainer_cls=None):
+    """执行 model.train；开启 --oom_recovery 时遇到显存/内存不足按阶梯降级并从 last.pt 续训。
+    返回 (results, model)，续训时 model 为重新加载 last.pt 的新实例"""
+    if not args.oom_recovery:
+        return model.train(trainer=trainer_cls, **training_params), model
+
+    ladder = build_oom_ladder(args)
+    last_pt = os.path.join(args.project, args.name, 'weights', 'last.pt')
+    params = dict(training_params)
+    attempt = 0
+    # exist_ok=True 且实验名固定，目录里可能留有旧实验的 last.pt，只认本次训练写入的
+    train_start = time.time()
+
+    while True:
+        try:
+            return model.train(trainer=trainer_cls, **params), model
+        except Exception as e:
+            error_msg = f"{type(e).__name__}: {e}"
+            if not is_oom_error(e) or attempt >= len(ladder):
+                raise
+
+            batch, imgsz = ladder[attempt]
+            attempt += 1
+            callbacks = model.callbacks
+            model = None
+            _free_memory()
+
+            resume_from = last_pt if os.path.exists(last_pt) and os.path.getmtime(last_pt) >= train_start else None
+            log_json({
+                "event": "recovered_oom",
+                "attempt": attempt,
+                "max_attempts": len(ladder),
+                "error": error_msg[:300],
+                "batch": batch,
+                "imgsz": imgsz,
+                "resume_from": resume_from
+            })
+            print(f"♻️ 内存不足，第 {attempt}/{len(ladder)} 次降级重试: batch={batch}, imgsz={imgsz}"
+                  f"{'，从 ' + resume_from + ' 续训' if resume_from else '，从头开始'}", flush=True)
+
+            if resume_from:
+                # ultralytics 续训时允许覆盖 batch / imgsz / device
+                model = YOLO(resume_from)
+                params = {'resume': True, 'batch': batch, 'imgsz': imgsz}
+            else:
+                model = YOLO(args.model)
+                params = {**params, 'batch': batch, 'imgsz': imgsz}
+            model.callbacks = callbacks
+
+def build_augment_params(args):
+    return {
+        'degrees': args.degrees,
+        'translate': args.translate,
+        'scale': args.scale,
+        'shear': args.shear,
+        'perspective': args.perspective,
+        'fliplr': args.fliplr,
+        'flipud': args.flipud,
+        'hsv_h': args.hsv_h,
+        'hsv_s': args.hsv_s,
+        'hsv_v': args.hsv_v,
+        'mosaic': args.mosaic,
+        'mixup': args.mixup,
+        'copy_paste': args.copy_paste,
+        'erasing': args.erasing,
+        'crop_fraction': args.crop_fraction,
+    }
+
+TEACHER_CACHE_MAX_DET = 20
+
+def _teacher_cache_arrays(cache_dir, index, mode='r'):
+    n, max_det, num_kpts = len(index["images"]), index["max_det"], index["num_keypoints"]
+    boxes = np.memmap(os.path.join(cache_dir, 'boxes.f16'), dtype=np.float16, mode=mode, shape=(max(n, 1), max_det, 6))
+    kpts = np.memmap(os.path.join(cache_dir, 'kpts.f16'), dtype=np.float16, mode=mode, shape=(max(n, 1), max_det, num_kpts, 3))
+    return boxes, kpts
+
+def build_teacher_cache(args, abs_data_path):
+    """蒸馏第一步：教师模型在训练集上批量推理一次，框 (cx, cy, w, h, conf, cls) 与
+    关键点 (x, y, conf) 以归一化 float16 写入内存映射文件，可被多次学生训练复用"""
+    data_config = load_data_config(abs_data_path)
+    images = [os.path.abspath(p) for p in list_split_images(resolve_split_path(data_config, 'train'))]
+    num_kpts = int(data_config.get('kpt_shape', [17, 3])[0])
+    t_hash = weights_hash(args.distill_teacher)
+
+    cache_dir = args.distill_cache or os.path.join(
+        os.path.dirname(abs_data_path), '.teacher_cache', f"{t_hash[:16]}_{args.imgsz}"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+
+    old_index = None
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            old_index = json.load(f)
+        if old_index.get("num_keypoints") != num_kpts or old_index.get("teacher_hash") != t_hash:
+            old_index = None
+        elif all(p in old_index["images"] for p in images):
+            print(f"✅ 复用教师缓存: {cache_dir} ({len(old_index['images'])} 张)", flush=True)
+            return cache_dir
+
+    index = {
+        "teacher": args.distill_teacher,
+        "teacher_hash": t_hash,
+        "imgsz": args.imgsz,
+        "max_det": TEACHER_CACHE_MAX_DET,
+        "num_keypoints": num_kpts,
+        "images": {p: row for row, p in enumerate(images)}
+    }
+
+    # 先写入临时文件，完成后再替换，避免中断留下半成品缓存
+    tmp_dir = cache_dir + '.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    boxes, kpts = _teacher_cache_arrays(tmp_dir, index, mode='w+')
+    boxes[:] = 0
+    kpts[:] = 0
+
+    pending = []
+    if old_index is not None:
+        old_boxes, old_kpts = _teacher_cache_arrays(cache_dir, old_index)
+        for p, row in index["images"].items():
+            old_row = old_index["images"].get(p)
+            if old_row is None:
+                pending.append(p)
+            else:
+                boxes[row] = old_boxes[old_row]
+                kpts[row] = old_kpts[old_row]
+        del old_boxes, old_kpts
+    else:
+        pending = images
+
+    print(f"🎓 教师模型推理: {args.distill_teacher} ({len(pending)} 张待处理, 共 {len(images)} 张)", flush=True)
+    teacher = YOLO(args.distill_teacher)
+    start = time.time()
+    batch_size = max(args.batch, 1)
+
+    for i in range(0, len(pending), batch_size):
+        if should_stop:
+            raise RuntimeError("教师缓存构建被中断")
+        batch = pending[i:i + batch_size]
+        results = teacher.predict(batch, imgsz=args.imgsz, device=args.device, conf=0.1,
+                                  max_det=TEACHER_CACHE_MAX_DET, verbose=False)
+        for img_path, result in zip(batch, results):
+            row = index["images"][img_path]
+            if result.boxes is None or len(result.boxes) == 0:
+                continue
+            n = min(len(result.boxes), TEACHER_CACHE_MAX_DET)
+            boxes[row, :n, :4] = result.boxes.xywhn[:n].cpu().numpy()
+            boxes[row, :n, 4] = result.boxes.conf[:n].cpu().numpy()
+            boxes[row, :n, 5] = result.boxes.cls[:n].cpu().numpy()
+            if result.keypoints is not None:
+                kpts[row, :n, :, :2] = result.keypoints.xyn[:n].cpu().numpy()
+                if result.keypoints.conf is not None:
+                    kpts[row, :n, :, 2] = result.keypoints.conf[:n].cpu().numpy()
+
+        log_json({
+            "event": "teacher_cache_progress",
+            "done": min(i + batch_size, len(pending)),
+            "total": len(pending),
+            "elapsed_s": round(time.time() - start, 1)
+        })
+
+    boxes.flush()
+    kpts.flush()
+    del boxes, kpts
+
+    with open(os.path.join(tmp_dir, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    for name in ('boxes.f16', 'kpts.f16', 'index.json'):
+        os.replace(os.path.join(tmp_dir, name), os.path.join(cache_dir, name))
+    os.rmdir(tmp_dir)
+
+    log_json({
+        "event": "teacher_cache_ready",
+        "cache_dir": cache_dir,
+        "images": len(images),
+        "inferred": len(pending),
+        "elapsed_s": round(time.time() - start, 1)
+    })
+    return cache_dir
+
+def encode_teacher_cls(cls, conf):
+    """教师实例的类别编码：-1 - cls - conf/2，负值与真值区分，小数部分携带框置信度（数据增强不改动 cls）"""
+    return -1.0 - cls - 0.5 * conf
+
+def decode_teacher_cls(encoded):
+    value = -1.0 - encoded
+    cls = value.floor()
+    return cls, ((value - cls) * 2).clamp(0, 1)
+
+def attach_teacher_targets(labels, cache_dir, kpt_conf, box_conf):
+    """把教师预测作为额外实例附加到训练标签（在数据增强之前，保证与图片同步变换），人工标注保持不变。
+    教师框置信度编码进类别（见 encode_teacher_cls），关键点可见性一栏存放关键点置信度，
+    损失计算时两者都作为软权重；低于 box_conf / kpt_conf 的框与关键点视为噪声直接忽略"""
+    with open(os.path.join(cache_dir, 'index.json'), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    boxes, kpts = _teacher_cache_arrays(cache_dir, index)
+
+    stats = {"images": 0, "teacher_instances": 0, "teacher_keypoints": 0}
+    for label in labels:
+        row = index["images"].get(os.path.abspath(label["im_file"]))
+        gt_kpts = label.get("keypoints")
+        if row is None or gt_kpts is None:
+            continue
+        t_boxes = np.asarray(boxes[row], dtype=np.float32)
+        keep = t_boxes[:, 4] >= box_conf
+        if not keep.any():
+            continue
+        t_boxes = t_boxes[keep]
+        t_kpts = np.asarray(kpts[row], dtype=np.float32)[keep]
+        if gt_kpts.shape[-1] == 3:
+            t_kpts[:, :, 2] = np.where(t_kpts[:, :, 2] >= kpt_conf, np.clip(t_kpts[:, :, 2], 0, 1), 0)
+            stats["teacher_keypoints"] += int((t_kpts[:, :, 2] > 0).sum())
+        else:
+            t_kpts = t_kpts[:, :, :2]
+
+        label["bboxes"] = np.concatenate([label["bboxes"], t_boxes[:, :4]]).astype(np.float32)
+        label["cls"] = np.concatenate(
+            [label["cls"], encode_teacher_cls(t_boxes[:, 5:6], np.clip(t_boxes[:, 4:5], 0, 1))]
+        ).astype(np.float32)
+        label["keypoints"] = np.concatenate([gt_kpts, t_kpts]).astype(np.float32)
+        stats["images"] += 1
+        stats["teacher_instances"] += len(t_boxes)
+
+    del boxes, kpts
+    return stats
+
+class PoseLossWeights:
+    """在 ultralytics v8PoseLoss 的逐元素损失上施加权重，分配器与批内归一化保持原样。
+    权重函数 fn(fg_mask, target_gt_idx) 返回 (batch, anchors) 张量：分类 BCE 与框损失按 anchor 加权，
+    关键点损失按前景 anchor（即所属实例）加权；多个权重同时生效时相乘。
+    soft_keypoints 时关键点误差按标签可见性一栏中的置信度加权，可见性损失以置信度为软目标"""
+
+    def __init__(self, criterion):
+        self._assigner = criterion.assigner
+        self._bce = criterion.bce
+        self._bbox_loss = criterion.bbox_loss
+        self._keypoint_loss = criterion.keypoint_loss
+        self._bce_pose = criterion.bce_pose
+        criterion.assigner = self.assign
+        criterion.bce = self.bce
+        criterion.bbox_loss = self.bbox_loss
+        criterion.keypoint_loss = self.keypoint_loss
+        criterion.bce_pose = self.bce_pose
+        self.weight_fns = []
+        self.soft_keypoints = False
+        self.anchor_weights = None
+        self.fg_mask = None
+        self.kpt_conf = None
+
+    @classmethod
+    def install(cls, criterion):
+        """每个 criterion 只安装一次；包装器（DistillationLoss 等）暴露同一个实例"""
+        weights = getattr(criterion, 'loss_weights', None)
+        if weights is None:
+            weights = cls(criterion)
+            criterion.loss_weights = weights
+        return weights
+
+    @contextlib.contextmanager
+    def apply(self, fn=None, soft_keypoints=False):
+        prev_soft = self.soft_keypoints
+        if fn is not None:
+            self.weight_fns.append(fn)
+        self.soft_keypoints = prev_soft or soft_keypoints
+        try:
+            yield
+        finally:
+            if fn is not None:
+                self.weight_fns.pop()
+            self.soft_keypoints = prev_soft
+
+    def assign(self, *a, **kw):
+        out = self._assigner(*a, **kw)
+        self.fg_mask, target_gt_idx = out[3], out[4]
+        self.anchor_weights = None
+        for fn in self.weight_fns:
+            w = fn(self.fg_mask, target_gt_idx)
+            self.anchor_weights = w if self.anchor_weights is None else self.anchor_weights * w
+        return out
+
+    def bce(self, pred, target):
+        loss = self._bce(pred, target)
+        return loss if self.anchor_weights is None else loss * self.anchor_weights[..., None].to(loss.dtype)
+
+    def bbox_loss(self, *a):
+        # 框损失与 DFL 都按 target_scores 之和加权，缩放它即逐 anchor 加权；归一化用的 target_scores_sum 不变
+        if self.anchor_weights is not None:
+            a = list(a)
+            a[4] = a[4] * self.anchor_weights[..., None].to(a[4].dtype)
+        return self._bbox_loss(*a)
+
+    def _row_weights(self):
+        return None if self.anchor_weights is None else self.anchor_weights[self.fg_mask]
+
+    def keypoint_loss(self, pred_kpt, gt_kpt, kpt_mask, area):
+        soft = self.soft_keypoints and gt_kpt.shape[-1] == 3
+        self.kpt_conf = gt_kpt[..., 2].clamp(0, 1) if soft else None
+        rows = self._row_weights()
+        if rows is None and not soft:
+            return self._keypoint_loss(pred_kpt, gt_kpt, kpt_mask, area)
+        # KeypointLoss 只用 mask != 0 计数，其余逐元素相乘，浮点权重可直接代替布尔 mask
+        weight = kpt_mask.float()
+        if rows is not None:
+            weight = weight * rows[:, None]
+        if soft:
+            weight = weight * self.kpt_conf
+        return self._keypoint_loss(pred_kpt, gt_kpt, weight, area)
+
+    def bce_pose(self, pred, target):
+        import torch.nn.functional as F
+
+        rows = self._row_weights()
+        if rows is None and self.kpt_conf is None:
+            return self._bce_pose(pred, target)
+        if self.kpt_conf is not None:
+            target = self.kpt_conf.to(pred.dtype)
+        loss = F.binary_cross_entropy_with_logits(pred, target, reduction='none')
+        if rows is not None:
+            loss = loss * rows[:, None].to(loss.dtype)
+        return loss.mean()
+
+class DistillationLoss:
+    """包装模型的 criterion：真值实例照常计算原损失；教师实例（负类别）单独组成目标再算一次，
+    作为蒸馏项按 alpha 加权叠加。蒸馏项中每个教师实例按框置信度加权、每个关键点按关键点置信度加权，
+    学到的是软目标而不是硬伪标签。返回的 loss_items 只含真值部分，训练日志与不蒸馏时可比"""
+
+    def __init__(self, criterion, alpha):
+        self.criterion = criterion
+        self.alpha = alpha
+        self.loss_weights = PoseLossWeights.install(criterion)
+
+    @staticmethod
+    def _instance_weights(conf, batch_idx, batch_size):
+        """按 ultralytics 损失预处理的顺序（每张图内保持原顺序）把实例权重排成 (batch, max_instances)"""
+        import torch
+
+        counts = torch.bincount(batch_idx.long(), minlength=batch_size)
+        table = conf.new_zeros(batch_size, max(int(counts.max()), 1))
+        for i in range(batch_size):
+            if counts[i]:
+                table[i, :counts[i]] = conf[batch_idx == i]
+        return table
+
+    def __call__(self, preds, batch):
+        import torch
+
+        teacher = batch["cls"].view(-1) < 0
+        if not teacher.any():
+            return self.criterion(preds, batch)
+
+        def select(mask, cls):
+            return {**batch, "cls": cls, "bboxes": batch["bboxes"][mask],
+                    "keypoints": batch["keypoints"][mask], "batch_idx": batch["batch_idx"][mask]}
+
+        loss, loss_items = self.criterion(preds, select(~teacher, batch["cls"][~teacher]))
+
+        t_cls, t_conf = decode_teacher_cls(batch["cls"][teacher])
+        batch_size = (preds if isinstance(preds[0], list) else preds[1])[1].shape[0]
+        table = self._instance_weights(t_conf.view(-1), batch["batch_idx"][teacher].view(-1), batch_size)
+
+        def instance_weights(fg_mask, target_gt_idx):
+            # 背景 anchor 仍按权重 1 计入分类损失
+            table_ = table.to(target_gt_idx.device)
+            return torch.where(fg_mask, table_.gather(1, target_gt_idx), torch.ones_like(table_[:, :1]))
+
+        with self.loss_weights.apply(instance_weights, soft_keypoints=True):
+            distill_loss, _ = self.criterion(preds, select(teacher, t_cls))
+        return loss + self.alpha * distill_loss, loss_items
+
+def make_distill_trainer(cache_dir, args, base_cls=None):
+    """返回带蒸馏项的 PoseTrainer 子类：训练集附加缓存的教师实例，损失在真值损失之外
+    再加 alpha × 教师目标损失；学生训练期间不再运行教师模型"""
+    from ultralytics.models.yolo.pose import PoseTrainer
+    from ultralytics.utils.torch_utils import de_parallel
+
+    base_cls = base_cls or PoseTrainer
+
+    class DistillPoseTrainer(base_cls):
+        def build_dataset(self, img_path, mode='train', batch=None):
+            dataset = super().build_dataset(img_path, mode, batch)
+            if mode == 'train':
+                stats = attach_teacher_targets(dataset.labels, cache_dir, args.distill_kpt_conf, args.distill_box_conf)
+                log_json({"event": "distill_targets_applied", "cache_dir": cache_dir, "alpha": args.distill_alpha, **stats})
+            return dataset
+
+        def preprocess_batch(self, batch):
+            batch = super().preprocess_batch(batch)
+            # 只包装一次：外层训练器（如重要性采样）可能再包装本 criterion
+            if getattr(self, '_distill_loss', None) is None:
+                model = de_parallel(self.model)
+                self._distill_loss = DistillationLoss(getattr(model, 'criterion', None) or model.init_criterion(),
+                                                      args.distill_alpha)
+                model.criterion = self._distill_loss
+            return batch
+
+        def plot_training_labels(self):
+            # 教师实例以负类别编码，标签分布图只统计人工标注
+            from ultralytics.utils.plotting import plot_labels
+            labels = self.train_loader.dataset.labels
+            boxes = np.concatenate([lb["bboxes"] for lb in labels], 0)
+            cls = np.concatenate([lb["cls"] for lb in labels], 0)
+            keep = cls.reshape(-1) >= 0
+            plot_labels(boxes[keep], cls[keep].squeeze(), names=self.data["names"], save_dir=self.save_dir,
+                        on_plot=self.on_plot)
+
+    return DistillPoseTrainer
+
+def pareto_front(points, cost_key, gain_key):
+    """返回 cost 越小、gain 越大意义下不被支配的点，按 cost 升序"""
+    front = []
+    for p in sorted(points, key=lambda x: (x[cost_key], -x[gain_key])):
+        if not front or p[gain_key] > front[-1][gain_key]:
+            front.append(p)
+    return front
+
+def _prunable_pairs(model):
+    """收集可独立剪枝的 (生产者 Conv, 消费者 conv) 对：
+    Bottleneck 内部 cv1->cv2，以及检测/姿态头各分支的中间层。
+    这些通道只在一对层之间流动，不涉及残差、concat 等跨层依赖"""
+    from ultralytics.nn.modules import Bottleneck, Conv, Detect
+
+    pairs = []
+    for m in model.modules():
+        if isinstance(m, Bottleneck):
+            pairs.append((m.cv1, m.cv2.conv))
+        elif isinstance(m, Detect):
+            branches = list(m.cv2) + list(m.cv3) + list(getattr(m, 'cv4', []))
+            for seq in branches:
+                layers = list(seq)
+                for a, b in zip(layers[:-1], layers[1:]):
+                    if isinstance(a, Conv):
+                        pairs.append((a, b.conv if isinstance(b, Conv) else b))
+
+    return [
+        (p, c) for p, c in pairs
+        if hasattr(p, 'bn') and p.conv.groups == 1 and c.groups == 1
+    ]
+
+def _prune_pair(producer, consumer, keep):
+    import torch
+    idx = torch.as_tensor(keep, dtype=torch.long, device=producer.conv.weight.device)
+    conv, bn = producer.conv, producer.bn
+
+    conv.weight = torch.nn.Parameter(conv.weight.data[idx].clone())
+    if conv.bias is not None:
+        conv.bias = torch.nn.Parameter(conv.bias.data[idx].clone())
+    conv.out_channels = len(keep)
+
+    bn.weight = torch.nn.Parameter(bn.weight.data[idx].clone())
+    bn.bias = torch.nn.Parameter(bn.bias.data[idx].clone())
+    bn.running_mean = bn.running_mean[idx].clone()
+    bn.running_var = bn.running_var[idx].clone()
+    bn.num_features = len(keep)
+
+    consumer.weight = torch.nn.Parameter(consumer.weight.data[:, idx].clone())
+    consumer.in_channels = len(keep)
+
+def prune_channels(model, ratio, round_to=8):
+    """按 BN gamma 绝对值做全局阈值结构化剪枝（原地修改），每层保留通道数向上取整到 round_to 的倍数"""
+    pairs = _prunable_pairs(model)
+    if not pairs or ratio <= 0:
+        return {"pairs": len(pairs), "removed_channels": 0}
+
+    gammas = np.concatenate([p.bn.weight.detach().abs().cpu().numpy() for p, _ in pairs])
+    threshold = np.quantile(gammas, ratio)
+
+    removed = 0
+    for producer, consumer in pairs:
+        gamma = producer.bn.weight.detach().abs().cpu().numpy()
+        n = len(gamma)
+        keep_count = int((gamma > threshold).sum())
+        keep_count = min(n, max(round_to, int(np.ceil(keep_count / round_to)) * round_to))
+        if keep_count >= n:
+            continue
+        keep = np.sort(np.argsort(-gamma)[:keep_count])
+        _prune_pair(producer, consumer, keep.tolist())
+        removed += n - keep_count
+
+    return {"pairs": len(pairs), "removed_channels": removed}
+
+def make_pruned_trainer(pruned_model):
+    """微调用 PoseTrainer：直接使用剪枝后的网络，而不是按 yaml 重新构建原始宽度模型"""
+    from ultralytics.models.yolo.pose import PoseTrainer
+
+    class PrunedPoseTrainer(PoseTrainer):
+        def get_model(self, cfg=None, weights=None, verbose=True):
+            model = pruned_model.float()
+            for p in model.parameters():
+                p.requires_grad = True
+            return model
+
+    return PrunedPoseTrainer
+
+def _measure_candidate(weights_path, args, abs_data_path):
+    """CPU 延迟 (PerformanceBenchmark) + 姿态 mAP"""
+    from ultralytics.utils.torch_utils import get_flops
+
+    candidate = YOLO(weights_path)
+    gflops = float(get_flops(candidate.model, args.imgsz) or 0.0)
+
+    benchmark = PerformanceBenchmark(model=candidate, device='cpu', imgsz=args.imgsz)
+    latency = benchmark.measure_inference_latency(num_runs=args.prune_latency_runs, warmup=3)
+
+    val_results = candidate.val(data=abs_data_path, batch=args.batch, imgsz=args.imgsz,
+                                device=args.device, plots=False, verbose=False)
+    metrics = extract_val_metrics(val_results)
+
+    return {
+        "weights": weights_path,
+        "gflops": round(gflops, 2),
+        "cpu_latency_ms": latency["mean_ms"],
+        "cpu_latency_p95_ms": latency["p95_ms"],
+        "pose_mAP50-95": metrics.get("pose_mAP50-95", 0.0),
+        "pose_mAP50": metrics.get("pose_mAP50", 0.0)
+    }
+
+def prune_and_finetune(args):
+    """训练后剪枝：按多个剪枝率生成候选，短暂微调恢复精度，在 CPU 上测量延迟并输出 Pareto 集"""
+    import copy
+    import torch
+    from ultralytics.utils.torch_utils import get_flops
+
+    abs_data_path = os.path.abspath(args.data)
+    run_dir = os.path.join(args.project, args.name)
+    base_weights = args.prune_weights or os.path.join(run_dir, 'weights', 'best.pt')
+    if not os.path.exists(base_weights):
+        raise FileNotFoundError(f"找不到待剪枝的权重: {base_weights}")
+
+    prune_dir = os.path.join(run_dir, 'prune')
+    os.makedirs(prune_dir, exist_ok=True)
+
+    ratios = sorted({float(r) for r in args.prune_ratios.split(',') if r.strip()})
+
+    base_model = YOLO(base_weights).model
+    base_gflops = float(get_flops(base_model, args.imgsz) or 0.0)
+
+    if args.prune_target_gflops > 0 and base_gflops > 0:
+        # FLOPs 不需要微调即可计算，先二分搜索出满足 FLOPs 预算的剪枝率
+        lo, hi = 0.0, 0.95
+        for _ in range(8):
+            mid = (lo + hi) / 2
+            trial = copy.deepcopy(base_model)
+            prune_channels(trial, mid)
+            if get_flops(trial, args.imgsz) <= args.prune_target_gflops:
+                hi = mid
+            else:
+                lo = mid
+        ratios = sorted(set(ratios) | {round(hi, 3)})
+        print(f"✂️ 满足 {args.prune_target_gflops} GFLOPs 预算的剪枝率: {hi:.3f}", flush=True)
+
+    print(f"✂️ 结构化剪枝: {base_weights} (原始 {base_gflops:.2f} GFLOPs), 剪枝率 {ratios}", flush=True)
+
+    candidates = [{"ratio": 0.0, **_measure_candidate(base_weights, args, abs_data_path)}]
+    log_json({"event": "prune_candidate", **candidates[0]})
+
+    for ratio in ratios:
+        if should_stop:
+            break
+        pruned = copy.deepcopy(base_model)
+        prune_stats = prune_channels(pruned, ratio)
+        tag = f"ratio_{int(round(ratio * 100)):02d}"
+        pruned_path = os.path.join(prune_dir, f"{tag}_pruned.pt")
+        torch.save({"model": copy.deepcopy(pruned).half(), "train_args": {}, "epoch": -1}, pruned_path)
+        print(f"   {tag}: 移除 {prune_stats['removed_channels']} 个通道，开始微调 {args.prune_finetune_epochs} 轮", flush=True)
+
+        finetune = YOLO(pruned_path)
+        finetune.train(
+            trainer=make_pruned_trainer(pruned),
+            data=abs_data_path,
+            epochs=args.prune_finetune_epochs,
+            batch=args.batch,
+            imgsz=args.imgsz,
+            device=args.device,
+            workers=args.workers,
+            project=prune_dir,
+            name=tag,
+            warmup_epochs=0,
+            exist_ok=True,
+            plots=False,
+            verbose=False
+        )
+
+        finetuned_path = os.path.join(prune_dir, tag, 'weights', 'best.pt')
+        candidate = {
+            "ratio": ratio,
+            "removed_channels": prune_stats["removed_channels"],
+            **_measure_candidate(finetuned_path, args, abs_data_path)
+        }
+        candidates.append(candidate)
+        log_json({"event": "prune_candidate", **candidate})
+
+    for c in candidates:
+        c["meets_budget"] = (
+            (args.prune_target_gflops <= 0 or c["gflops"] <= args.prune_target_gflops)
+            and (args.prune_target_latency_ms <= 0 or c["cpu_latency_ms"] <= args.prune_target_latency_ms)
+        )
+
+    front = pareto_front(candidates, "cpu_latency_ms", "pose_mAP50-95")
+    report = {
+        "event": "prune_complete",
+        "base_weights": base_weights,
+        "candidates": candidates,
+        "pareto": [c["ratio"] for c in front],
+        "pareto_candidates": front
+    }
+    with open(os.path.join(prune_dir, 'prune_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log_json(report)
+
+    print("📊 Pareto 候选 (CPU 延迟 / Pose mAP@50-95):", flush=True)
+    for c in front:
+        flag = "✅" if c["meets_budget"] else "⚠️ 超出预算"
+        print(f"   ratio={c['ratio']:.2f}: {c['cpu_latency_ms']:.1f}ms, {c['pose_mAP50-95']:.4f}, {c['gflops']} GFLOPs {flag}", flush=True)
+    return report
+
+OKS_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+def keypoint_sigmas(num_kpts):
+    """与 ultralytics 一致：17 点使用 COCO sigma，其余关键点数使用均匀 sigma"""
+    if num_kpts == 17:
+        from ultralytics.utils.metrics import OKS_SIGMA
+        return np.asarray(OKS_SIGMA)
+    return np.ones(num_kpts) / num_kpts
+
+def oks_matrix(kpts_a, kpts_b, areas_b, sigmas):
+    """kpts_a: (n, K, 3)，kpts_b: (m, K, 3) 参考关键点（第 3 维 >0 视为有效），areas_b: (m,) -> (n, m)"""
+    d2 = ((kpts_a[:, None, :, :2] - kpts_b[None, :, :, :2]) ** 2).sum(-1)
+    e = d2 / ((2 * sigmas) ** 2 * (areas_b[None, :, None] + 1e-9) * 2)
+    mask = kpts_b[None, :, :, 2] > 0
+    return (np.exp(-e) * mask).sum(-1) / (mask.sum(-1) + 1e-9)
+
+def box_intersection_over_smaller(boxes):
+    """xyxy 框两两交集 / 较小框面积，用于识别被切片截断后包含在完整检测中的片段"""
+    lt = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    rb = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    areas = (boxes[:, 2:] - boxes[:, :2]).prod(-1)
+    return inter / np.maximum(np.minimum(areas[:, None], areas[None, :]), 1e-9)
+
+def load_pose_labels(label_path, width, height, num_kpts):
+    """读取 YOLO-pose 标签并转换为像素坐标: (boxes xyxy (m, 4), kpts (m, K, 3))"""
+    boxes, kpts = [], []
+    if os.path.exists(label_path):
+        with open(label_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                values = [float(v) for v in line.split()]
+                if len(values) < 5 + num_kpts * 2:
+                    continue
+                cx, cy, w, h = values[1:5]
+                boxes.append([(cx - w / 2) * width, (cy - h / 2) * height, (cx + w / 2) * width, (cy + h / 2) * height])
+                raw = np.asarray(values[5:], dtype=np.float32)
+                ndim = 3 if len(raw) == num_kpts * 3 else 2
+                raw = raw.reshape(num_kpts, ndim)
+                k = np.full((num_kpts, 3), 2.0, dtype=np.float32)
+                k[:, 0], k[:, 1] = raw[:, 0] * width, raw[:, 1] * height
+                if ndim == 3:
+                    k[:, 2] = raw[:, 2]
+                kpts.append(k)
+    return (np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+            np.asarray(kpts, dtype=np.float32).reshape(-1, num_kpts, 3))
+
+def match_predictions(sim, pred_conf, num_gt, thresholds=OKS_THRESHOLDS):
+    """按置信度降序贪心匹配，返回每个预测在各阈值下是否为 TP: (n, T)"""
+    tp = np.zeros((len(pred_conf), len(thresholds)), dtype=bool)
+    if num_gt == 0 or len(pred_conf) == 0:
+        return tp
+    order = np.argsort(-pred_conf)
+    for ti, t in enumerate(thresholds):
+        used = np.zeros(num_gt, dtype=bool)
+        for i in order:
+            cand = np.where(~used & (sim[i] >= t), sim[i], -1.0)
+            j = int(cand.argmax())
+            if cand[j] >= t:
+                used[j] = True
+                tp[i, ti] = True
+    return tp
+
+def interpolated_ap(recall, precision):
+    """COCO 101 点插值 AP，recall / precision 为按置信度降序累计的一维曲线"""
+    if len(recall) == 0:
+        return 0.0
+    envelope = np.maximum.accumulate(precision[::-1])[::-1]
+    idx = np.searchsorted(recall, np.linspace(0, 1, 101), side='left')
+    return float(np.mean(np.where(idx < len(envelope), envelope[np.minimum(idx, len(envelope) - 1)], 0.0)))
+
+def average_precision_from_similarity(per_image, thresholds=OKS_THRESHOLDS, return_curve=False):
+    """按相似度 (OKS 或 IoU) 贪心匹配后的 AP (COCO 101 点插值)。
+    per_image: [(sim (n, m), pred_conf (n,), num_gt), ...]"""
+    confs, tps, num_gt = [], [], 0
+    for sim, pred_conf, image_gt in per_image:
+        num_gt += image_gt
+        if len(pred_conf) == 0:
+            continue
+        confs.append(pred_conf)
+        tps.append(match_predictions(sim, pred_conf, image_gt, thresholds))
+
+    if not confs or num_gt == 0:
+        metrics = {"mAP50": 0.0, "mAP50-95": 0.0, "precision": 0.0, "recall": 0.0, "num_gt": num_gt}
+        return (metrics, None) if return_curve else metrics
+
+    order = np.argsort(-np.concatenate(confs))
+    tp = np.concatenate(tps)[order]
+    ctp = np.cumsum(tp, axis=0)
+    cfp = np.cumsum(~tp, axis=0)
+    recall = ctp / num_gt
+    precision = ctp / np.maximum(ctp + cfp, 1)
+    aps = [interpolated_ap(recall[:, ti], precision[:, ti]) for ti in range(len(thresholds))]
+
+    metrics = {
+        "mAP50": round(aps[0], 4),
+        "mAP50-95": round(float(np.mean(aps)), 4),
+        "precision": round(float(precision[-1, 0]), 4),
+        "recall": round(float(recall[-1, 0]), 4),
+        "num_gt": num_gt
+    }
+    if return_curve:
+        return metrics, (recall[:, 0], precision[:, 0])
+    return metrics
+
+def pose_average_precision(per_image, sigmas, thresholds=OKS_THRESHOLDS):
+    """OKS 姿态 AP。
+    per_image: [(pred_kpts (n, K, 3), pred_conf (n,), gt_kpts (m, K, 3), gt_boxes (m, 4)), ...]"""
+    sims = []
+    for pred_kpts, pred_conf, gt_kpts, gt_boxes in per_image:
+        if len(pred_kpts) and len(gt_kpts):
+            areas = (gt_boxes[:, 2:] - gt_boxes[:, :2]).prod(-1) * 0.53
+            sim = oks_matrix(pred_kpts, gt_kpts, areas, sigmas)
+        else:
+            sim = np.zeros((len(pred_kpts), len(gt_kpts)))
+        sims.append((sim, pred_conf, len(gt_kpts)))
+
+    metrics = average_precision_from_similarity(sims, thresholds)
+    return {
+        "pose_mAP50": metrics["mAP50"],
+        "pose_mAP50-95": metrics["mAP50-95"],
+        "precision": metrics["precision"],
+        "recall": metrics["recall"],
+        "num_gt": metrics["num_gt"]
+    }
+
+def _result_arrays(result, offset=(0, 0)):
+    """ultralytics Results -> (boxes xyxy, conf, kpts (n, K, 3))，坐标平移 offset"""
+    if result.boxes is None or len(result.boxes) == 0:
+        k = result.keypoints.xy.shape[1] if result.keypoints is not None else 0
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros((0, k, 3), np.float32)
+    boxes = result.boxes.xyxy.cpu().numpy().astype(np.float32)
+    conf = result.boxes.conf.cpu().numpy().astype(np.float32)
+    xy = result.keypoints.xy.cpu().numpy().astype(np.float32)
+    kconf = result.keypoints.conf.cpu().numpy().astype(np.float32) if result.keypoints.conf is not None else np.ones(xy.shape[:2], np.float32)
+    kpts = np.concatenate([xy, kconf[..., None]], axis=-1)
+    ox, oy = offset
+    boxes[:, [0, 2]] += ox
+    boxes[:, [1, 3]] += oy
+    kpts[:, :, 0] += ox
+    kpts[:, :, 1] += oy
+    return boxes, conf, kpts
+
+def merge_detections_oks(boxes, conf, kpts, sigmas, oks_thr=0.5, ios_thr=0.6):
+    """跨切片合并：OKS 或“交集/较小框”超过阈值的检测视为同一目标。
+    合并后框取并集，每个关键点取组内该点置信度最高的预测（切片边缘被截断的关键点置信度低）"""
+    if len(boxes) <= 1:
+        return boxes, conf, kpts
+    areas = (boxes[:, 2:] - boxes[:, :2]).prod(-1) * 0.53
+    ref = kpts.copy()
+    ref[:, :, 2] = (kpts[:, :, 2] > 0.5).astype(np.float32)
+    oks = oks_matrix(kpts, ref, areas, sigmas)
+    linked = (np.maximum(oks, oks.T) > oks_thr) | (box_intersection_over_smaller(boxes) > ios_thr)
+
+    merged_boxes, merged_conf, merged_kpts = [], [], []
+    assigned = np.zeros(len(boxes), dtype=bool)
+    for i in np.argsort(-conf):
+        if assigned[i]:
+            continue
+        members = np.flatnonzero(linked[i] & ~assigned)
+        assigned[members] = True
+        group_kpts = kpts[members]
+        best = group_kpts[:, :, 2].argmax(axis=0)
+        merged_kpts.append(group_kpts[best, np.arange(kpts.shape[1])])
+        merged_boxes.append(np.concatenate([boxes[members, :2].min(0), boxes[members, 2:].max(0)]))
+        merged_conf.append(conf[i])
+
+    return np.asarray(merged_boxes), np.asarray(merged_conf), np.asarray(merged_kpts)
+
+def _tile_origins(length, tile, overlap):
+    if length <= tile:
+        return [0]
+    stride = max(int(tile * (1 - overlap)), 1)
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+def predict_sliced(model, img, args):
+    """切片推理：重叠切片批量送入模型，映射回原图坐标后按 OKS 合并；可选叠加整帧预测"""
+    tile = args.tile_size or args.imgsz
+    h, w = img.shape[:2]
+    tiles, offsets = [], []
+    for y in _tile_origins(h, tile, args.tile_overlap):
+        for x in _tile_origins(w, tile, args.tile_overlap):
+            tiles.append(img[y:y + tile, x:x + tile])
+            offsets.append((x, y))
+
+    parts = []
+    for i in range(0, len(tiles), args.tile_batch):
+        results = model.predict(tiles[i:i + args.tile_batch], imgsz=tile, device=args.device, conf=args.tile_conf, verbose=False)
+        parts += [_result_arrays(r, off) for r, off in zip(results, offsets[i:i + args.tile_batch])]
+
+    if args.tile_full_frame:
+        parts.append(_result_arrays(model.predict(img, imgsz=args.imgsz, device=args.device, conf=args.tile_conf, verbose=False)[0]))
+
+    boxes = np.concatenate([p[0] for p in parts])
+    conf = np.concatenate([p[1] for p in parts])
+    kpts = np.concatenate([p[2] for p in parts])
+    merged = merge_detections_oks(boxes, conf, kpts, keypoint_sigmas(kpts.shape[1]), args.tile_merge_oks)
+    return merged, len(tiles)
+
+def sliced_predict(args):
+    """高分辨率切片推理：对图片/目录输出合并后的检测结果"""
+    import cv2
+
+    source = os.path.abspath(args.sliced_predict)
+    images = [source] if os.path.isfile(source) else [p for batch in _iter_image_batches(source, 64) for p in batch]
+    if not images:
+        raise FileNotFoundError(f"没有找到待推理图片: {source}")
+
+    model = YOLO(args.model)
+    predictions, total_tiles = [], 0
+    start = time.time()
+
+    for img_path in images:
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        (boxes, conf, kpts), num_tiles = predict_sliced(model, img, args)
+        total_tiles += num_tiles
+        predictions.append({
+            "image": img_path,
+            "width": img.shape[1],
+            "height": img.shape[0],
+            "tiles": num_tiles,
+            "detections": [
+                {"box": b.round(1).tolist(), "conf": round(float(c), 4), "keypoints": k.round(2).tolist()}
+                for b, c, k in zip(boxes, conf, kpts)
+            ]
+        })
+
+    elapsed = time.time() - start
+    out_dir = os.path.join(args.project, args.name)
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, 'sliced_predictions.json')
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(predictions, f)
+
+    summary = {
+        "event": "sliced_predict_complete",
+        "images": len(predictions),
+        "tiles": total_tiles,
+        "tiles_per_sec": round(total_tiles / elapsed, 1) if elapsed > 0 else 0.0,
+        "images_per_sec": round(len(predictions) / elapsed, 2) if elapsed > 0 else 0.0,
+        "output": out_path
+    }
+    log_json(summary)
+    print(f"✅ 切片推理完成: {len(predictions)} 张, {total_tiles} 个切片 ({summary['tiles_per_sec']} 切片/秒)", flush=True)
+    return summary
+
+def sliced_validate(args):
+    """在验证集上对比整帧推理与切片推理的姿态精度与吞吐"""
+    import cv2
+
+    abs_data_path = os.path.abspath(args.data)
+    data_config = load_data_config(abs_data_path)
+    num_kpts = int(data_config.get('kpt_shape', [17, 3])[0])
+    sigmas = keypoint_sigmas(num_kpts)
+    images = list_split_images(resolve_split_path(data_config, 'val'))
+    if not images:
+        raise FileNotFoundError("验证集中没有图片")
+
+    model = YOLO(args.model)
+    whole, sliced = [], []
+    whole_time = sliced_time = 0.0
+    total_tiles = 0
+
+    for img_path in images:
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        gt_boxes, gt_kpts = load_pose_labels(image_to_label_path(img_path), img.shape[1], img.shape[0], num_kpts)
+
+        t0 = time.perf_counter()
+        boxes, conf, kpts = _result_arrays(model.predict(img, imgsz=args.imgsz, device=args.device, conf=args.tile_conf, verbose=False)[0])
+        whole_time += time.perf_counter() - t0
+        whole.append((kpts, conf, gt_kpts, gt_boxes))
+
+        t0 = time.perf_counter()
+        (boxes, conf, kpts), num_tiles = predict_sliced(model, img, args)
+        sliced_time += time.perf_counter() - t0
+        total_tiles += num_tiles
+        sliced.append((kpts, conf, gt_kpts, gt_boxes))
+
+    whole_metrics = pose_average_precision(whole, sigmas)
+    sliced_metrics = pose_average_precision(sliced, sigmas)
+    report = {
+        "event": "sliced_validation",
+        "images": len(whole),
+        "whole_frame": whole_metrics,
+        "sliced": sliced_metrics,
+        "gain": {k: round(sliced_metrics[k] - whole_metrics[k], 4) for k in ("pose_mAP50", "pose_mAP50-95", "precision", "recall")},
+        "tiles": total_tiles,
+        "tiles_per_sec": round(total_tiles / sliced_time, 1) if sliced_time > 0 else 0.0,
+        "whole_frame_ms_per_image": round(whole_time / max(len(whole), 1) * 1000, 1),
+        "sliced_ms_per_image": round(sliced_time / max(len(sliced), 1) * 1000, 1)
+    }
+    log_json(report)
+    print(f"📊 Pose mAP@50-95: 整帧 {whole_metrics['pose_mAP50-95']:.4f} -> 切片 {sliced_metrics['pose_mAP50-95']:.4f} ({report['gain']['pose_mAP50-95']:+.4f})", flush=True)
+    print(f"   切片吞吐: {report['tiles_per_sec']} 切片/秒, 每张 {report['sliced_ms_per_image']}ms (整帧 {report['whole_frame_ms_per_image']}ms)", flush=True)
+    return report
+
+PREDICTION_STORE_MIN_CONF = 0.001
+PREDICTION_STORE_MAX_CANDIDATES = 1000
+PREDICTION_STORE_ARRAYS = ('pred_offsets', 'pred_boxes', 'pred_conf', 'pred_cls', 'pred_kpts',
+                           'gt_offsets', 'gt_boxes', 'gt_kpts')
+
+def prediction_store_key(model_path, images, imgsz):
+    """(权重哈希, 验证集内容, imgsz) 决定缓存目录；图片或标签变化都会使缓存失效"""
+    import hashlib
+    h = hashlib.sha256()
+    h.update(weights_hash(model_path).encode('utf-8'))
+    h.update(f"|{imgsz}|{PREDICTION_STORE_MIN_CONF}|{PREDICTION_STORE_MAX_CANDIDATES}".encode('utf-8'))
+    _hash_split_contents(h, images)
+    return h.hexdigest()[:16]
+
+def _hash_split_contents(h, images):
+    """把图片与对应标签的内容标识依次写入哈希"""
+    for img_path in images:
+        h.update(_image_cache_key(img_path).encode('utf-8'))
+        label_path = image_to_label_path(img_path)
+        if os.path.exists(label_path):
+            st = os.stat(label_path)
+            h.update(f"|{st.st_size}|{st.st_mtime_ns}".encode('utf-8'))
+
+def build_prediction_store(model, model_path, data_yaml, args):
+    """对验证集推理一次，把 NMS 前的候选框（conf >= 0.001，每张最多 1000 个）与真值按列存为 .npy。
+    已存在相同键的缓存时直接返回目录"""
+    import cv2
+
+    data_config = load_data_config(data_yaml)
+    num_kpts = int(data_config.get('kpt_shape', [17, 3])[0])
+    images = list_split_images(resolve_split_path(data_config, 'val'))
+    if not images:
+        raise FileNotFoundError("验证集中没有图片")
+
+    store_dir = os.path.join(args.prediction_store, prediction_store_key(model_path, images, args.imgsz))
+    if os.path.exists(os.path.join(store_dir, 'meta.json')):
+        print(f"♻️ 复用预测缓存: {store_dir}", flush=True)
+        return store_dir
+    os.makedirs(store_dir, exist_ok=True)
+
+    print(f"🗃️ 构建预测缓存: {len(images)} 张验证图片 -> {store_dir}", flush=True)
+    columns = {name: [] for name in PREDICTION_STORE_ARRAYS if not name.endswith('_offsets')}
+    pred_counts, gt_counts, shapes = [], [], []
+    start = time.time()
+
+    for i in range(0, len(images), args.batch):
+        batch = images[i:i + args.batch]
+        # iou=1.0 时 NMS 不抑制任何框，得到的就是经过置信度过滤的原始候选，坐标已映射回原图
+        results = model.predict(batch, imgsz=args.imgsz, device=args.device, conf=PREDICTION_STORE_MIN_CONF,
+                                iou=1.0, max_det=PREDICTION_STORE_MAX_CANDIDATES, verbose=False)
+        for img_path, result in zip(batch, results):
+            height, width = result.orig_shape
+            boxes, conf, kpts = _result_arrays(result)
+            cls = result.boxes.cls.cpu().numpy().astype(np.int16) if len(conf) else np.zeros(0, np.int16)
+            gt_boxes, gt_kpts = load_pose_labels(image_to_label_path(img_path), width, height, num_kpts)
+
+            columns['pred_boxes'].append(boxes)
+            columns['pred_conf'].append(conf)
+            columns['pred_cls'].append(cls)
+            columns['pred_kpts'].append(kpts.reshape(-1, num_kpts, 3))
+            columns['gt_boxes'].append(gt_boxes)
+            columns['gt_kpts'].append(gt_kpts)
+            pred_counts.append(len(conf))
+            gt_counts.append(len(gt_boxes))
+            shapes.append([height, width])
+
+    for name, parts in columns.items():
+        np.save(os.path.join(store_dir, f"{name}.npy"), np.concatenate(parts))
+    np.save(os.path.join(store_dir, 'pred_offsets.npy'), np.concatenate([[0], np.cumsum(pred_counts)]).astype(np.int64))
+    np.save(os.path.join(store_dir, 'gt_offsets.npy'), np.concatenate([[0], np.cumsum(gt_counts)]).astype(np.int64))
+
+    meta = {
+        "model_path": os.path.abspath(model_path),
+        "weights_hash": weights_hash(model_path),
+        "data": os.path.abspath(data_yaml),
+        "imgsz": args.imgsz,
+        "num_kpts": num_kpts,
+        "min_conf": PREDICTION_STORE_MIN_CONF,
+        "max_candidates": PREDICTION_STORE_MAX_CANDIDATES,
+        "images": images,
+        "shapes": shapes,
+        "created": time.time()
+    }
+    # meta.json 最后写入，作为缓存完整的标记
+    _write_json_atomic(os.path.join(store_dir, 'meta.json'), meta)
+
+    log_json({
+        "event": "prediction_store_built",
+        "store": store_dir,
+        "images": len(images),
+        "candidates": int(sum(pred_counts)),
+        "time_s": round(time.time() - start, 2)
+    })
+    return store_dir
+
+def load_prediction_store(store_dir):
+    """以内存映射方式打开缓存，只有实际访问到的列才会读盘"""
+    with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+        store = {"meta": json.load(f), "dir": store_dir}
+    for name in PREDICTION_STORE_ARRAYS:
+        store[name] = np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode='r')
+    return store
+
+def nms_numpy(boxes, conf, cls, iou_threshold, max_det=300):
+    """与 ultralytics 一致的按类别 NMS（类别偏移技巧），返回保留下标（按置信度降序）"""
+    order = np.argsort(-conf)
+    shifted = boxes[order] + (cls[order, None].astype(np.float32) * 7680)
+    iou = box_iou_xyxy(shifted, shifted)
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if len(keep) >= max_det:
+            break
+        suppressed |= iou[i] > iou_threshold
+    return order[keep]
+
+def store_image_predictions(store, index, conf_threshold, iou_threshold, max_det=300):
+    """取出第 index 张图在给定阈值下的最终检测: (boxes, conf, kpts)"""
+    lo, hi = store['pred_offsets'][index], store['pred_offsets'][index + 1]
+    conf = np.asarray(store['pred_conf'][lo:hi])
+    mask = conf >= conf_threshold
+    boxes = np.asarray(store['pred_boxes'][lo:hi])[mask]
+    kpts = np.asarray(store['pred_kpts'][lo:hi])[mask]
+    cls = np.asarray(store['pred_cls'][lo:hi])[mask]
+    conf = conf[mask]
+    if len(conf) == 0:
+        return boxes, conf, kpts
+    keep = nms_numpy(boxes, conf, cls, iou_threshold, max_det)
+    return boxes[keep], conf[keep], kpts[keep]
+
+def store_ground_truth(store, index):
+    lo, hi = store['gt_offsets'][index], store['gt_offsets'][index + 1]
+    return np.asarray(store['gt_boxes'][lo:hi]), np.asarray(store['gt_kpts'][lo:hi])
+
+def oks_matches(kpts, conf, gt_kpts, gt_boxes, sigmas, threshold=0.5):
+    """单张图的 OKS 矩阵，以及按置信度贪心匹配上的 (预测关键点, 真值关键点, sigmas, 面积)，供 per_keypoint_report 使用"""
+    if not len(conf) or not len(gt_kpts):
+        return np.zeros((len(conf), len(gt_kpts))), []
+    areas = (gt_boxes[:, 2:] - gt_boxes[:, :2]).prod(-1) * 0.53
+    oks = oks_matrix(kpts, gt_kpts, areas, sigmas)
+    used = np.zeros(len(gt_kpts), dtype=bool)
+    matches = []
+    for p in np.argsort(-conf):
+        cand = np.where(~used & (oks[p] >= threshold), oks[p], -1.0)
+        j = int(cand.argmax())
+        if cand[j] >= threshold:
+            used[j] = True
+            matches.append((kpts[p], gt_kpts[j], sigmas, areas[j]))
+    return oks, matches
+
+def per_keypoint_report(matches, num_kpts, kpt_conf):
+    """按关键点统计 OKS 0.5 匹配上的实例: 单点相似度 >= 0.5 的比例、平均像素误差、预测可见率"""
+    keypoints = []
+    for k in range(num_kpts):
+        ks, err, visible = [], [], []
+        for pred, gt, sigmas, area in matches:
+            if gt[k, 2] <= 0:
+                continue
+            d2 = ((pred[k, :2] - gt[k, :2]) ** 2).sum()
+            ks.append(np.exp(-d2 / ((2 * sigmas[k]) ** 2 * (area + 1e-9) * 2)))
+            err.append(np.sqrt(d2))
+            visible.append(pred[k, 2] >= kpt_conf)
+        pck = float(np.mean(np.asarray(ks) >= 0.5)) if ks else 0.0
+        keypoints.append({
+            "keypoint_id": k,
+            "ap": round(pck, 4),
+            "pck": round(pck, 4),
+            "mean_oks": round(float(np.mean(ks)), 4) if ks else 0.0,
+            "mean_error_px": round(float(np.mean(err)), 2) if err else None,
+            "visibility": round(float(np.mean(visible)), 4) if visible else 0.0,
+            "num_gt": len(ks)
+        })
+    return keypoints
+
+def rescore_prediction_store(store, conf_threshold=0.001, iou_threshold=0.7, kpt_conf=0.5, max_det=300, curves=False):
+    """只用缓存重新计算 box / pose AP 与关键点细分指标，不再运行模型"""
+    num_kpts = store["meta"]["num_kpts"]
+    sigmas = keypoint_sigmas(num_kpts)
+    box_sims, pose_sims, matches = [], [], []
+
+    for i in range(len(store["meta"]["images"])):
+        boxes, conf, kpts = store_image_predictions(store, i, conf_threshold, iou_threshold, max_det)
+        gt_boxes, gt_kpts = store_ground_truth(store, i)
+        oks, image_matches = oks_matches(kpts, conf, gt_kpts, gt_boxes, sigmas)
+        matches.extend(image_matches)
+        iou = box_iou_xyxy(boxes, gt_boxes) if len(conf) and len(gt_boxes) else np.zeros((len(conf), len(gt_boxes)))
+        box_sims.append((iou, conf, len(gt_boxes)))
+        pose_sims.append((oks, conf, len(gt_boxes)))
+
+    box_metrics = average_precision_from_similarity(box_sims, return_curve=curves)
+    pose_metrics = average_precision_from_similarity(pose_sims, return_curve=curves)
+    report = {
+        "conf": conf_threshold,
+        "iou": iou_threshold,
+        "kpt_conf": kpt_conf,
+        "box": box_metrics[0] if curves else box_metrics,
+        "pose": pose_metrics[0] if curves else pose_metrics,
+        "keypoints": per_keypoint_report(matches, num_kpts, kpt_conf)
+    }
+    if curves:
+        report["curves"] = {"box": box_metrics[1], "pose": pose_metrics[1]}
+    return report
+
+def plot_store_pr_curves(curves, output_path):
+    """根据缓存重算的 PR 曲线作图（IoU / OKS 0.5）"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(6, 5))
+    for name, curve in curves.items():
+        if curve is not None:
+            ax.plot(curve[0], curve[1], label=name)
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1.01)
+    ax.legend()
+    fig.savefig(output_path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+    return output_path
+
+def rescore_predictions(args):
+    """独立工具模式：在缓存上按新的 conf / IoU / 关键点置信度阈值重算指标，缓存不存在时先构建"""
+    if not args.prediction_store:
+        raise ValueError("--rescore 需要同时指定 --prediction_store")
+    model = YOLO(args.model)
+    store_dir = build_prediction_store(model, args.model, os.path.abspath(args.data), args)
+    store = load_prediction_store(store_dir)
+
+    start = time.time()
+    report = rescore_prediction_store(store, args.rescore_conf, args.rescore_iou, args.rescore_kpt_conf, curves=True)
+    plot_path = os.path.join(store_dir, f"PR_curve_conf{args.rescore_conf}_iou{args.rescore_iou}.png")
+    try:
+        plot_store_pr_curves(report.pop("curves"), plot_path)
+    except Exception as e:
+        print(f"⚠️ 绘制 PR 曲线失败: {e}", flush=True)
+        plot_path = None
+
+    log_json({"event": "rescore_metrics", "store": store_dir, "pr_curve": plot_path,
+              "time_s": round(time.time() - start, 2), **report})
+    print(f"📊 重算指标 (conf={args.rescore_conf}, iou={args.rescore_iou}, 耗时 {time.time() - start:.1f}s):", flush=True)
+    print(f"   Box  mAP@50: {report['box']['mAP50']:.4f}  mAP@50-95: {report['box']['mAP50-95']:.4f}", flush=True)
+    print(f"   Pose mAP@50: {report['pose']['mAP50']:.4f}  mAP@50-95: {report['pose']['mAP50-95']:.4f}", flush=True)
+    return report
+
+def parse_float_list(spec):
+    return sorted({float(v) for v in spec.split(',') if v.strip()})
+
+def nms_keep_grid(iou, iou_thresholds, max_det=300):
+    """对按置信度降序排列的候选一次性计算多个 IoU 阈值下的贪心 NMS 保留掩码: (T_iou, n)。
+    低置信度框不会影响高置信度框的去留，因此 conf 阈值只需在结果上截断，不必重跑 NMS"""
+    thresholds = np.asarray(iou_thresholds)[:, None]
+    n = iou.shape[0]
+    suppressed = np.zeros((len(thresholds), n), dtype=bool)
+    keep = np.zeros((len(thresholds), n), dtype=bool)
+    for i in range(n):
+        alive = ~suppressed[:, i]
+        if not alive.any():
+            continue
+        keep[:, i] = alive
+        suppressed |= alive[:, None] & (iou[i][None, :] > thresholds)
+    keep &= np.cumsum(keep, axis=1) <= max_det
+    return keep
+
+def keypoint_similarity(pred_kpts, gt_kpts, gt_boxes, sigmas):
+    """逐关键点相似度 (n, m, K) 与真值可见掩码 (m, K)，OKS 为其在可见点上的均值"""
+    areas = (gt_boxes[:, 2:] - gt_boxes[:, :2]).prod(-1) * 0.53
+    d2 = ((pred_kpts[:, None, :, :2] - gt_kpts[None, :, :, :2]) ** 2).sum(-1)
+    ks = np.exp(-d2 / ((2 * sigmas) ** 2 * (areas[None, :, None] + 1e-9) * 2))
+    return ks, gt_kpts[:, :, 2] > 0
+
+def sweep_thresholds(store, conf_grid, iou_grid, kpt_grid, max_det=300):
+    """在 conf × IoU × 关键点置信度网格上计算 OKS 姿态指标。
+    每张图的 IoU 矩阵与逐点相似度只算一次；关键点置信度低于阈值的点视为未输出，不计入 OKS"""
+    conf_grid, iou_grid, kpt_grid = np.asarray(conf_grid), np.asarray(iou_grid), np.asarray(kpt_grid)
+    sigmas = keypoint_sigmas(store["meta"]["num_kpts"])
+    acc_conf = [[[] for _ in kpt_grid] for _ in iou_grid]
+    acc_tp = [[[] for _ in kpt_grid] for _ in iou_grid]
+    post_nms = np.zeros((len(conf_grid), len(iou_grid)))
+    num_gt, num_images = 0, len(store["meta"]["images"])
+
+    for idx in range(num_images):
+        lo, hi = store['pred_offsets'][idx], store['pred_offsets'][idx + 1]
+        conf = np.asarray(store['pred_conf'][lo:hi])
+        order = np.argsort(-conf)
+        order = order[conf[order] >= conf_grid.min()]
+        conf = conf[order]
+        boxes = np.asarray(store['pred_boxes'][lo:hi])[order]
+        kpts = np.asarray(store['pred_kpts'][lo:hi])[order]
+        cls = np.asarray(store['pred_cls'][lo:hi])[order]
+        gt_boxes, gt_kpts = store_ground_truth(store, idx)
+        num_gt += len(gt_boxes)
+        if len(conf) == 0:
+            continue
+
+        shifted = boxes + cls[:, None].astype(np.float32) * 7680
+        keep = nms_keep_grid(box_iou_xyxy(shifted, shifted), iou_grid, max_det)
+        post_nms += (keep[None, :, :] & (conf[None, None, :] >= conf_grid[:, None, None])).sum(-1)
+
+        if len(gt_boxes):
+            ks, visible = keypoint_similarity(kpts, gt_kpts, gt_boxes, sigmas)
+        for j, kt in enumerate(kpt_grid):
+            if len(gt_boxes):
+                counted = (kpts[:, None, :, 2] >= kt) & visible[None, :, :]
+                oks = (ks * counted).sum(-1) / (visible.sum(-1)[None, :] + 1e-9)
+            for i in range(len(iou_grid)):
+                sel = keep[i]
+                acc_conf[i][j].append(conf[sel])
+                if len(gt_boxes):
+                    acc_tp[i][j].append(match_predictions(oks[sel], conf[sel], len(gt_boxes)))
+                else:
+                    acc_tp[i][j].append(np.zeros((int(sel.sum()), len(OKS_THRESHOLDS)), dtype=bool))
+
+    grid = []
+    for i, iou_t in enumerate(iou_grid):
+        for j, kpt_t in enumerate(kpt_grid):
+            confs = np.concatenate(acc_conf[i][j]) if acc_conf[i][j] else np.zeros(0)
+            tps = np.concatenate(acc_tp[i][j]) if acc_tp[i][j] else np.zeros((0, len(OKS_THRESHOLDS)), dtype=bool)
+            order = np.argsort(-confs)
+            confs, tps = confs[order], tps[order]
+            ctp = np.cumsum(tps, axis=0)
+            cfp = np.cumsum(~tps, axis=0)
+            recall = ctp / max(num_gt, 1)
+            precision = ctp / np.maximum(ctp + cfp, 1)
+            # conf 阈值 c 对应排序后前 count 个预测
+            counts = np.searchsorted(-confs, -conf_grid, side='right')
+            for c, (conf_t, count) in enumerate(zip(conf_grid, counts)):
+                p = float(precision[count - 1, 0]) if count else 0.0
+                r = float(recall[count - 1, 0]) if count else 0.0
+                aps = [interpolated_ap(recall[:count, t], precision[:count, t]) for t in range(len(OKS_THRESHOLDS))]
+                grid.append({
+                    "conf": round(float(conf_t), 4),
+                    "iou": round(float(iou_t), 4),
+                    "kpt_conf": round(float(kpt_t), 4),
+                    "precision": round(p, 4),
+                    "recall": round(r, 4),
+                    "f1": round(2 * p * r / (p + r), 4) if p + r > 0 else 0.0,
+                    "pose_mAP50": round(aps[0], 4),
+                    "pose_mAP50-95": round(float(np.mean(aps)), 4),
+                    "boxes_per_image": round(float(post_nms[c, i]) / max(num_images, 1), 2)
+                })
+    return grid
+
+def select_operating_point(grid, target_precision=0.0, target_recall=0.0):
+    """目标精度下取召回最高的点，目标召回下取精度最高的点，都未指定时取 F1 最高的点"""
+    if target_precision > 0:
+        candidates = [g for g in grid if g["precision"] >= target_precision]
+        key = lambda g: (g["recall"], g["pose_mAP50-95"], g["conf"])
+    elif target_recall > 0:
+        candidates = [g for g in grid if g["recall"] >= target_recall]
+        key = lambda g: (g["precision"], g["pose_mAP50-95"], g["conf"])
+    else:
+        candidates = grid
+        key = lambda g: (g["f1"], g["pose_mAP50-95"], g["conf"])
+    return max(candidates, key=key) if candidates else None
+
+def measure_postprocess_latency(store, conf_grid, iou_threshold, runs=3):
+    """各 conf 阈值下每张图 NMS 后处理的耗时，与 NMS 前候选数 / NMS 后框数对应"""
+    num_images = len(store["meta"]["images"])
+    rows = []
+    for conf_t in conf_grid:
+        candidates = kept = 0
+        start = time.perf_counter()
+        for _ in range(runs):
+            for idx in range(num_images):
+                _, conf, _ = store_image_predictions(store, idx, conf_t, iou_threshold)
+                kept += len(conf)
+        elapsed = time.perf_counter() - start
+        for idx in range(num_images):
+            lo, hi = store['pred_offsets'][idx], store['pred_offsets'][idx + 1]
+            candidates += int((np.asarray(store['pred_conf'][lo:hi]) >= conf_t).sum())
+        rows.append({
+            "conf": round(float(conf_t), 4),
+            "candidates_per_image": round(candidates / max(num_images, 1), 2),
+            "boxes_per_image": round(kept / runs / max(num_images, 1), 2),
+            "postprocess_ms": round(elapsed / runs / max(num_images, 1) * 1000, 4)
+        })
+
+    fit = None
+    if len({r["candidates_per_image"] for r in rows}) > 1:
+        slope, intercept = np.polyfit([r["candidates_per_image"] for r in rows], [r["postprocess_ms"] for r in rows], 1)
+        fit = {"ms_per_candidate": round(float(slope), 5), "base_ms": round(float(intercept), 4)}
+    return rows, fit
+
+def threshold_sweep(args):
+    """独立工具模式：在预测缓存上扫描部署阈值，给出满足目标精度/召回的工作点"""
+    if not args.prediction_store:
+        raise ValueError("--sweep 需要同时指定 --prediction_store")
+    model = YOLO(args.model)
+    store = load_prediction_store(build_prediction_store(model, args.model, os.path.abspath(args.data), args))
+    conf_grid = parse_float_list(args.sweep_conf)
+    iou_grid = parse_float_list(args.sweep_iou)
+    kpt_grid = parse_float_list(args.sweep_kpt_conf)
+
+    start = time.time()
+    grid = sweep_thresholds(store, conf_grid, iou_grid, kpt_grid)
+    sweep_time = time.time() - start
+    best = select_operating_point(grid, args.sweep_target_precision, args.sweep_target_recall)
+    iou_for_latency = best["iou"] if best else args.rescore_iou
+    latency, latency_fit = measure_postprocess_latency(store, conf_grid, iou_for_latency)
+
+    report = {
+        "event": "threshold_sweep",
+        "store": store["dir"],
+        "grid_size": len(grid),
+        "sweep_time_s": round(sweep_time, 2),
+        "target_precision": args.sweep_target_precision,
+        "target_recall": args.sweep_target_recall,
+        "best": best,
+        "postprocess_latency": latency,
+        "postprocess_latency_fit": latency_fit
+    }
+    output_path = os.path.join(store["dir"], 'threshold_sweep.json')
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({**report, "grid": grid}, f, indent=2)
+    report["output"] = output_path
+    log_json(report)
+
+    print(f"🎚️ 阈值扫描: {len(grid)} 个组合，耗时 {sweep_time:.1f}s", flush=True)
+    if best:
+        print(f"   推荐工作点: conf={best['conf']}, iou={best['iou']}, kpt_conf={best['kpt_conf']} -> "
+              f"P={best['precision']:.3f} R={best['recall']:.3f} Pose mAP@50-95={best['pose_mAP50-95']:.4f}", flush=True)
+    else:
+        print("⚠️ 网格中没有满足目标的工作点", flush=True)
+    for row in latency:
+        print(f"   conf={row['conf']:<6} 候选 {row['candidates_per_image']:>8.1f} -> 保留 {row['boxes_per_image']:>6.1f} 框/图, "
+              f"后处理 {row['postprocess_ms']:.3f}ms", flush=True)
+    return report
+
+def imgsz_pareto_sweep(args):
+    """独立工具模式：在多个推理尺寸下评估同一权重，验证集图片只解码一次。
+    记录各尺寸的姿态 mAP、关键点误差与 CPU 延迟，输出 Pareto 前沿与满足精度容差的最小尺寸"""
+    import cv2
+
+    sizes = sorted({int(v) for v in args.imgsz_sweep.split(',') if v.strip()})
+    bad = [s for s in sizes if s % 32 != 0]
+    if bad:
+        raise ValueError(f"推理尺寸必须是 32 的倍数: {bad}")
+
+    abs_data_path = os.path.abspath(args.data)
+    data_config = load_data_config(abs_data_path)
+    num_kpts = int(data_config.get('kpt_shape', [17, 3])[0])
+    sigmas = keypoint_sigmas(num_kpts)
+
+    print("🖼️ 解码验证集图片（各尺寸共用）...", flush=True)
+    samples = []
+    for img_path in list_split_images(resolve_split_path(data_config, 'val')):
+        img = cv2.imread(img_path)
+        if img is None:
+            continue
+        gt_boxes, gt_kpts = load_pose_labels(image_to_label_path(img_path), img.shape[1], img.shape[0], num_kpts)
+        samples.append((img, gt_boxes, gt_kpts))
+    if not samples:
+        raise FileNotFoundError("验证集中没有可读取的图片")
+
+    model = YOLO(args.model)
+    # 预测器在首次 predict 时按 device 构建，之后传入的 device 会被忽略；CPU 计时用单独的实例
+    cpu_model = YOLO(args.model)
+    latency_images = [img for img, _, _ in samples[:args.imgsz_latency_images]]
+    points = []
+    for size in sizes:
+        per_image, matches = [], []
+        for i in range(0, len(samples), args.batch):
+            chunk = samples[i:i + args.batch]
+            results = model.predict([img for img, _, _ in chunk], imgsz=size, device=args.device,
+                                    conf=PREDICTION_STORE_MIN_CONF, verbose=False)
+            for (img, gt_boxes, gt_kpts), result in zip(chunk, results):
+                _, conf, kpts = _result_arrays(result)
+                per_image.append((kpts, conf, gt_kpts, gt_boxes))
+                matches.extend(oks_matches(kpts, conf, gt_kpts, gt_boxes, sigmas)[1])
+        metrics = pose_average_precision(per_image, sigmas)
+        keypoints = per_keypoint_report(matches, num_kpts, args.rescore_kpt_conf)
+
+        for img in latency_images[:3]:
+            cpu_model.predict(img, imgsz=size, device='cpu', verbose=False)
+        times = []
+        for img in latency_images:
+            start = time.perf_counter()
+            cpu_model.predict(img, imgsz=size, device='cpu', verbose=False)
+            times.append((time.perf_counter() - start) * 1000)
+
+        errors = [k["mean_error_px"] for k in keypoints if k["mean_error_px"] is not None]
+        point = {
+            "imgsz": size,
+            "pose_mAP50": metrics["pose_mAP50"],
+            "pose_mAP50-95": metrics["pose_mAP50-95"],
+            "precision": metrics["precision"],
+            "recall": metrics["recall"],
+            "mean_keypoint_error_px": round(float(np.mean(errors)), 2) if errors else None,
+            "keypoints": keypoints,
+            "cpu_latency_ms": round(float(np.mean(times)), 2),
+            "cpu_latency_p95_ms": round(float(np.percentile(times, 95)), 2)
+        }
+        points.append(point)
+        print(f"   imgsz={size}: Pose mAP@50-95 {point['pose_mAP50-95']:.4f}, 关键点误差 {point['mean_keypoint_error_px']}px, "
+              f"CPU {point['cpu_latency_ms']:.1f}ms", flush=True)
+
+    best_map = max(p["pose_mAP50-95"] for p in points)
+    within = [p for p in points if p["pose_mAP50-95"] >= best_map - args.imgsz_tolerance]
+    recommended = min(within, key=lambda p: p["imgsz"])
+    front = pareto_front(points, "cpu_latency_ms", "pose_mAP50-95")
+
+    report = {
+        "event": "imgsz_sweep",
+        "model": args.model,
+        "images": len(samples),
+        "tolerance": args.imgsz_tolerance,
+        "points": points,
+        "pareto_front": [p["imgsz"] for p in front],
+        "recommended_imgsz": recommended["imgsz"],
+        "recommended": {k: v for k, v in recommended.items() if k != "keypoints"}
+    }
+    log_json(report)
+    print(f"📐 Pareto 前沿尺寸: {report['pareto_front']}", flush=True)
+    print(f"✅ 精度容差 {args.imgsz_tolerance} 内的最小尺寸: {recommended['imgsz']} "
+          f"(mAP@50-95 {recommended['pose_mAP50-95']:.4f} / 最佳 {best_map:.4f}, CPU {recommended['cpu_latency_ms']:.1f}ms)", flush=True)
+    return report
+
+VIDEO_QUEUE_SIZE = 32
+
+def box_iou_xyxy(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(-1)
+    area_a = (a[:, 2:] - a[:, :2]).prod(-1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(-1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+class KeypointTracker:
+    """轻量关键点跟踪：IoU 贪心关联 + 按关键点置信度加权的指数平滑"""
+
+    def __init__(self, iou_threshold=0.3, max_age=5, smooth_alpha=0.6):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.smooth_alpha = smooth_alpha
+        self.tracks = {}
+        self.next_id = 1
+
+    def update(self, boxes, conf, kpts):
+        ids = list(self.tracks)
+        assigned = {}
+        if ids and len(boxes):
+            iou = box_iou_xyxy(np.array([self.tracks[i]["box"] for i in ids]), boxes)
+            while iou.size:
+                t, d = np.unravel_index(iou.argmax(), iou.shape)
+                if iou[t, d] < self.iou_threshold:
+                    break
+                assigned[int(d)] = ids[t]
+                iou[t, :] = -1
+                iou[:, d] = -1
+
+        for d in range(len(boxes)):
+            tid = assigned.get(d)
+            if tid is None:
+                tid = self.next_id
+                self.next_id += 1
+                self.tracks[tid] = {"box": boxes[d].copy(), "kpts": kpts[d].copy(), "conf": float(conf[d]), "age": 0}
+                continue
+            track = self.tracks[tid]
+            w = self.smooth_alpha * kpts[d][:, 2:3]
+            track["kpts"][:, :2] = w * kpts[d][:, :2] + (1 - w) * track["kpts"][:, :2]
+            track["kpts"][:, 2] = kpts[d][:, 2]
+            track["box"] = self.smooth_alpha * boxes[d] + (1 - self.smooth_alpha) * track["box"]
+            track["conf"] = float(conf[d])
+            track["age"] = 0
+
+        matched = set(assigned.values())
+        for tid in ids:
+            if tid not in matched:
+                self.tracks[tid]["age"] += 1
+                if self.tracks[tid]["age"] > self.max_age:
+                    del self.tracks[tid]
+
+        return {
+            tid: {"box": t["box"].copy(), "kpts": t["kpts"].copy(), "conf": t["conf"]}
+            for tid, t in self.tracks.items() if t["age"] == 0
+        }
+
+def interpolate_tracks(prev, cur, alpha):
+    """跳帧插值：两侧都存在的轨迹线性插值，仅前一帧存在的轨迹保持不动"""
+    frame = {}
+    for tid, p in prev.items():
+        c = cur.get(tid)
+        if c is None:
+            frame[tid] = p
+        else:
+            frame[tid] = {
+                "box": p["box"] + alpha * (c["box"] - p["box"]),
+                "kpts": p["kpts"] + alpha * (c["kpts"] - p["kpts"]),
+                "conf": p["conf"]
+            }
+    return frame
+
+class VideoInferencePipeline:
+    """视频推理流水线：解码线程 -> 批量推理 -> 跟踪/平滑 -> 写出，各级之间为有界队列。
+    画面运动量低于阈值时跳过推理，由跟踪阶段在相邻两次推理结果之间插值"""
+
+    STAGES = ("decode", "inference", "tracking", "writer")
+
+    def __init__(self, model, args):
+        self.model = model
+        self.args = args
+        self.tracker = KeypointTracker(max_age=args.track_max_age, smooth_alpha=args.smooth_alpha)
+        self.stats = {name: {"frames": 0, "busy_s": 0.0} for name in self.STAGES}
+        self.inferred_frames = 0
+        self.error = None
+        self.start_time = None
+
+    def _put(self, q, item):
+        import queue
+        while True:
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if self.error is not None:
+                    return False
+
+    def _get(self, q):
+        import queue
+        while True:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                if self.error is not None:
+                    return None
+
+    def _run_stage(self, name, fn, *queues):
+        try:
+            fn(*queues)
+        except Exception as e:
+            self.error = f"{name}: {e}"
+            print(f"❌ 视频流水线 {name} 阶段出错: {e}", flush=True)
+        finally:
+            if queues and name != "writer":
+                self._put(queues[-1], None)
+
+    def _record(self, name, t0, frames=1):
+        self.stats[name]["frames"] += frames
+        self.stats[name]["busy_s"] += time.perf_counter() - t0
+
+    def _decode(self, cap, out_q):
+        import cv2
+        prev_small = None
+        skipped = 0
+        idx = 0
+        while not should_stop and self.error is None:
+            t0 = time.perf_counter()
+            ok, frame = cap.read()
+            if not ok:
+                break
+            small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA)
+            skip = False
+            if prev_small is not None and skipped < self.args.max_skip:
+                motion = float(np.mean(cv2.absdiff(small, prev_small))) / 255.0
+                skip = motion < self.args.motion_threshold
+            if skip:
+                skipped += 1
+            else:
+                skipped = 0
+                prev_small = small
+            self._record("decode", t0)
+            if not self._put(out_q, (idx, frame, skip)):
+                return
+            idx += 1
+
+    def _infer(self, in_q, out_q):
+        import queue
+        done = False
+        while not done:
+            item = self._get(in_q)
+            if item is None:
+                break
+            chunk = [item]
+            while sum(1 for c in chunk if not c[2]) < self.args.video_batch:
+                try:
+                    nxt = in_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    done = True
+                    break
+                chunk.append(nxt)
+
+            t0 = time.perf_counter()
+            to_infer = [c[1] for c in chunk if not c[2]]
+            results = self.model.predict(to_infer, imgsz=self.args.imgsz, device=self.args.device,
+                                         conf=self.args.tile_conf, verbose=False) if to_infer else []
+            detections = iter([_result_arrays(r) for r in results])
+            self.inferred_frames += len(to_infer)
+            self._record("inference", t0, len(chunk))
+
+            for idx, frame, skip in chunk:
+                if not self._put(out_q, (idx, frame, None if skip else next(detections))):
+                    return
+
+    def _track(self, in_q, out_q):
+        pending, prev = [], None
+        while True:
+            item = self._get(in_q)
+            if item is None:
+                break
+            idx, frame, det = item
+            if det is None and prev is not None:
+                pending.append((idx, frame))
+                continue
+
+            t0 = time.perf_counter()
+            cur = self.tracker.update(*det) if det is not None else {}
+            emitted = []
+            for j, (pidx, pframe) in enumerate(pending):
+                emitted.append((pidx, pframe, interpolate_tracks(prev, cur, (j + 1) / (len(pending) + 1)), True))
+            emitted.append((idx, frame, cur, False))
+            self._record("tracking", t0, len(emitted))
+
+            for out in emitted:
+                if not self._put(out_q, out):
+                    return
+            pending, prev = [], cur
+
+        for pidx, pframe in pending:
+            self._put(out_q, (pidx, pframe, prev or {}, True))
+
+    def _write(self, in_q, writer, tracks_file):
+        import cv2
+        while True:
+            item = self._get(in_q)
+            if item is None:
+                break
+            idx, frame, tracks, interpolated = item
+            t0 = time.perf_counter()
+            if writer is not None:
+                for tid, t in tracks.items():
+                    x1, y1, x2, y2 = [int(v) for v in t["box"]]
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                    cv2.putText(frame, f"#{tid}", (x1, max(y1 - 4, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                    for x, y, c in t["kpts"]:
+                        if c > 0.5:
+                            cv2.circle(frame, (int(x), int(y)), 3, (0, 0, 255), -1)
+                writer.write(frame)
+            tracks_file.write(json.dumps({
+                "frame": idx,
+                "interpolated": interpolated,
+                "tracks": [
+                    {"id": tid, "box": np.round(t["box"], 1).tolist(), "conf": round(t["conf"], 4),
+                     "keypoints": np.round(t["kpts"], 2).tolist()}
+                    for tid, t in tracks.items()
+                ]
+            }) + '\n')
+            self._record("writer", t0)
+
+            if self.stats["writer"]["frames"] % self.args.video_log_interval == 0:
+                log_json({"event": "video_progress", **self.stage_summary()})
+
+    def stage_summary(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        stage_fps = {
+            name: round(s["frames"] / s["busy_s"], 1) if s["busy_s"] > 0 else 0.0
+            for name, s in self.stats.items()
+        }
+        return {
+            "frames": self.stats["writer"]["frames"],
+            "inferred_frames": self.inferred_frames,
+            "skipped_frames": self.stats["decode"]["frames"] - self.inferred_frames,
+            "wall_fps": round(self.stats["writer"]["frames"] / elapsed, 1) if elapsed > 0 else 0.0,
+            "stage_fps": stage_fps,
+            "bottleneck": min(stage_fps, key=stage_fps.get) if any(stage_fps.values()) else None
+        }
+
+    def run(self, source, output_dir):
+        import cv2
+        import queue
+
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise FileNotFoundError(f"无法打开视频: {source}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        os.makedirs(output_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(source))[0]
+        writer = None
+        if self.args.video_save:
+            writer = cv2.VideoWriter(os.path.join(output_dir, f"{stem}_pose.mp4"),
+                                     cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        tracks_path = os.path.join(output_dir, f"{stem}_tracks.jsonl")
+
+        queues = [queue.Queue(maxsize=VIDEO_QUEUE_SIZE) for _ in range(3)]
+        self.start_time = time.time()
+        with open(tracks_path, 'w', encoding='utf-8') as tracks_file:
+            threads = [
+                threading.Thread(target=self._run_stage, args=("decode", lambda q: self._decode(cap, q), queues[0]), daemon=True),
+                threading.Thread(target=self._run_stage, args=("inference", self._infer, queues[0], queues[1]), daemon=True),
+                threading.Thread(target=self._run_stage, args=("tracking", self._track, queues[1], queues[2]), daemon=True),
+                threading.Thread(target=self._run_stage, args=("writer", lambda q: self._write(q, writer, tracks_file), queues[2]), daemon=True),
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        cap.release()
+        if writer is not None:
+            writer.release()
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return {**self.stage_summary(), "tracks": tracks_path, "source_fps": fps}
+
+def run_video_inference(args):
+    """视频入口：多线程流水线推理并输出轨迹 (JSONL) 与可选的标注视频"""
+    source = os.path.abspath(args.video)
+    print(f"🎬 视频推理: {source}", flush=True)
+    pipeline = VideoInferencePipeline(YOLO(args.model), args)
+    summary = pipeline.run(source, os.path.join(args.project, args.name, 'video'))
+    log_json({"event": "video_complete", **summary})
+    print(f"✅ 视频推理完成: {summary['frames']} 帧 (推理 {summary['inferred_frames']}, 跳过 {summary['skipped_frames']}), {summary['wall_fps']} FPS", flush=True)
+    for name, fps in summary["stage_fps"].items():
+        print(f"   {name:<10} {fps:8.1f} FPS{'  ⬅ 瓶颈' if name == summary['bottleneck'] else ''}", flush=True)
+    return summary
+
+# ultralytics 检测/姿态流水线中各变换对应的增强参数
+AUGMENT_TRANSFORM_PARAMS = {
+    'Mosaic': ['mosaic'],
+    'CopyPaste': ['copy_paste'],
+    'RandomPerspective': ['degrees', 'translate', 'scale', 'shear', 'perspective'],
+    'MixUp': ['mixup'],
+    'RandomHSV': ['hsv_h', 'hsv_s', 'hsv_v'],
+    'RandomFlip': ['fliplr', 'flipud'],
+}
+
+def _flatten_transforms(transform):
+    inner = getattr(transform, 'transforms', None)
+    if isinstance(inner, list):
+        return [t for sub in inner for t in _flatten_transforms(sub)]
+    return [transform]
+
+def profile_augmentations(args):
+    """数据增强耗时分析：在真实训练图片上逐个变换计时，估算当前 workers 下的吞吐"""
+    from ultralytics.cfg import get_cfg
+    from ultralytics.data import build_yolo_dataset
+    from ultralytics.data.utils import check_det_dataset
+
+    abs_data_path = os.path.abspath(args.data)
+    augment_params = build_augment_params(args)
+
+    cfg = get_cfg(overrides={
+        'task': 'pose',
+        'mode': 'train',
+        'data': abs_data_path,
+        'imgsz': args.imgsz,
+        'rect': args.rect,
+        **augment_params
+    })
+    data = check_det_dataset(abs_data_path)
+    dataset = build_yolo_dataset(cfg, data['train'], args.batch, data, mode='train')
+
+    transforms = _flatten_transforms(dataset.transforms)
+    names = [f"{i:02d}_{type(t).__name__}" for i, t in enumerate(transforms)]
+
+    sample_count = min(args.profile_samples, len(dataset))
+    indices = random.Random(0).sample(range(len(dataset)), sample_count)
+    print(f"⏱️ 数据增强耗时分析: {sample_count} 张图片, {len(transforms)} 个变换, imgsz={args.imgsz}", flush=True)
+
+    load_times = []
+    transform_times = {name: [] for name in names}
+    for idx in indices:
+        t0 = time.perf_counter()
+        labels = dataset.get_image_and_label(idx)
+        load_times.append((time.perf_counter() - t0) * 1000)
+
+        for name, transform in zip(names, transforms):
+            t0 = time.perf_counter()
+            labels = transform(labels)
+            transform_times[name].append((time.perf_counter() - t0) * 1000)
+
+    stages = [("00_load_decode", "LoadImage", load_times)]
+    stages += [(name, type(t).__name__, transform_times[name]) for name, t in zip(names, transforms)]
+    per_image_ms = sum(float(np.mean(times)) for _, _, times in stages)
+
+    breakdown = []
+    for name, cls_name, times in stages:
+        mean_ms = float(np.mean(times))
+        breakdown.append({
+            "stage": name,
+            "params": {k: augment_params[k] for k in AUGMENT_TRANSFORM_PARAMS.get(cls_name, [])},
+            "mean_ms": round(mean_ms, 3),
+            "p95_ms": round(float(np.percentile(times, 95)), 3),
+            "share": round(mean_ms / per_image_ms, 4) if per_image_ms > 0 else 0.0
         })
-        
-        return False
-    
-    print(f"\n✅ 所有检查通过 ({passed_count}/{total_count})", flush=True)
-    print("="*50 + "\n", flush=True)
-    
-    if warnings:
+
+    # 检测/姿态流水线不使用 erasing / crop_fraction (仅分类任务生效)
+    active = {p for params in AUGMENT_TRANSFORM_PARAMS.values() for p in params}
+    inactive = [k for k in augment_params if k not in active]
+
+    # ultralytics 实际 worker 数: min(cpu_count, workers)；workers=0 时在主进程加载
+    effective_workers = max(1, min(os.cpu_count() or 1, args.workers))
+    single_ips = 1000.0 / per_image_ms if per_image_ms > 0 else 0.0
+
+    report = {
+        "event": "augment_profile",
+        "samples": sample_count,
+        "imgsz": args.imgsz,
+        "per_image_ms": round(per_image_ms, 3),
+        "stages": breakdown,
+        "inactive_params": inactive,
+        "workers": args.workers,
+        "est_images_per_sec_single": round(single_ips, 1),
+        "est_images_per_sec": round(single_ips * effective_workers, 1),
+        "est_batches_per_sec": round(single_ips * effective_workers / max(args.batch, 1), 2)
+    }
+
+    out_dir = os.path.join(args.project, args.name)
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'augment_profile.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log_json(report)
+
+    print(f"   每张图片: {per_image_ms:.2f}ms", flush=True)
+    for item in sorted(breakdown, key=lambda x: x["mean_ms"], reverse=True):
+        print(f"   {item['stage']:<28} {item['mean_ms']:8.2f}ms  {item['share'] * 100:5.1f}%", flush=True)
+    if inactive:
+        print(f"   ℹ️ 以下参数在姿态训练中不生效: {', '.join(inactive)}", flush=True)
+    print(f"   预计吞吐 (workers={args.workers}): {report['est_images_per_sec']} 张/秒", flush=True)
+    return report
+
+class PostTrainStage:
+    """训练后流水线的一个阶段。fn(ctx) 返回可 JSON 序列化的结果，返回 None 视为失败且不缓存；
+    resources 中的资源同一时间只允许一个阶段占用，'exclusive' 表示运行时不与任何阶段并发"""
+
+    def __init__(self, name, fn, deps=(), resources=(), config=None, cache=True, is_valid=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.resources = tuple(resources)
+        self.config = config or {}
+        self.cache = cache
+        self.is_valid = is_valid
+
+    def cache_key(self, dep_keys):
+        import hashlib
+        payload = json.dumps({
+            "stage": self.name,
+            "config": self.config,
+            "deps": {d: dep_keys[d] for d in self.deps}
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    def cache_path(self, cache_dir, key):
+        return os.path.join(cache_dir, self.name, f"{key}.json")
+
+    def load(self, cache_dir, key):
+        entry = _read_json(self.cache_path(cache_dir, key), None)
+        if entry is None or (self.is_valid is not None and not self.is_valid(entry["result"])):
+            return None
+        return entry
+
+def _run_stage_captured(stage, ctx):
+    _log_capture.events = []
+    try:
+        start = time.time()
+        result = stage.fn(ctx)
+        return result, _log_capture.events, time.time() - start
+    finally:
+        _log_capture.events = None
+
+def run_stage_graph(stages, ctx, cache_dir):
+    """按依赖关系执行阶段：依赖全部成功且资源空闲即启动，互不依赖的阶段并发运行。
+    结果按 (阶段配置, 上游结果键) 缓存在 cache_dir，命中时只重放当时的事件。
+    某个阶段失败只跳过它的下游，其余阶段照常完成并写入缓存，最后再抛出第一个异常"""
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    by_name = {s.name: s for s in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"阶段 {stage.name} 依赖未知阶段 {dep}")
+
+    pending = [s.name for s in stages]
+    status, keys, results, errors = {}, {}, {}, []
+    running = {}
+    saved_s = 0.0
+    start_all = time.time()
+
+    def finish(stage, state, key=None, result=None, elapsed=0.0):
+        status[stage.name] = state
+        if key is not None:
+            keys[stage.name] = key
+            results[stage.name] = result
         log_json({
-            "event": "validation_passed_with_warnings",
-            "passed": passed_count,
-            "total": total_count,
-            "warnings": warnings
+            "event": "post_train_stage",
+            "stage": stage.name,
+            "status": state,
+            "key": key,
+            "time_s": round(elapsed, 2)
         })
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as pool:
+        while pending or running:
+            progressed = False
+            for name in list(pending):
+                stage = by_name[name]
+                dep_states = [status.get(d) for d in stage.deps]
+                if any(state in ('failed', 'skipped') for state in dep_states):
+                    pending.remove(name)
+                    progressed = True
+                    finish(stage, 'skipped')
+                    continue
+                if not all(state in ('completed', 'cached') for state in dep_states):
+                    continue
+
+                key = stage.cache_key(keys) if stage.cache else None
+                entry = stage.load(cache_dir, key) if stage.cache else None
+                if entry is not None:
+                    for event in entry["events"]:
+                        log_json({**event, "cached": True})
+                    pending.remove(name)
+                    progressed = True
+                    saved_s += entry["time_s"]
+                    print(f"♻️ 训练后阶段 {name}: 使用缓存结果", flush=True)
+                    finish(stage, 'cached', key, entry["result"])
+                    continue
+                if should_stop:
+                    continue
+
+                held = {r for s, _ in running.values() for r in s.resources}
+                if 'exclusive' in stage.resources:
+                    if running:
+                        # 独占阶段排队时不再启动新阶段，等当前阶段结束后单独运行
+                        break
+                elif 'exclusive' in held or held & set(stage.resources):
+                    continue
+                pending.remove(name)
+                progressed = True
+                running[pool.submit(_run_stage_captured, stage, ctx)] = (stage, key)
+                if 'exclusive' in stage.resources:
+                    break
+
+            if not running:
+                if progressed:
+                    continue
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = running.pop(future)
+                try:
+                    result, events, elapsed = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    print(f"❌ 训练后阶段 {stage.name} 失败: {e}", file=sys.stderr)
+                    finish(stage, 'failed')
+                    continue
+                if result is None:
+                    finish(stage, 'failed', elapsed=elapsed)
+                    continue
+                if stage.cache:
+                    path = stage.cache_path(cache_dir, key)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_json_atomic(path, {
+                        "stage": stage.name,
+                        "key": key,
+                        "config": stage.config,
+                        "result": result,
+                        "events": events,
+                        "time_s": round(elapsed, 2),
+                        "created": time.strftime('%Y-%m-%d %H:%M:%S')
+                    })
+                else:
+                    key = hashlib.sha256(json.dumps(result, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+                finish(stage, 'completed', key, result, elapsed)
+
+    for name in pending:
+        finish(by_name[name], 'skipped')
+
+    log_json({
+        "event": "post_train_complete",
+        "stages": status,
+        "time_s": round(time.time() - start_all, 2),
+        "saved_s": round(saved_s, 2)
+    })
+    ran = sum(1 for state in status.values() if state == 'completed')
+    print(f"🧩 训练后阶段完成: 执行 {ran} 个，缓存命中 {sum(1 for s in status.values() if s == 'cached')} 个 "
+          f"(节省约 {saved_s:.0f}s)，耗时 {time.time() - start_all:.1f}s", flush=True)
+    if errors:
+        raise errors[0]
+    return results
+
+def _val_set_digest(data_yaml):
+    """data.yaml 内容与验证集图片/标签的哈希，验证集变化时相关阶段的缓存失效"""
+    import hashlib
+    h = hashlib.sha256()
+    with open(data_yaml, 'rb') as f:
+        h.update(f.read())
+    _hash_split_contents(h, list_split_images(resolve_split_path(load_data_config(data_yaml), 'val')))
+    return h.hexdigest()[:16]
+
+def _stage_weights(ctx):
+    if not os.path.isfile(ctx["best_model_path"]):
+        raise FileNotFoundError(f"找不到训练权重: {ctx['best_model_path']}")
+    return {"sha256": weights_hash(ctx["best_model_path"])}
+
+def _stage_gpu_summary(ctx):
+    if gpu_monitor is None:
+        return {"available": False}
+    gpu_summary = gpu_monitor.get_summary()
+    log_json({
+        "event": "gpu_summary",
+        **gpu_summary
+    })
+    return {"available": True, **gpu_summary}
+
+def _stage_benchmark(ctx):
+    global performance_benchmark
+    args = ctx["args"]
+
+    print("⏱️ 开始性能基准测试...", flush=True)
+    performance_benchmark = PerformanceBenchmark(
+        model=YOLO(ctx["best_model_path"]),
+        device=args.device,
+        imgsz=args.imgsz
+    )
+    with profile_benchmark(args, os.path.join(ctx["run_dir"], 'profile')):
+        performance_benchmark.measure_inference_latency(num_runs=30, warmup=3)
+    performance_benchmark.measure_throughput(batch_sizes=[1, 2, 4], num_runs=20)
+
+    perf_summary = performance_benchmark.get_summary()
+    log_json({
+        "event": "performance_benchmark",
+        **perf_summary
+    })
+    print(f"   实时FPS: {perf_summary['realtime_fps']} {'✅ 满足实时要求' if perf_summary['meets_realtime_requirement'] else '⚠️ 未达实时要求'}")
+    return perf_summary
+
+def _stage_validate(ctx):
+    print("🔍 正在执行模型验证...")
+    return validate_model(YOLO(ctx["best_model_path"]), ctx["args"], ctx["best_model_path"])
+
+def _stage_keypoints(ctx):
+    args = ctx["args"]
+    model = YOLO(ctx["best_model_path"])
+
+    print("📊 正在计算关键点细分误差...")
+    if args.prediction_store:
+        store = load_prediction_store(build_prediction_store(model, ctx["best_model_path"], ctx["abs_data_path"], args))
+        keypoint_metrics = {
+            "event": "per_keypoint_metrics",
+            "prediction_store": store["dir"],
+            "keypoints": rescore_prediction_store(store)["keypoints"]
+        }
     else:
-        log_json({
-            "event": "validation_passed",
-            "passed": passed_count,
-            "total": total_count
-        })
-    
-    return True
+        keypoint_metrics = get_per_keypoint_metrics(model, ctx["abs_data_path"], args.device)
+    log_json(keypoint_metrics)
+    return keypoint_metrics
+
+def _stage_export(ctx):
+    print("📦 正在导出模型...")
+    result = export_model(YOLO(ctx["best_model_path"]), ctx["args"], ctx["best_model_path"])
+    # 有格式导出失败时不缓存，--post_train 会重试
+    if result is None or result["failed_count"] > 0:
+        return None
+    return result
+
+def build_post_train_stages(args, abs_data_path):
+    """训练后阶段的依赖图：全部依赖权重哈希；基准测试独占运行，
+    验证与关键点分析共用推理设备，导出只占 CPU，可与验证并发"""
+    import platform
+
+    val_digest = _val_set_digest(abs_data_path)
+    device = 'cpu' if args.device == 'cpu' else f"device:{args.device}"
+    stages = [
+        PostTrainStage("weights", _stage_weights, cache=False),
+        PostTrainStage("gpu_summary", _stage_gpu_summary, deps=("weights",)),
+        PostTrainStage("benchmark", _stage_benchmark, deps=("weights",), resources=("exclusive",),
+                       config={"device": args.device, "imgsz": args.imgsz, "host": platform.node()}),
+        PostTrainStage("validate", _stage_validate, deps=("weights",), resources=(device,),
+                       config={"data": val_digest, "batch": args.batch, "imgsz": args.imgsz, "device": args.device}),
+        PostTrainStage("keypoints", _stage_keypoints, deps=("weights",), resources=(device,),
+                       config={"data": val_digest, "imgsz": args.imgsz, "device": args.device,
+                               "prediction_store": bool(args.prediction_store)})
+    ]
+    if args.export_formats:
+        formats = args.export_formats.split(',') if isinstance(args.export_formats, str) else args.export_formats
+        stages.append(PostTrainStage(
+            "export", _stage_export, deps=("weights",), resources=("cpu",),
+            config={"formats": sorted(f.strip().lower() for f in formats)},
+            is_valid=lambda result: all(os.path.exists(p) for p in result["exported"])
+        ))
+    return stages
+
+def run_post_training(args, best_model_path, abs_data_path, run_dir):
+    ctx = {
+        "args": args,
+        "best_model_path": best_model_path,
+        "abs_data_path": abs_data_path,
+        "run_dir": run_dir
+    }
+    return run_stage_graph(build_post_train_stages(args, abs_data_path), ctx,
+                           os.path.join(run_dir, POST_TRAIN_CACHE_DIR))
+
+def post_train(args):
+    """--post_train：不训练，只对 <project>/<name> 的 best.pt 重跑训练后阶段，缓存有效的阶段直接复用"""
+    run_dir = os.path.join(args.project, args.name)
+    best_model_path = os.path.join(run_dir, 'weights', 'best.pt')
+    abs_data_path = os.path.abspath(args.data)
+    if not os.path.exists(abs_data_path):
+        raise FileNotFoundError(f"找不到配置文件: {abs_data_path}")
+    print(f"🧩 重跑训练后阶段: {best_model_path}", flush=True)
+    return run_post_training(args, best_model_path, abs_data_path, run_dir)
 
 def train_model(args):
-    global gpu_monitor, visual_validator, performance_benchmark
+    global gpu_monitor, visual_validator, control_channel, stop_timeout
+    stop_timeout = args.stop_timeout
     
     try:
         if not args.skip_validation:
@@ -1246,6 +5867,8 @@ def train_model(args):
         else:
             print("⚠️ 已跳过飞行前检查 (--skip-validation)", flush=True)
         
+        if args.resume:
+            restart_if_stopped_in_first_epoch(args)
         if not args.resume:
             resume_info = check_resume_available(args)
             if resume_info["available"]:
@@ -1259,8 +5882,7 @@ def train_model(args):
                 print("\n如需从上次中断处继续训练，请添加 --resume 参数", flush=True)
                 print("="*60 + "\n", flush=True)
         
-        monitor_thread = threading.Thread(target=parent_monitor_thread, daemon=True)
-        monitor_thread.start()
+        start_parent_monitor()
         
         hw_info = detect_hardware()
         log_json({
@@ -1282,10 +5904,32 @@ def train_model(args):
         if not os.path.exists(abs_data_path):
             raise FileNotFoundError(f"找不到配置文件: {abs_data_path}")
 
+        if args.normalize_images and not args.resume:
+            abs_data_path = normalize_dataset(args, abs_data_path)
+            args.data = abs_data_path
+
+        run_dir = os.path.join(args.project, args.name)
+        # blob 与 weights/*.pt 共享 inode，且不设只读以免实验自身无法续训；
+        # 不论本次是否指定 --weights_store，写入前都先断开链接
+        detach_weights(run_dir)
+
+        incremental_plan = None
+        if args.incremental_from and not args.resume:
+            incremental_plan = prepare_incremental_dataset(args, abs_data_path)
+            if not incremental_plan["changed_count"]:
+                print("✅ 自上次训练以来数据集没有变化，无需增量训练", flush=True)
+                log_json({"event": "incremental_skipped", "reason": "no_changes"})
+                return
+            args.model = incremental_plan["base_weights"]
+
         print(f"🚀 开始加载模型: {args.model}")
         print(f"📂 数据集路径: {abs_data_path}")
 
         model = YOLO(args.model)
+
+        cpu_plan = None
+        if args.cpu_optimize and args.device == 'cpu':
+            cpu_plan = configure_cpu_training(model, args)
         
         device_id = 0
         if args.device != 'cpu':
@@ -1317,29 +5961,55 @@ def train_model(args):
 
         model.add_callback("on_train_start", on_train_start)
         model.add_callback("on_train_epoch_end", on_train_epoch_end)
+        model.add_callback("on_train_batch_end", on_train_batch_end_check_stop)
+        model.add_callback("on_fit_epoch_end", on_fit_epoch_end_check_stop)
+
+        if args.control:
+            control_channel = ControlChannel(abs_data_path, args.device)
+            if args.control == 'stdin':
+                control_channel.start_stdin()
+            else:
+                control_channel.start_socket(int(args.control))
+            model.add_callback("on_train_batch_end", control_channel.on_train_batch_end)
+            model.add_callback("on_train_epoch_end", control_channel.on_train_epoch_end)
+            model.add_callback("on_fit_epoch_end", control_channel.on_fit_epoch_end)
+        if args.profile:
+            training_profiler = TrainingProfiler(os.path.join(run_dir, 'profile'), args.profile_start_iter,
+                                                 args.profile_iters, args.profile_top, use_cuda=args.device != 'cpu')
+            model.add_callback("on_train_batch_start", training_profiler.on_train_batch_start)
+            model.add_callback("on_train_batch_end", training_profiler.on_train_batch_end)
+            model.add_callback("on_train_end", training_profiler.on_train_end)
+        if args.simulate_oom_epoch >= 0:
+            model.add_callback("on_train_epoch_start", simulate_oom_callback(args.simulate_oom_epoch))
+
+        resize_scheduler = None
+        if args.imgsz_schedule:
+            resize_scheduler = ProgressiveResizeScheduler(
+                parse_imgsz_schedule(args.imgsz_schedule, args.imgsz), args.imgsz
+            )
+            model.add_callback("on_train_epoch_start", resize_scheduler.on_train_epoch_start)
+            model.add_callback("on_train_epoch_end", resize_scheduler.on_train_epoch_end)
+            model.add_callback("on_train_end", resize_scheduler.on_train_end)
+            print(f"📐 渐进分辨率计划: {resize_scheduler.phases}", flush=True)
 
         if args.resume:
             print("🔄 正在恢复中断的训练...")
             log_json({"event": "resume", "message": "Resuming training"})
-            model.train(resume=True)
+            trainer_cls = make_packed_trainer(args.packed_dataset) if args.packed_dataset else None
+            if args.aspect_buckets > 0:
+                trainer_cls = make_bucketed_trainer(args.aspect_buckets, trainer_cls)
+            if args.distill_teacher:
+                # 教师缓存按权重哈希复用，续训不会重新推理
+                trainer_cls = make_distill_trainer(build_teacher_cache(args, abs_data_path), args, trainer_cls)
+            if args.importance_sampling:
+                trainer_cls = make_importance_trainer(args, trainer_cls)
+            if cpu_plan:
+                trainer_cls = make_cpu_optimized_trainer(cpu_plan, trainer_cls)
+            if resize_scheduler:
+                trainer_cls = make_progressive_trainer(resize_scheduler, trainer_cls)
+            results, model = train_with_oom_recovery(model, {'resume': True}, args, trainer_cls)
         else:
-            augment_params = {
-                'degrees': args.degrees,
-                'translate': args.translate,
-                'scale': args.scale,
-                'shear': args.shear,
-                'perspective': args.perspective,
-                'fliplr': args.fliplr,
-                'flipud': args.flipud,
-                'hsv_h': args.hsv_h,
-                'hsv_s': args.hsv_s,
-                'hsv_v': args.hsv_v,
-                'mosaic': args.mosaic,
-                'mixup': args.mixup,
-                'copy_paste': args.copy_paste,
-                'erasing': args.erasing,
-                'crop_fraction': args.crop_fraction,
-            }
+            augment_params = build_augment_params(args)
 
             print(f"📊 数据增强配置:")
             for k, v in augment_params.items():
@@ -1374,58 +6044,81 @@ def train_model(args):
             if hasattr(args, 'loss_cls'):
                 training_params['cls'] = args.loss_cls
 
+            if incremental_plan is not None:
+                training_params['data'] = incremental_plan["data_yaml"]
+                training_params['epochs'] = args.incremental_epochs
+                training_params['warmup_epochs'] = 0
+
             print(f"📊 训练配置:")
             for k, v in training_params.items():
                 if k not in augment_params:
                     print(f"   {k}: {v}")
 
-            results = model.train(**training_params)
+            # 清单要对每张图片做哈希，只在增量训练或显式要求时生成，供之后的 --incremental_from 比对
+            if incremental_plan is not None or args.save_manifest:
+                try:
+                    manifest = incremental_plan["manifest"] if incremental_plan else build_dataset_manifest(
+                        abs_data_path, previous=_read_json(os.path.join(run_dir, DATASET_MANIFEST_FILE), None)
+                    )
+                    save_dataset_manifest(manifest, run_dir)
+                except Exception as e:
+                    print(f"⚠️ 写入数据清单失败（不影响训练）: {e}", flush=True)
+
+            trainer_cls = make_packed_trainer(args.packed_dataset) if args.packed_dataset else None
+            if args.aspect_buckets > 0:
+                if args.rect:
+                    print("⚠️ 已指定 --rect，忽略 --aspect_buckets", flush=True)
+                elif args.mosaic > 0:
+                    print("⚠️ 宽高比分桶与 rect 训练一样会关闭 mosaic 增强", flush=True)
+                trainer_cls = make_bucketed_trainer(args.aspect_buckets, trainer_cls)
+            if args.distill_teacher:
+                teacher_cache_dir = build_teacher_cache(args, abs_data_path)
+                trainer_cls = make_distill_trainer(teacher_cache_dir, args, trainer_cls)
+            if args.importance_sampling:
+                if args.importance_warmup >= training_params['epochs']:
+                    print(f"⚠️ --importance_warmup={args.importance_warmup} 不小于训练轮数，重要性采样不会生效", flush=True)
+                trainer_cls = make_importance_trainer(args, trainer_cls)
+            if cpu_plan:
+                trainer_cls = make_cpu_optimized_trainer(cpu_plan, trainer_cls)
+            if resize_scheduler:
+                trainer_cls = make_progressive_trainer(resize_scheduler, trainer_cls)
+
+            train_start_time = time.time()
+            results, model = train_with_oom_recovery(model, training_params, args, trainer_cls)
+            train_time_s = time.time() - train_start_time
+
+        if should_stop:
+            raise TrainingStopped(stop_reason)
+        if control_channel is not None:
+            control_channel.stop()
 
         best_model_path = os.path.join(args.project, args.name, 'weights', 'best.pt')
         print(f"✅ 训练完成！最佳模型已保存至: {best_model_path}")
+        if args.weights_store:
+            intern_weights(run_dir, args.weights_store)
+        visual_validator.model = model
         
         if gpu_monitor is not None:
             gpu_monitor.stop_monitoring()
-            gpu_summary = gpu_monitor.get_summary()
-            log_json({
-                "event": "gpu_summary",
-                **gpu_summary
-            })
-        
-        print("⏱️ 开始性能基准测试...", flush=True)
-        performance_benchmark = PerformanceBenchmark(
-            model=model,
-            device=args.device,
-            imgsz=args.imgsz
-        )
-        
-        latency_results = performance_benchmark.measure_inference_latency(num_runs=30, warmup=3)
-        throughput_results = performance_benchmark.measure_throughput(batch_sizes=[1, 2, 4], num_runs=20)
-        
-        perf_summary = performance_benchmark.get_summary()
-        log_json({
-            "event": "performance_benchmark",
-            **perf_summary
-        })
-        
-        print(f"   实时FPS: {perf_summary['realtime_fps']} {'✅ 满足实时要求' if perf_summary['meets_realtime_requirement'] else '⚠️ 未达实时要求'}")
-        
+
         log_json({
             "event": "train_complete",
             "best_model": best_model_path
         })
+
+        run_post_training(args, best_model_path, abs_data_path, run_dir)
+        if should_stop:
+            raise TrainingStopped(stop_reason)
+
+        if incremental_plan is not None:
+            report_incremental_delta(incremental_plan, best_model_path, args, train_time_s)
         
-        print("🔍 正在执行模型验证...")
-        validation_result = validate_model(model, args, best_model_path)
-        
-        print("📊 正在计算关键点细分误差...")
-        keypoint_metrics = get_per_keypoint_metrics(model, abs_data_path, args.device)
-        log_json(keypoint_metrics)
-        
-        if hasattr(args, 'export_formats') and args.export_formats:
-            print("📦 正在导出模型...")
-            export_results = export_model(model, args, best_model_path)
-        
+    except TrainingStopped:
+        print("🛑 训练已停止", flush=True)
+        if gpu_monitor is not None:
+            gpu_monitor.stop_monitoring()
+        sys.exit(STOP_EXIT_CODE)
+
     except Exception as e:
         error_msg = str(e)
         print(f"❌ 训练过程中发生错误: {e}", file=sys.stderr)
@@ -1437,6 +6130,211 @@ def train_model(args):
         log_json(friendly_error)
         sys.exit(1)
 
+class ModelCache:
+    """按 (绝对路径, mtime) 缓存已加载的 YOLO 模型，超出容量时淘汰最久未使用的"""
+
+    def __init__(self, max_size=3):
+        from collections import OrderedDict
+        self.max_size = max_size
+        self.models = OrderedDict()
+
+    def get(self, model_path):
+        key = os.path.abspath(model_path) if os.path.exists(model_path) else model_path
+        key = (key, os.path.getmtime(key) if os.path.exists(key) else None)
+        if key in self.models:
+            self.models.move_to_end(key)
+            return self.models[key], True
+        model = YOLO(model_path)
+        self.models[key] = model
+        while len(self.models) > self.max_size:
+            self.models.popitem(last=False)
+            _free_memory()
+        return model, False
+
+def _cached_model(args, cache, timings):
+    start = time.time()
+    model, hit = cache.get(args.model)
+    timings["model_load_s"] = round(time.time() - start, 3)
+    timings["cache_hit"] = hit
+    return model
+
+def _job_train(args, cache, timings):
+    if args.control == 'stdin':
+        # worker 的 stdin 用于任务流，训练任务不能再占用
+        args.control = ''
+    train_model(args)
+
+def _job_val(args, cache, timings):
+    model = _cached_model(args, cache, timings)
+    if validate_model(model, args, args.model) is None:
+        raise RuntimeError("模型验证失败")
+
+def _job_benchmark(args, cache, timings):
+    model = _cached_model(args, cache, timings)
+    benchmark = PerformanceBenchmark(model=model, device=args.device, imgsz=args.imgsz)
+    with profile_benchmark(args, os.path.join(args.project, args.name, 'profile')):
+        benchmark.measure_inference_latency(num_runs=30, warmup=3)
+    benchmark.measure_throughput(batch_sizes=[1, 2, 4], num_runs=20)
+    log_json({"event": "performance_benchmark", **benchmark.get_summary()})
+
+def _job_export(args, cache, timings):
+    model = _cached_model(args, cache, timings)
+    result = export_model(model, args, args.model)
+    if result is None or not result["success_count"]:
+        raise RuntimeError("模型导出失败")
+
+def _job_predict(args, cache, timings):
+    model = _cached_model(args, cache, timings)
+    source = getattr(args, 'source', None)
+    if not source:
+        raise ValueError("predict 任务需要 source 参数")
+    count = 0
+    start = time.time()
+    for result in model.predict(source, imgsz=args.imgsz, device=args.device, conf=getattr(args, 'conf', 0.25),
+                                stream=True, verbose=False):
+        boxes, conf, kpts = _result_arrays(result)
+        log_json({
+            "event": "prediction",
+            "image": result.path,
+            "boxes": np.round(boxes, 2).tolist(),
+            "conf": np.round(conf, 4).tolist(),
+            "keypoints": np.round(kpts, 2).tolist()
+        })
+        count += 1
+    timings["images"] = count
+    timings["ms_per_image"] = round((time.time() - start) / max(count, 1) * 1000, 2)
+
+WORKER_JOBS = {
+    "train": _job_train,
+    "val": _job_val,
+    "benchmark": _job_benchmark,
+    "export": _job_export,
+    "predict": _job_predict
+}
+
+def build_job_args(parser, job):
+    """任务参数：argv 按命令行解析（与单次启动 train.py 相同），args 字典再逐项覆盖"""
+    job_args = parser.parse_args([str(a) for a in job.get("argv", [])])
+    for key, value in job.get("args", {}).items():
+        setattr(job_args, key, value)
+    return job_args
+
+def cancel_job(job_id):
+    """worker 模式：job_id 对应的任务（未指定时为当前任务）仍在运行才请求停止，返回被取消的任务 id。
+    与任务的开始/结束共用一把锁，已结束任务的 cancel 不会波及下一个任务"""
+    with _job_lock:
+        running = current_job_id
+        if running is None or job_id not in (None, running):
+            return None
+        request_stop("cancel")
+        return running
+
+def run_worker_job(job, parser, cache):
+    """执行单个任务，失败（包括 sys.exit）只影响本任务"""
+    global current_job_id, gpu_monitor, visual_validator, performance_benchmark, control_channel, viz_interval
+
+    with _job_lock:
+        current_job_id = str(job.get("id") or f"job_{int(time.time() * 1000)}")
+    job_type = job.get("type")
+    gpu_monitor = visual_validator = performance_benchmark = control_channel = None
+    viz_interval = 5
+    timings = {"queue_wait_s": round(time.time() - job.get("_received", time.time()), 3)}
+    status, error = "completed", None
+
+    log_json({"event": "job_started", "type": job_type})
+    start = time.time()
+    try:
+        if job_type not in WORKER_JOBS:
+            raise ValueError(f"未知任务类型: {job_type}")
+        WORKER_JOBS[job_type](build_job_args(parser, job), cache, timings)
+    except SystemExit as e:
+        if e.code == STOP_EXIT_CODE:
+            status = "stopped"
+        elif e.code not in (0, None):
+            status, error = "failed", f"exit code {e.code}"
+    except Exception as e:
+        status, error = "failed", str(e)
+        print(f"❌ 任务 {current_job_id} 失败: {e}", file=sys.stderr)
+        log_json(format_user_friendly_error(str(e)))
+    finally:
+        if gpu_monitor is not None:
+            gpu_monitor.stop_monitoring()
+        if control_channel is not None:
+            control_channel.stop()
+        _free_memory()
+
+    timings["time_s"] = round(time.time() - start, 3)
+    log_json({"event": f"job_{status}", "type": job_type, "status": status, "error": error, "timings": timings})
+    print(f"{'✅' if status == 'completed' else '⚠️'} 任务 {current_job_id} ({job_type}) {status}，耗时 {timings['time_s']:.1f}s", flush=True)
+    with _job_lock:
+        current_job_id = None
+    return status
+
+def _read_worker_jobs(jobs):
+    """后台读取 stdin 上的任务流；cancel 命令立即生效，不排队"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            log_json({"event": "job_rejected", "error": f"无效的 JSON: {e}"})
+            continue
+        if job.get("type") == "cancel":
+            cancelled = cancel_job(job.get("id"))
+            log_json({"event": "job_cancel", "id": job.get("id"), "cancelled": cancelled})
+            continue
+        job["_received"] = time.time()
+        jobs.put(job)
+    jobs.put(None)
+
+def run_worker(parser, args):
+    """常驻 worker：复用已导入的 torch/ultralytics 与模型缓存，逐行接收 JSON 任务。
+    SIGTERM / 父进程退出在当前任务停止后结束 worker；cancel 只停止当前任务"""
+    import queue
+
+    start_parent_monitor()
+    cache = ModelCache(args.worker_cache_size)
+    jobs = queue.Queue()
+    threading.Thread(target=_read_worker_jobs, args=(jobs,), daemon=True).start()
+
+    log_json({
+        "event": "worker_ready",
+        "pid": os.getpid(),
+        "startup_s": round(time.time() - psutil.Process().create_time(), 2),
+        "job_types": sorted(WORKER_JOBS)
+    })
+    summary = {}
+    while True:
+        try:
+            job = jobs.get(timeout=1.0)
+        except queue.Empty:
+            # cancel 只针对任务，空闲时不应结束 worker
+            if should_stop and stop_reason != "cancel":
+                break
+            continue
+        if job is None or job.get("type") == "shutdown":
+            break
+        status = run_worker_job(job, parser, cache)
+        summary[status] = summary.get(status, 0) + 1
+        if stop_reason is not None and stop_reason != "cancel":
+            break
+        reset_stop_state()
+
+    log_json({"event": "worker_exit", "jobs": summary, "reason": stop_reason or "shutdown"})
+    if stop_reason is not None and stop_reason != "cancel":
+        sys.exit(STOP_EXIT_CODE)
+
+def run_tool(tool_fn, args):
+    """独立工具模式入口：与训练一致地输出结构化错误"""
+    try:
+        return tool_fn(args)
+    except Exception as e:
+        print(f"❌ 执行 {tool_fn.__name__} 时发生错误: {e}", file=sys.stderr)
+        log_json(format_user_friendly_error(str(e)))
+        sys.exit(1)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train YOLOv8-Pose for Fish Keypoints')
 
@@ -1456,8 +6354,28 @@ if __name__ == "__main__":
     parser.add_argument('--cos_lr', action='store_true', help='Use cosine LR scheduler')
     parser.add_argument('--optimizer', type=str, default='auto', help='Optimizer (auto, SGD, Adam, AdamW)')
     parser.add_argument('--rect', action='store_true', help='Use rectangular training')
+    parser.add_argument('--aspect_buckets', type=int, default=0, help='Group training images into up to N aspect-ratio buckets with shuffled, padding-minimal batches (0 = off)')
 
     parser.add_argument('--resume', action='store_true', help='Resume most recent training')
+    parser.add_argument('--distill_teacher', type=str, default='', help='Teacher pose model for distillation (e.g. yolov8m-pose.pt); predictions are cached once')
+    parser.add_argument('--distill_cache', type=str, default='', help='Teacher prediction cache dir (default: .teacher_cache next to data.yaml)')
+    parser.add_argument('--distill_alpha', type=float, default=0.3, help='Weight of the distillation loss term computed against cached teacher predictions (labels are not modified)')
+    parser.add_argument('--distill_kpt_conf', type=float, default=0.2, help='Teacher keypoints below this confidence are ignored; above it the confidence weights the keypoint in the distillation term')
+    parser.add_argument('--distill_box_conf', type=float, default=0.25, help='Teacher detections below this confidence are ignored; above it the confidence weights the instance in the distillation term')
+    parser.add_argument('--oom_recovery', action='store_true', help='On OOM, lower batch then imgsz along a ladder and resume from last.pt')
+    parser.add_argument('--oom_batch_ladder', type=str, default='', help='Batch sizes to try on OOM, e.g. "8,4,2,1" (default: halve down to 1)')
+    parser.add_argument('--oom_imgsz_ladder', type=str, default='', help='Image sizes to try once batch is exhausted, e.g. "960,640" (default: 0.75x, 0.5x)')
+    parser.add_argument('--simulate_oom_epoch', type=int, default=-1, help='Testing: raise MemoryError once at the start of this 0-based epoch')
+    parser.add_argument('--importance_sampling', action='store_true', help='After warmup, train each epoch on images sampled in proportion to their last loss (unbiased reweighting)')
+    parser.add_argument('--importance_warmup', type=int, default=30, help='Full epochs before loss-aware sampling starts')
+    parser.add_argument('--importance_fraction', type=float, default=0.5, help='Images drawn per sampled epoch, as a fraction of the training set')
+    parser.add_argument('--importance_floor', type=float, default=0.2, help='Share of sampling probability spread uniformly, so every image keeps at least floor/N')
+    parser.add_argument('--imgsz_schedule', type=str, default='', help='Progressive resolution, e.g. "640:0.3,960:0.6" (size:end-fraction); final phase uses --imgsz')
+
+    parser.add_argument('--incremental_from', type=str, default='', help='Previous run dir to incrementally fine-tune from (uses its best.pt and dataset manifest)')
+    parser.add_argument('--save_manifest', action='store_true', help='Write a dataset manifest (content hashes) to the run dir so a later --incremental_from can diff against it')
+    parser.add_argument('--replay_ratio', type=float, default=1.0, help='Replayed old images per new/changed image in incremental mode')
+    parser.add_argument('--incremental_epochs', type=int, default=20, help='Epochs for incremental fine-tuning')
 
     parser.add_argument('--degrees', type=float, default=180.0, help='Rotation range')
     parser.add_argument('--translate', type=float, default=0.2, help='Translation fraction')
@@ -1480,6 +6398,42 @@ if __name__ == "__main__":
     parser.add_argument('--erasing', type=float, default=0.4, help='Random erasing probability')
     parser.add_argument('--crop_fraction', type=float, default=1.0, help='Crop fraction')
     
+    parser.add_argument('--control', type=str, default='', help='Live control channel: "stdin" or a localhost TCP port for line-delimited JSON commands')
+    parser.add_argument('--profile', action='store_true', help='Capture a torch profiler trace and sampled Python stacks for a window of training iterations and the inference benchmark')
+    parser.add_argument('--profile_start_iter', type=int, default=10, help='Training iteration at which profiling starts (skips warmup)')
+    parser.add_argument('--profile_iters', type=int, default=20, help='Number of training iterations to profile')
+    parser.add_argument('--profile_top', type=int, default=15, help='Hot operators / functions listed in the profile_ready event')
+    parser.add_argument('--worker', action='store_true', help='Stay running and execute line-delimited JSON jobs (train/val/benchmark/export/predict) from stdin')
+    parser.add_argument('--worker_cache_size', type=int, default=3, help='Loaded models kept in the worker LRU cache')
+    parser.add_argument('--normalize_images', action='store_true', help='Before training, build a mirror dataset with EXIF-applied, downscaled, re-encoded images')
+    parser.add_argument('--normalize_dir', type=str, default='', help='Mirror dataset directory (default: next to data.yaml)')
+    parser.add_argument('--normalize_max_side', type=int, default=0, help='Longest image side in the mirror (0 = largest training imgsz)')
+    parser.add_argument('--normalize_quality', type=int, default=95, help='JPEG quality for re-encoded images')
+    parser.add_argument('--normalize_workers', type=int, default=0, help='Threads for normalization (0 = CPU count)')
+    parser.add_argument('--pack_dataset', type=str, default='', help='Tool mode: pack data.yaml splits into large shard files under this directory (incremental)')
+    parser.add_argument('--pack_shard_mb', type=int, default=256, help='Target shard size in MB for --pack_dataset')
+    parser.add_argument('--pack_rebuild', action='store_true', help='Repack from scratch instead of appending changed images')
+    parser.add_argument('--packed_dataset', type=str, default='', help='Read training/val images and labels from a --pack_dataset directory')
+    parser.add_argument('--prediction_store', type=str, default='', help='Directory caching raw val predictions per (weights, val set, imgsz)')
+    parser.add_argument('--rescore', action='store_true', help='Tool mode: recompute val metrics of --model from --prediction_store at new thresholds')
+    parser.add_argument('--rescore_conf', type=float, default=0.001, help='Confidence threshold for --rescore')
+    parser.add_argument('--rescore_iou', type=float, default=0.7, help='NMS IoU threshold for --rescore')
+    parser.add_argument('--rescore_kpt_conf', type=float, default=0.5, help='Keypoint confidence counted as visible for --rescore')
+    parser.add_argument('--sweep', action='store_true', help='Tool mode: sweep conf/IoU/keypoint-conf grids over --prediction_store')
+    parser.add_argument('--sweep_conf', type=str, default='0.001,0.05,0.1,0.15,0.2,0.25,0.3,0.4,0.5,0.6,0.7', help='Comma-separated confidence thresholds')
+    parser.add_argument('--sweep_iou', type=str, default='0.3,0.4,0.5,0.6,0.7,0.8', help='Comma-separated NMS IoU thresholds')
+    parser.add_argument('--sweep_kpt_conf', type=str, default='0,0.25,0.5,0.75', help='Comma-separated keypoint confidence thresholds')
+    parser.add_argument('--sweep_target_precision', type=float, default=0.0, help='Pick the highest-recall point with at least this precision')
+    parser.add_argument('--sweep_target_recall', type=float, default=0.0, help='Pick the highest-precision point with at least this recall')
+    parser.add_argument('--imgsz_sweep', type=str, default='', help='Tool mode: evaluate --model at these inference sizes, e.g. "640,960,1280"')
+    parser.add_argument('--imgsz_tolerance', type=float, default=0.01, help='Pose mAP50-95 drop allowed when recommending the smallest imgsz')
+    parser.add_argument('--imgsz_latency_images', type=int, default=20, help='Val images timed for CPU latency at each size')
+    parser.add_argument('--weights_store', type=str, default='', help='Content-addressed weights store; weights/*.pt become links to deduplicated blobs')
+    parser.add_argument('--weights_gc', action='store_true', help='Tool mode: delete blobs in --weights_store no experiment references')
+    parser.add_argument('--copy_experiment', type=str, default='', help='Tool mode: copy <project>/<this> to <project>/<name>, sharing weight blobs')
+    parser.add_argument('--post_train', action='store_true', help='Tool mode: rerun only the post-training stages for <project>/<name>/weights/best.pt, reusing cached results')
+    parser.add_argument('--cpu_optimize', action='store_true', help='On CPU: split physical cores between workers and compute, use channels_last and bf16 autocast when supported')
+    parser.add_argument('--stop_timeout', type=float, default=60.0, help='Seconds allowed for a graceful stop before forcing exit')
     parser.add_argument('--skip_validation', action='store_true', help='Skip pre-flight validation check')
     
     parser.add_argument('--export_formats', type=str, default='', help='Auto-export formats after training (e.g., "onnx,tflite,torchscript")')
@@ -1488,6 +6442,73 @@ if __name__ == "__main__":
     parser.add_argument('--loss_box', type=float, default=7.5, help='Box loss weight')
     parser.add_argument('--loss_cls', type=float, default=0.5, help='Class loss weight')
 
+    parser.add_argument('--rank_unlabeled', type=str, default='', help='Rank an unlabeled image dir by model uncertainty (active learning) and exit')
+    parser.add_argument('--rank_batch', type=int, default=16, help='Batch size for uncertainty scoring')
+    parser.add_argument('--rank_top_k', type=int, default=0, help='Keep only the top-K most uncertain images in the manifest (0 = all)')
+
+    parser.add_argument('--dedup', action='store_true', help='Detect near-duplicate images (pHash), report train/val leakage and exit')
+    parser.add_argument('--dedup_threshold', type=int, default=6, help='Max Hamming distance between pHashes to count as near-duplicate')
+
+    parser.add_argument('--profile_augment', action='store_true', help='Profile per-transform augmentation cost on real training images and exit')
+    parser.add_argument('--profile_samples', type=int, default=64, help='Number of training images to sample for augmentation profiling')
+
+    parser.add_argument('--prune', action='store_true', help='Prune channels of best.pt, fine-tune each candidate and report the CPU latency / pose mAP Pareto set, then exit')
+    parser.add_argument('--prune_weights', type=str, default='', help='Weights to prune (default: <project>/<name>/weights/best.pt)')
+    parser.add_argument('--prune_ratios', type=str, default='0.2,0.35,0.5', help='Comma-separated global channel pruning ratios')
+    parser.add_argument('--prune_target_gflops', type=float, default=0.0, help='FLOPs budget; adds a searched ratio that meets it (0 = off)')
+    parser.add_argument('--prune_target_latency_ms', type=float, default=0.0, help='CPU latency budget used to gate candidates (0 = off)')
+    parser.add_argument('--prune_finetune_epochs', type=int, default=10, help='Recovery fine-tune epochs per pruned candidate')
+    parser.add_argument('--prune_latency_runs', type=int, default=30, help='CPU latency measurement runs per candidate')
+
+    parser.add_argument('--sliced_predict', type=str, default='', help='Run tiled inference on an image file/dir and exit')
+    parser.add_argument('--sliced_val', action='store_true', help='Compare tiled vs whole-frame inference on the val split and exit')
+    parser.add_argument('--tile_size', type=int, default=0, help='Tile size for sliced inference (0 = --imgsz)')
+    parser.add_argument('--tile_overlap', type=float, default=0.2, help='Overlap fraction between adjacent tiles')
+    parser.add_argument('--tile_batch', type=int, default=8, help='Tiles per inference batch')
+    parser.add_argument('--tile_conf', type=float, default=0.25, help='Confidence threshold for sliced inference')
+    parser.add_argument('--tile_merge_oks', type=float, default=0.5, help='OKS threshold for merging detections across tile seams')
+    parser.add_argument('--tile_full_frame', action='store_true', help='Also run a downscaled whole-frame pass and merge it with the tiles')
+
+    parser.add_argument('--video', type=str, default='', help='Run the threaded video inference/tracking pipeline on a video file and exit')
+    parser.add_argument('--video_batch', type=int, default=4, help='Frames per inference batch in the video pipeline')
+    parser.add_argument('--video_save', action='store_true', help='Write an annotated video next to the tracks file')
+    parser.add_argument('--video_log_interval', type=int, default=100, help='Emit video_progress every N frames')
+    parser.add_argument('--motion_threshold', type=float, default=0.01, help='Mean frame difference below which inference is skipped and interpolated')
+    parser.add_argument('--max_skip', type=int, default=2, help='Max consecutive frames to skip on low motion (0 = never skip)')
+    parser.add_argument('--smooth_alpha', type=float, default=0.6, help='Temporal smoothing factor for tracked keypoints (1 = no smoothing)')
+    parser.add_argument('--track_max_age', type=int, default=5, help='Drop a track after N inferred frames without a match')
+
     args = parser.parse_args()
 
-    train_model(args)
+    if args.worker:
+        run_worker(parser, args)
+    elif args.rank_unlabeled:
+        run_tool(rank_unlabeled_images, args)
+    elif args.dedup:
+        run_tool(detect_near_duplicates, args)
+    elif args.profile_augment:
+        run_tool(profile_augmentations, args)
+    elif args.prune:
+        run_tool(prune_and_finetune, args)
+    elif args.sliced_predict:
+        run_tool(sliced_predict, args)
+    elif args.sliced_val:
+        run_tool(sliced_validate, args)
+    elif args.video:
+        run_tool(run_video_inference, args)
+    elif args.rescore:
+        run_tool(rescore_predictions, args)
+    elif args.sweep:
+        run_tool(threshold_sweep, args)
+    elif args.pack_dataset:
+        run_tool(pack_dataset, args)
+    elif args.imgsz_sweep:
+        run_tool(imgsz_pareto_sweep, args)
+    elif args.weights_gc:
+        run_tool(gc_weights_store, args)
+    elif args.copy_experiment:
+        run_tool(copy_experiment, args)
+    elif args.post_train:
+        run_tool(post_train, args)
+    else:
+        train_model(args)